@@ -0,0 +1,86 @@
+"""
+Compare embedding encoders on throughput and on drift from a reference encoder.
+
+Sentences come from the role descriptions and global prompt in examples/sjt.json, so the
+workload matches what MessagePool embeds. Every candidate is timed on the same sentences.
+Its vectors are compared row by row with the reference vectors. Drift is only reported
+when the two encoders share a dimension, e.g. "onnx-int8:<dir>" against its source model.
+
+Usage:
+    python benchmarks/encoders.py --reference all-mpnet-base-v2 \
+        --candidates onnx-int8:exports/all-mpnet-base-v2 hashing
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, ROOT_DIR)
+
+from chatarena import EXAMPLES_DIR  # noqa: E402
+from chatarena.embeddings import load_encoder  # noqa: E402
+
+
+def load_sentences(limit: int):
+    with open(os.path.join(EXAMPLES_DIR, "sjt.json"), encoding="utf-8") as f:
+        config = json.load(f)
+    texts = [config["global_prompt"]] + [player["role_desc"] for player in config["players"]]
+    sentences = [
+        sentence.strip()
+        for text in texts
+        for sentence in re.split(r"[。\n；！？]", text)
+        if len(sentence.strip()) > 4
+    ]
+    # Repeat the corpus to reach the requested size
+    return [sentences[i % len(sentences)] + ("" if i < len(sentences) else f" #{i}") for i in range(limit)]
+
+
+def time_encoder(encoder, sentences, batch_size: int, repeat: int):
+    encoder.encode(sentences[:batch_size], batch_size=batch_size)  # warm up
+    best = float("inf")
+    vectors = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        vectors = np.asarray(encoder.encode(sentences, batch_size=batch_size), dtype=np.float32)
+        best = min(best, time.perf_counter() - start)
+    return len(sentences) / best, vectors
+
+
+def cosine_rows(a, b):
+    a = a / np.clip(np.linalg.norm(a, axis=1, keepdims=True), 1e-12, None)
+    b = b / np.clip(np.linalg.norm(b, axis=1, keepdims=True), 1e-12, None)
+    return (a * b).sum(axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--reference", default="all-mpnet-base-v2", help="reference encoder spec")
+    parser.add_argument("--candidates", nargs="*", default=["hashing"], help="encoder specs to compare")
+    parser.add_argument("--sentences", type=int, default=256, help="number of sentences to encode")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per encoder; the best is kept")
+    args = parser.parse_args()
+
+    sentences = load_sentences(args.sentences)
+    reference = load_encoder(args.reference)
+    ref_rate, ref_vectors = time_encoder(reference, sentences, args.batch_size, args.repeat)
+
+    print(f"{'encoder':50s} {'sent/s':>9s} {'speedup':>8s} {'mean cos':>9s} {'min cos':>8s}")
+    print(f"{args.reference:50s} {ref_rate:9.1f} {1.0:8.2f} {'-':>9s} {'-':>8s}")
+    for spec in args.candidates:
+        rate, vectors = time_encoder(load_encoder(spec), sentences, args.batch_size, args.repeat)
+        if vectors.shape == ref_vectors.shape:
+            cos = cosine_rows(vectors, ref_vectors)
+            drift = f"{cos.mean():9.4f} {cos.min():8.4f}"
+        else:
+            drift = f"{'n/a':>9s} {'n/a':>8s}"
+        print(f"{spec:50s} {rate:9.1f} {rate / ref_rate:8.2f} {drift}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Measure the cold-start cost of importing chatarena.
+
+Each measurement runs in a fresh interpreter so that nothing is cached in sys.modules.
+It reports the wall time and peak RSS of the import, and whether torch or
+sentence_transformers were pulled in. The baseline imports torch and
+sentence_transformers directly; before they were loaded lazily, that was the minimum
+cost of `import chatarena.message`.
+
+Usage:
+    python benchmarks/import_time.py [--repeat 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if sys.platform == "darwin":
+    rss_kb //= 1024
+print(json.dumps({{
+    "seconds": elapsed,
+    "rss_mb": rss_kb / 1024,
+    "torch": "torch" in sys.modules,
+    "sentence_transformers": "sentence_transformers" in sys.modules,
+}}))
+"""
+
+TARGETS = {
+    "chatarena.message": "import chatarena.message",
+    "chatarena.arena": "import chatarena.arena",
+    "baseline: torch + sentence_transformers": "import torch, sentence_transformers",
+}
+
+
+def measure(statement: str):
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(statement=statement)],
+        cwd=ROOT_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        return None
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="number of cold imports per target")
+    args = parser.parse_args()
+
+    print(f"{'target':45s} {'median s':>9s} {'rss MiB':>8s}  heavy deps loaded")
+    for name, statement in TARGETS.items():
+        runs = [measure(statement) for _ in range(args.repeat)]
+        runs = [run for run in runs if run is not None]
+        if not runs:
+            print(f"{name:45s} {'failed (missing dependency?)':>20s}")
+            continue
+        heavy = [dep for dep in ("torch", "sentence_transformers") if runs[0][dep]]
+        print(
+            f"{name:45s} {statistics.median(r['seconds'] for r in runs):9.3f} "
+            f"{statistics.median(r['rss_mb'] for r in runs):8.1f}  {', '.join(heavy) or 'none'}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+End-to-end throughput of the SJT pipeline against the local stand-in server.
+
+Starts chatarena.devserver on a free port, points the OpenAI client at it and runs the
+batch mode of run_sjt.py over synthetic self-reports. It reports items/minute, the number
+of LLM requests and tokens the server saw, and the status codes returned (injected
+429/5xx included). No API key or network access is needed, so every throughput change
+can be measured the same way.
+
+Usage:
+    python benchmarks/pipeline.py --items 50 --concurrency 8 --latency-median 1.0 --error-rate-429 0.02
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, ROOT_DIR)
+
+from chatarena.devserver import StandInModel, start_in_thread  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--items", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-median", type=float, default=0.5)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--error-rate-429", type=float, default=0.0)
+    parser.add_argument("--error-rate-5xx", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    model = StandInModel(
+        latency_median=args.latency_median,
+        latency_sigma=args.latency_sigma,
+        error_rate_429=args.error_rate_429,
+        error_rate_5xx=args.error_rate_5xx,
+        seed=args.seed,
+    )
+    server, base_url = start_in_thread(model)
+    # The OpenAI clients are created when the backend module is imported, so set these first
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "stand-in")
+    import run_sjt
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config = run_sjt.load_sjt_config()
+        config["embeddings"] = "off"
+        config_path = os.path.join(tmp, "sjt.json")
+        with open(config_path, "w", encoding="utf-8") as f:
+            json.dump(config, f, ensure_ascii=False)
+        input_path = os.path.join(tmp, "input.jsonl")
+        with open(input_path, "w", encoding="utf-8") as f:
+            for i in range(args.items):
+                f.write(json.dumps({"id": i, "self_report": f"我是一个做事认真、喜欢和人交流的人。（样本 {i}）"},
+                                   ensure_ascii=False) + "\n")
+
+        start = time.monotonic()
+        asyncio.run(run_sjt.run_batch(input_path, os.path.join(tmp, "output.jsonl"), config_path=config_path,
+                                      concurrency=args.concurrency, resume=False))
+        elapsed = time.monotonic() - start
+    server.shutdown()
+
+    stats = model.stats
+    print(json.dumps({
+        "items": args.items,
+        "concurrency": args.concurrency,
+        "seconds": round(elapsed, 2),
+        "items_per_minute": round(args.items / elapsed * 60, 1),
+        **stats,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -69,8 +69,9 @@ class Player(Agent):
             global_prompt=self.global_prompt,
         )
 
-    def act(self, observation: List[Message], message_pool=None, question_pool=None) -> str:
-
+    def act(self, observation: List[Message], message_pool=None, question_pool=None, stream_callback=None) -> str:
+        # 只在需要流式输出时传 stream_callback，其他后端的 query 不必认识这个参数
+        stream_kwargs = {"stream_callback": stream_callback} if stream_callback is not None else {}
         try:
             response = self.backend.query(
                 agent_name=self.name,
@@ -79,7 +80,7 @@ class Player(Agent):
                 ques=question_pool,
                 global_prompt=self.global_prompt,
                 msgs=message_pool,
-
+                **stream_kwargs,
             )
         except RetryError as e:
             err_msg = f"Agent {self.name} failed to generate a response. Error: {e.last_attempt.exception()}. Sending signal to end the conversation."
@@ -88,10 +89,10 @@ class Player(Agent):
 
         return response
 
-    def __call__(self, observation, message_pool, question_pool):
-        return self.act(observation, message_pool, question_pool)
+    def __call__(self, observation, message_pool, question_pool, stream_callback=None):
+        return self.act(observation, message_pool, question_pool, stream_callback=stream_callback)
 
-    async def async_act(self, observation: List[Message]) -> str:
+    async def async_act(self, observation: List[Message], message_pool=None, question_pool=None) -> str:
         """
         Async version of act().
 
@@ -99,17 +100,20 @@ class Player(Agent):
 
         Parameters:
             observation (List[Message]): The messages that the player has observed from the environment.
+            message_pool (MessagePool): The message pool of the environment.
+            question_pool (QuestionPool): The reflection questions of the environment.
 
         Returns:
             str: The action (response) of the player.
         """
         try:
-            response = self.backend.async_query(
+            response = await self.backend.async_query(
                 agent_name=self.name,
                 role_desc=self.role_desc,
                 history_messages=observation,
+                ques=question_pool,
                 global_prompt=self.global_prompt,
-                request_msg=None,
+                msgs=message_pool,
             )
         except RetryError as e:
             err_msg = f"Agent {self.name} failed to generate a response. Error: {e.last_attempt.exception()}. Sending signal to end the conversation."
@@ -1,7 +1,11 @@
+import asyncio
+import contextvars
 import csv
+import functools
 import json
 import logging
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Union
 
 from .agent import Player
@@ -9,11 +13,17 @@ from .backends import Human
 from .config import ArenaConfig
 from .environments import Environment, TimeStep, load_environment
 from .message import Message, MessagePool
+from .metrics import metrics_labels
 
 class TooManyInvalidActions(Exception):
     pass
 
 
+def _player_callback(stream_callback, player_name: str):
+    # Arena callbacks also get the player name; backends call back with (phase, text)
+    return functools.partial(stream_callback, player_name) if stream_callback is not None else None
+
+
 class Arena:
     """Utility class that manages the game environment and players."""
 
@@ -28,6 +38,7 @@ class Arena:
         self.current_timestep = environment.reset()
         self.uuid = uuid.uuid4()  # Generate a unique id for the game
         self.invalid_actions_retry = 5
+        self._executor = None  # thread pool for parallel steps, created on first use
         message = Message(agent_name="Moderator", content="SJT题目开始生成!", turn=-1, visible_to="None")
         self.environment.message_pool.append_message_at_index(message, 0)
         for player in players:
@@ -51,10 +62,156 @@ class Arena:
             player.reset()
         # Reset the uuid
         self.uuid = uuid.uuid4()
+        self._shutdown_executor()
         return self.current_timestep
 
-    def step(self) -> TimeStep:
-        """Take a step in the game: one player takes an action and the environment updates."""
+    def close(self):
+        """Stop the parallel-step thread pool and close the message pool."""
+        self._shutdown_executor()
+        self.environment.message_pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _shutdown_executor(self):
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def _is_parallel(self) -> bool:
+        return getattr(self.environment, "parallel", False) and hasattr(
+            self.environment, "get_next_players"
+        )
+
+    def _act_with_retries(self, player_name: str, observation, stream_callback=None) -> str:
+        """Let a player act until it produces a valid action, without touching the environment."""
+        player = self.name_to_player[player_name]
+        for i in range(self.invalid_actions_retry):
+            action = player(
+                observation, self.environment.message_pool, self.environment.question_pool,
+                stream_callback=_player_callback(stream_callback, player_name),
+            )
+            if self.environment.check_action(action, player_name):
+                return action
+            logging.warning(f"{player_name} made an invalid action {action}")
+
+        warning_msg = f"{player_name} has made invalid actions for {self.invalid_actions_retry} times. Terminating the game."
+        logging.warning(warning_msg)
+        raise TooManyInvalidActions(warning_msg)
+
+    async def _async_act_with_retries(self, player_name: str, observation) -> str:
+        """Async version of _act_with_retries()."""
+        player = self.name_to_player[player_name]
+        for i in range(self.invalid_actions_retry):
+            action = await player.async_act(
+                observation, self.environment.message_pool, self.environment.question_pool
+            )
+            if self.environment.check_action(action, player_name):
+                return action
+            logging.warning(f"{player_name} made an invalid action {action}")
+
+        warning_msg = f"{player_name} has made invalid actions for {self.invalid_actions_retry} times. Terminating the game."
+        logging.warning(warning_msg)
+        raise TooManyInvalidActions(warning_msg)
+
+    def _commit_actions(self, player_names: List[str], actions: List[str]) -> TimeStep:
+        """Apply the actions of a parallel step to the environment in player order."""
+        timesteps = [
+            self.environment.step(player_name, action)
+            for player_name, action in zip(player_names, actions)
+        ]
+        timestep = timesteps[-1]
+        timestep.terminal = any(t.terminal for t in timesteps)
+        return timestep
+
+    def parallel_step(self, stream_callback=None) -> TimeStep:
+        """
+        Take a step in which every player of the current turn acts concurrently.
+
+        The players' observations only cover earlier turns, so they do not depend on each
+        other. Actions are computed on a thread pool, each player retrying its own invalid
+        actions, and then committed to the environment in player order so that the
+        message pool is the same as with serial stepping.
+        """
+        player_names = self.environment.get_next_players()
+        observations = [self.environment.get_observation(name) for name in player_names]
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.num_players, thread_name_prefix="Arena"
+            )
+        futures = [
+            self._executor.submit(
+                contextvars.copy_context().run, self._act_with_retries, name, observation, stream_callback
+            )
+            for name, observation in zip(player_names, observations)
+        ]
+        actions = [future.result() for future in futures]
+        return self._commit_actions(player_names, actions)
+
+    async def async_parallel_step(self) -> TimeStep:
+        """Async version of parallel_step(): the players' queries run concurrently on the event loop."""
+        player_names = self.environment.get_next_players()
+        observations = [self.environment.get_observation(name) for name in player_names]
+        actions = await asyncio.gather(
+            *[
+                self._async_act_with_retries(name, observation)
+                for name, observation in zip(player_names, observations)
+            ]
+        )
+        return self._commit_actions(player_names, list(actions))
+
+    def step(self, stream_callback=None) -> TimeStep:
+        """
+        Take a step in the game: one player takes an action and the environment updates.
+
+        With `stream_callback`, backends that support streaming call
+        stream_callback(player_name, phase, text) as the action is generated.
+        """
+        with metrics_labels(arena=self.uuid):  # LLM call metrics are aggregated per arena
+            return self._step(stream_callback)
+
+    def _step(self, stream_callback=None) -> TimeStep:
+        if self._is_parallel():
+            return self.parallel_step(stream_callback)
+        player_name = self.environment.get_next_player()
+        player = self.name_to_player[player_name]  # get the player object
+        observation = self.environment.get_observation(
+            player_name
+        )  # get the observation for the player
+
+        timestep = None
+        for i in range(self.invalid_actions_retry):  # try to take an action for a few times
+            action = player(
+                observation, self.environment.message_pool, self.environment.question_pool,
+                stream_callback=_player_callback(stream_callback, player_name),
+            )  # take an action
+            if self.environment.check_action(action, player_name):
+                timestep = self.environment.step(player_name, action)  # update the environment
+                break
+            else:
+                self.environment.message_pool.pop_message()
+                self.environment.message_pool.pop_message()
+                logging.warning(f"{player_name} made an invalid action {action}")
+                continue
+
+        if timestep is None:  # if the player made invalid actions for too many times, terminate the game
+            warning_msg = f"{player_name} has made invalid actions for {self.invalid_actions_retry} times. Terminating the game."
+            logging.warning(warning_msg)
+            raise TooManyInvalidActions(warning_msg)
+
+        return timestep
+
+    async def async_step(self) -> TimeStep:
+        """Async version of step(): the player's backend is queried without blocking the event loop."""
+        with metrics_labels(arena=self.uuid):
+            return await self._async_step()
+
+    async def _async_step(self) -> TimeStep:
+        if self._is_parallel():
+            return await self.async_parallel_step()
         player_name = self.environment.get_next_player()
         player = self.name_to_player[player_name]  # get the player object
         observation = self.environment.get_observation(
@@ -63,13 +220,15 @@ class Arena:
 
         timestep = None
         for i in range(self.invalid_actions_retry):  # try to take an action for a few times
-            action = player(observation, self.environment.message_pool, self.environment.question_pool)  # take an action
+            action = await player.async_act(
+                observation, self.environment.message_pool, self.environment.question_pool
+            )  # take an action
             if self.environment.check_action(action, player_name):
                 timestep = self.environment.step(player_name, action)  # update the environment
                 break
             else:
-                self.environment.message_pool._messages.pop()
-                self.environment.message_pool._messages.pop()
+                self.environment.message_pool.pop_message()
+                self.environment.message_pool.pop_message()
                 logging.warning(f"{player_name} made an invalid action {action}")
                 continue
 
@@ -93,6 +252,13 @@ class Arena:
             if timestep.terminal:
                 break
 
+    async def async_run(self, num_steps: int = 1):
+        """Async version of run(); many arenas can be driven concurrently on one event loop."""
+        for i in range(num_steps):
+            timestep = await self.async_step()
+            if timestep.terminal:
+                break
+
     @classmethod
     def from_config(cls, config: Union[str, ArenaConfig]):
         """Create an arena from a config."""
@@ -102,6 +268,7 @@ class Arena:
 
         global_prompt = config.get("global_prompt", None)
         request_msg = config.get("request_msg", None)
+        embeddings = config.get("embeddings", None)
         # Create the players
         players = []
         for player_config in config.players:
@@ -124,6 +291,8 @@ class Arena:
         config.environment[
             "player_names"
         ] = player_names  # add the player names to the environment config
+        if embeddings is not None:  # e.g. "embeddings": "off" for arenas that never use them
+            config.environment["embeddings"] = embeddings
         env = load_environment(config.environment)
 
         return cls(players, env, global_prompt=global_prompt)
@@ -177,7 +346,7 @@ class Arena:
                     message.content,
                     message.turn,
                     str(message.timestamp),
-                    message.visible_to,
+                    message.visibility,
                     message.msg_type,
                 ]
                 message_rows.append(message_row)
@@ -193,7 +362,7 @@ class Arena:
                     "content": message.content,
                     "turn": message.turn,
                     "timestamp": str(message.timestamp),
-                    "visible_to": message.visible_to,
+                    "visible_to": message.visibility,
                     "msg_type": message.msg_type,
                 }
                 message_rows.append(message_row)
@@ -1,5 +1,5 @@
 from ..config import BackendConfig
-from .base import BACKEND_REGISTRY, IntelligenceBackend, register_backend
+from .base import BACKEND_REGISTRY, IntelligenceBackend, StreamDelta, register_backend
 from .human import Human
 from .openai import OpenAIChat
 
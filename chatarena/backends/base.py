@@ -1,10 +1,101 @@
+import asyncio
+import contextvars
+import functools
+import queue
+import threading
 from abc import abstractmethod
-from typing import Dict, List, Type
+from typing import Callable, Dict, List, NamedTuple, Type
 
 from ..config import BackendConfig, Configurable
 from ..message import Message
 
 
+class StreamDelta(NamedTuple):
+    """A piece of generated text; `phase` names the request it belongs to (e.g. "answer")."""
+
+    phase: str
+    text: str
+
+
+# Called with (phase, text) for every piece of text as it is generated
+StreamCallback = Callable[[str, str], None]
+
+_DONE = object()
+
+
+def _final_text(result) -> str:
+    # query() may return (final_answer, round_records)
+    return result[0] if isinstance(result, tuple) else result
+
+
+class ResponseStream:
+    """
+    Iterator over the StreamDelta of one query, run on a background thread.
+
+    `result` holds the return value of query() once the iteration is exhausted. Backends
+    that do not stream produce a single "final" delta with the whole answer.
+    """
+
+    def __init__(self, run: Callable[[StreamCallback], object]):
+        self._run = run
+        self.result = None
+
+    def __iter__(self):
+        deltas = queue.Queue()
+        outcome = {}
+
+        def target():
+            try:
+                outcome["result"] = self._run(lambda phase, text: deltas.put(StreamDelta(phase, text)))
+            except BaseException as e:
+                outcome["error"] = e
+            finally:
+                deltas.put(_DONE)
+
+        threading.Thread(target=target, name="ResponseStream", daemon=True).start()
+        streamed = False
+        while True:
+            delta = deltas.get()
+            if delta is _DONE:
+                break
+            streamed = True
+            yield delta
+        if "error" in outcome:
+            raise outcome["error"]
+        self.result = outcome["result"]
+        if not streamed and self.result is not None:
+            yield StreamDelta("final", _final_text(self.result))
+
+
+class AsyncResponseStream:
+    """Async counterpart of ResponseStream: an async iterator driven by async_query() as a task."""
+
+    def __init__(self, run):
+        self._run = run
+        self.result = None
+
+    async def __aiter__(self):
+        deltas = asyncio.Queue()
+        task = asyncio.ensure_future(
+            self._run(lambda phase, text: deltas.put_nowait(StreamDelta(phase, text)))
+        )
+        task.add_done_callback(lambda _: deltas.put_nowait(_DONE))
+        streamed = False
+        try:
+            while True:
+                delta = await deltas.get()
+                if delta is _DONE:
+                    break
+                streamed = True
+                yield delta
+        finally:
+            if not task.done():
+                task.cancel()
+        self.result = task.result()
+        if not streamed and self.result is not None:
+            yield StreamDelta("final", _final_text(self.result))
+
+
 class IntelligenceBackend(Configurable):
     """An abstraction of the intelligence source of the agents."""
 
@@ -44,7 +135,6 @@ class IntelligenceBackend(Configurable):
     ) -> str:
         raise NotImplementedError
 
-    @abstractmethod
     async def async_query(
         self,
         agent_name: str,
@@ -55,8 +145,83 @@ class IntelligenceBackend(Configurable):
         *args,
         **kwargs,
     ) -> str:
-        """Async querying."""
-        raise NotImplementedError
+        """
+        Async querying.
+
+        Backends without a native async client run query() in the default executor so
+        that they do not block the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        # run_in_executor does not carry context variables (e.g. metrics labels) over to the thread
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            None,
+            functools.partial(
+                context.run,
+                self.query,
+                agent_name,
+                role_desc,
+                history_messages,
+                *args,
+                global_prompt=global_prompt,
+                request_msg=request_msg,
+                **kwargs,
+            ),
+        )
+
+    def stream(
+        self,
+        agent_name: str,
+        role_desc: str,
+        history_messages: List[Message],
+        global_prompt: str = None,
+        request_msg: Message = None,
+        *args,
+        **kwargs,
+    ) -> ResponseStream:
+        """
+        Streaming querying.
+
+        Returns an iterator of StreamDelta; its `result` is what query() would have returned.
+        Backends stream by calling the `stream_callback` keyword argument of query() with
+        (phase, text) as text is generated; the others yield their answer in one piece.
+        """
+        return ResponseStream(
+            lambda callback: self.query(
+                agent_name,
+                role_desc,
+                history_messages,
+                *args,
+                global_prompt=global_prompt,
+                request_msg=request_msg,
+                stream_callback=callback,
+                **kwargs,
+            )
+        )
+
+    def async_stream(
+        self,
+        agent_name: str,
+        role_desc: str,
+        history_messages: List[Message],
+        global_prompt: str = None,
+        request_msg: Message = None,
+        *args,
+        **kwargs,
+    ) -> AsyncResponseStream:
+        """Async version of stream(), driven by async_query()."""
+        return AsyncResponseStream(
+            lambda callback: self.async_query(
+                agent_name,
+                role_desc,
+                history_messages,
+                *args,
+                global_prompt=global_prompt,
+                request_msg=request_msg,
+                stream_callback=callback,
+                **kwargs,
+            )
+        )
 
     # reset the state of the backend
     def reset(self):
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+DEFAULT_RESPONSE_CACHE_CAPACITY = 1024
+# SQLite file of the on-disk tier and default time-to-live (seconds) of cached responses
+RESPONSE_CACHE_DB_ENV = "CHATARENA_LLM_CACHE_DB"
+RESPONSE_CACHE_TTL_ENV = "CHATARENA_LLM_CACHE_TTL"
+
+
+def request_key(request: dict) -> str:
+    """
+    Canonical hash of a chat completion request.
+
+    The request is serialized as JSON with sorted keys and no insignificant whitespace,
+    so two requests hash equally exactly when they would be sent with the same
+    parameters (model, temperature, max_tokens, stop, messages, ...).
+    """
+    canonical = json.dumps(request, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Cache of chat completion responses, keyed by the `request_key` of the full request.
+
+    Because the key covers every request parameter, a hit means the exact same request
+    (model, sampling settings, messages) was answered before. The cache stores whatever
+    it is given: callers decide which requests are cacheable; OpenAIChat only caches
+    when `cache_enabled`, i.e. at temperature 0 unless configured otherwise.
+
+    Responses live in an in-memory LRU of `capacity` entries. The least recently used
+    entry is evicted first, and evicted entries stay in the SQLite file when `db_path`
+    is set, so they, and the responses of earlier runs, are still found there and
+    moved back into the LRU. Each entry expires `ttl` seconds after it was stored
+    (never when None); an expired entry counts as a miss and is dropped from memory.
+    """
+
+    def __init__(
+        self,
+        capacity: int = DEFAULT_RESPONSE_CACHE_CAPACITY,
+        db_path: Optional[str] = None,
+        ttl: Optional[float] = None,
+    ):
+        self.capacity = capacity
+        self.db_path = db_path
+        self.ttl = ttl
+        # key -> (response, expires_at or None)
+        self._lru: "OrderedDict[str, Tuple[str, Optional[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path is not None:
+            directory = os.path.dirname(os.path.abspath(db_path))
+            os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL, expires_at REAL)"
+            )
+            self._db.commit()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    @property
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "size": len(self._lru),
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _remember(self, key: str, entry: Tuple[str, Optional[float]]):
+        self._lru[key] = entry
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.capacity:
+            self._lru.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for `key`, or None on a miss or an expired entry."""
+        now = time.time()
+        with self._lock:
+            entry = self._lru.get(key)
+            from_disk = False
+            if entry is None and self._db is not None:
+                row = self._db.execute(
+                    "SELECT response, expires_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    entry, from_disk = (row[0], row[1]), True
+            if entry is not None and entry[1] is not None and entry[1] <= now:
+                self._lru.pop(key, None)
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._remember(key, entry)
+            self.hits += 1
+            if from_disk:
+                self.disk_hits += 1
+            return entry[0]
+
+    def put(self, key: str, response: str, ttl: Optional[float] = None):
+        """Cache `response` under `key` in both tiers; `ttl` defaults to the cache's TTL."""
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        entry = (response, now + ttl if ttl is not None else None)
+        with self._lock:
+            self._remember(key, entry)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                    (key, response, now, entry[1]),
+                )
+                self._db.commit()
+
+    def purge_expired(self):
+        """Delete expired entries from both tiers."""
+        now = time.time()
+        with self._lock:
+            for key in [k for k, (_, expires_at) in self._lru.items() if expires_at is not None and expires_at <= now]:
+                del self._lru[key]
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+                self._db.commit()
+
+    def clear(self):
+        """
+        Forget the responses held in memory and reset the hit/miss counters.
+
+        Responses already written to the SQLite file are not deleted and will be served
+        again from disk; use `purge_expired` to remove stale ones.
+        """
+        with self._lock:
+            self._lru.clear()
+            self.hits = self.disk_hits = self.misses = self.expired = 0
+
+
+_CACHES: Dict[Optional[str], ResponseCache] = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def get_response_cache(db_path: Optional[str] = None) -> ResponseCache:
+    """
+    Return the response cache shared by every backend that uses `db_path`.
+
+    Backends sharing a cache answer each other's repeated requests. The path defaults to
+    CHATARENA_LLM_CACHE_DB; when neither is set, responses are only kept in memory and
+    are lost at exit. CHATARENA_LLM_CACHE_TTL gives the seconds after which a cached
+    response expires (no expiry when unset); it is read when the cache is first created.
+    """
+    if db_path is None:
+        db_path = os.environ.get(RESPONSE_CACHE_DB_ENV) or None
+    with _CACHES_LOCK:
+        cache = _CACHES.get(db_path)
+        if cache is None:
+            ttl = os.environ.get(RESPONSE_CACHE_TTL_ENV)
+            cache = ResponseCache(db_path=db_path, ttl=float(ttl) if ttl else None)
+            _CACHES[db_path] = cache
+        return cache
@@ -0,0 +1,108 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from ..embeddings import HashingEncoder
+from ..message import MODERATOR_NAME, SELF_REPORT_NAME, SYSTEM_NAME, Message, MessagePool
+from ..utils import estimate_tokens
+
+# Share of the budget given to the note summarizing the messages that did not fit
+SUMMARY_SHARE = 0.1
+SUMMARY_SNIPPET_CHARS = 40
+MAX_IMPORTANCE = 5
+# Weights of the ranking terms: importance (0-1), relevance (cosine) and recency (0-1)
+IMPORTANCE_WEIGHT = 1.0
+RELEVANCE_WEIGHT = 1.0
+RECENCY_WEIGHT = 0.5
+
+
+def message_tokens(message: Message) -> int:
+    """Estimated tokens of `message` in a prompt: "agent_name: content" plus message framing."""
+    return estimate_tokens(f"{message.agent_name}: {message.content}") + 5
+
+
+def is_pinned(message: Message) -> bool:
+    """
+    Messages that are always kept: the setup of the run and the instructions.
+
+    That is everything posted before the first turn (the moderator's role prompts), the
+    self-report, and system and moderator messages. Player outputs, which make up the bulk
+    of a long history, are the only messages that compete for the budget.
+    """
+    return message.turn < 0 or message.agent_name in (SELF_REPORT_NAME, SYSTEM_NAME, MODERATOR_NAME)
+
+
+def _relevance(messages: List[Message], query: Optional[str], msgs: Optional[MessagePool]) -> np.ndarray:
+    if not query or not messages:
+        return np.zeros(len(messages), dtype=np.float32)
+    if msgs is not None:
+        # Pool messages already have vectors in the pool's index: only the query is encoded
+        hits = msgs.search(query, k=len(messages), model_key="qa", candidates=messages)
+        if hits:
+            scores = {id(message): score for message, score in hits}
+            return np.array([scores.get(id(m), 0.0) for m in messages], dtype=np.float32)
+    # Embeddings are off or the messages are not in the pool: use cheap hashing vectors
+    vectors = HashingEncoder().encode([str(m.content) for m in messages] + [query])
+    return vectors[:-1] @ vectors[-1]
+
+
+def summarize_dropped(messages: List[Message], budget: int) -> Optional[str]:
+    """
+    Extractive note standing in for `messages`: who said what, one short snippet each,
+    newest first, until `budget` tokens are used.
+    """
+    if not messages or budget <= 0:
+        return None
+    header = f"（为控制长度，省略了 {len(messages)} 条较早或相关性较低的消息，摘要如下）"
+    lines, used = [], estimate_tokens(header)
+    for message in reversed(messages):
+        content = " ".join(str(message.content).split())
+        snippet = content[:SUMMARY_SNIPPET_CHARS] + ("…" if len(content) > SUMMARY_SNIPPET_CHARS else "")
+        line = f"- {message.agent_name}: {snippet}"
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget:
+            break
+        lines.append(line)
+        used += cost
+    return "\n".join([header] + lines[::-1])
+
+
+def select_context(
+    messages: List[Message],
+    budget: int,
+    query: Optional[str] = None,
+    msgs: Optional[MessagePool] = None,
+) -> Tuple[List[Message], Optional[str]]:
+    """
+    Choose the history messages that fit in `budget` estimated tokens.
+
+    Pinned messages (see is_pinned) are always kept. The others are ranked by
+    importance, embedding relevance to `query` and recency, and added best first while
+    they fit. A short extractive summary of the messages left out takes up to
+    SUMMARY_SHARE of the budget. Returns the kept messages in their original order and
+    the summary (None when everything fits).
+    """
+    if sum(message_tokens(m) for m in messages) <= budget:
+        return list(messages), None
+    pinned = [i for i, m in enumerate(messages) if is_pinned(m)]
+    others = [i for i, m in enumerate(messages) if not is_pinned(m)]
+    remaining = budget - sum(message_tokens(messages[i]) for i in pinned)
+    remaining -= int(budget * SUMMARY_SHARE)
+
+    candidates = [messages[i] for i in others]
+    relevance = _relevance(candidates, query, msgs)
+    scores = {}
+    for k, i in enumerate(others):
+        importance = min(getattr(messages[i], "importance", 1), MAX_IMPORTANCE) / MAX_IMPORTANCE
+        recency = (k + 1) / len(others)
+        scores[i] = IMPORTANCE_WEIGHT * importance + RELEVANCE_WEIGHT * float(relevance[k]) + RECENCY_WEIGHT * recency
+
+    kept = set(pinned)
+    for i in sorted(others, key=lambda i: -scores[i]):
+        cost = message_tokens(messages[i])
+        if cost <= remaining:
+            kept.add(i)
+            remaining -= cost
+    dropped = [messages[i] for i in others if i not in kept]
+    summary = summarize_dropped(dropped, remaining + int(budget * SUMMARY_SHARE))
+    return [messages[i] for i in sorted(kept)], summary
@@ -0,0 +1,230 @@
+import asyncio
+import contextvars
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures import wait
+from typing import Callable, Dict, Hashable, Optional
+
+from ..metrics import current_call
+
+DEFAULT_HEDGE_BUDGET = 0.05  # at most this fraction of requests may be duplicated
+DEFAULT_MIN_SAMPLES = 20  # latencies observed before hedging starts
+DEFAULT_MIN_DELAY = 0.5  # never hedge earlier than this many seconds
+LATENCY_WINDOW = 200
+
+
+class LatencyTracker:
+    """Sliding window of recent request latencies."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def percentile(self, q: float, min_samples: int = DEFAULT_MIN_SAMPLES) -> Optional[float]:
+        """The `q` quantile (0-1) of the window, or None until `min_samples` latencies are known."""
+        with self._lock:
+            if len(self._latencies) < min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class Hedger:
+    """
+    Hedged requests: if a request is slower than a percentile of recent latencies, send a
+    duplicate and use whichever finishes first.
+
+    Hedge one attempt at a time, with retries and scheduler waits outside: the latency
+    samples and the hedge delay must only measure the service time of a request. Latencies
+    are tracked separately for every key (e.g. the request phase, since answers,
+    reflections and revisions have very different lengths). The duplicates are capped at
+    `budget` times the number of requests, and `make_hedge` can refuse one, e.g. when the
+    scheduler has no free slot. The losing coroutine is cancelled. A losing thread cannot
+    be interrupted, so it runs to completion; the result of a loser that completes is passed
+    to `discard` (e.g. to account for its tokens). Hedges and hedge wins are counted here and
+    on the current call's metrics record.
+    """
+
+    def __init__(self, min_samples: int = DEFAULT_MIN_SAMPLES, min_delay: float = DEFAULT_MIN_DELAY):
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self._trackers: Dict[Hashable, LatencyTracker] = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.denied = 0
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "denied": self.denied,
+                "win_rate": self.hedge_wins / self.hedges if self.hedges else 0.0,
+            }
+
+    def _tracker(self, key: Hashable) -> LatencyTracker:
+        with self._lock:
+            tracker = self._trackers.get(key)
+            if tracker is None:
+                tracker = self._trackers[key] = LatencyTracker()
+            self.requests += 1
+            return tracker
+
+    def _delay(self, tracker: LatencyTracker, percentile: float) -> Optional[float]:
+        threshold = tracker.percentile(percentile, self.min_samples)
+        return max(threshold, self.min_delay) if threshold is not None else None
+
+    def _start_hedge(self, budget: float, make_hedge: Callable[[], Optional[Callable]]) -> Optional[Callable]:
+        """The duplicate to run, or None when the budget or `make_hedge` refuses one."""
+        with self._lock:
+            if self.hedges + 1 > budget * self.requests:
+                self.denied += 1
+                return None
+            self.hedges += 1  # reserve it, so that concurrent callers cannot overshoot the budget
+        hedge = make_hedge()
+        if hedge is None:
+            with self._lock:
+                self.hedges -= 1
+                self.denied += 1
+        return hedge
+
+    def _won(self, hedge_won: bool):
+        call = current_call()
+        if call is not None:
+            call.hedged = True
+            call.hedge_won = hedge_won
+        if hedge_won:
+            with self._lock:
+                self.hedge_wins += 1
+
+    def call(self, key: Hashable, fn: Callable[[], object], percentile: float,
+             budget: float = DEFAULT_HEDGE_BUDGET, make_hedge: Callable[[], Optional[Callable]] = None,
+             discard: Callable[[object], None] = None):
+        """
+        Run one attempt fn() on the calling thread's behalf, hedging it on a worker thread when it is slow.
+
+        `make_hedge` returns the duplicate to run (default: fn itself) or None to skip it.
+        Until the latency percentile is known fn() simply runs on the calling thread. After
+        that it runs on a worker so that a faster hedge can be returned without waiting for
+        it; the hedge delay counts from when fn() starts running, so time spent queued for
+        a worker never triggers a hedge.
+        """
+        tracker = self._tracker(key)
+        delay = self._delay(tracker, percentile)
+        if delay is None:
+            start = time.monotonic()
+            result = fn()
+            tracker.observe(time.monotonic() - start)
+            return result
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(thread_name_prefix="Hedger")
+        started = []
+        started_event = threading.Event()
+
+        def run_primary():
+            started.append(time.monotonic())
+            started_event.set()
+            return fn()
+
+        primary = self._executor.submit(contextvars.copy_context().run, run_primary)
+        started_event.wait()
+        start = started[0]
+        try:
+            result = primary.result(timeout=max(0.0, start + delay - time.monotonic()))
+        except FutureTimeoutError:
+            pass
+        else:
+            tracker.observe(time.monotonic() - start)
+            return result
+        hedge_fn = self._start_hedge(budget, make_hedge or (lambda: fn))
+        if hedge_fn is None:
+            result = primary.result()
+            tracker.observe(time.monotonic() - start)
+            return result
+        hedge = self._executor.submit(contextvars.copy_context().run, hedge_fn)
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = next((f for f in done if f.exception() is None), None)
+            if winner is not None:
+                tracker.observe(time.monotonic() - start)
+                self._won(winner is hedge)
+                loser = hedge if winner is primary else primary
+                if discard is not None:
+                    loser.add_done_callback(lambda f: f.exception() is None and discard(f.result()))
+                return winner.result()
+        return primary.result()  # both failed: raise the primary's error
+
+    async def async_call(self, key: Hashable, make_coro: Callable[[], object], percentile: float,
+                         budget: float = DEFAULT_HEDGE_BUDGET, make_hedge: Callable[[], Optional[Callable]] = None,
+                         discard: Callable[[object], None] = None):
+        """
+        Await one attempt make_coro(), starting a duplicate when it is slow and cancelling the loser.
+
+        `make_hedge` returns the coroutine function of the duplicate (default: make_coro) or
+        None to skip it. The loser has finished (usually cancelled) when this returns.
+        """
+        tracker = self._tracker(key)
+        delay = self._delay(tracker, percentile)
+        start = time.monotonic()
+        if delay is None:
+            result = await make_coro()
+            tracker.observe(time.monotonic() - start)
+            return result
+        primary = asyncio.ensure_future(make_coro())
+        hedge = winner = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            hedge_coro = None if done else self._start_hedge(budget, make_hedge or (lambda: make_coro))
+            if hedge_coro is None:
+                result = await primary
+                tracker.observe(time.monotonic() - start)
+                return result
+            hedge = asyncio.ensure_future(hedge_coro())
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((t for t in done if t.exception() is None), None)
+                if winner is not None:
+                    tracker.observe(time.monotonic() - start)
+                    self._won(winner is hedge)
+                    return winner.result()
+            return primary.result()  # both failed: raise the primary's error
+        finally:
+            losers = [task for task in (primary, hedge) if task is not None and not task.done()]
+            for task in losers:
+                task.cancel()
+            if losers:
+                # let the losers unwind (and give back their scheduler slots) before returning
+                await asyncio.wait(losers)
+            if discard is not None and winner is not None:
+                loser = hedge if winner is primary else primary
+                if not loser.cancelled() and loser.exception() is None:
+                    discard(loser.result())
+
+
+_HEDGERS: Dict[str, Hedger] = {}
+_HEDGERS_LOCK = threading.Lock()
+
+
+def get_hedger(key: str = "default") -> Hedger:
+    """Return the process-wide hedger for `key` (usually the model name)."""
+    with _HEDGERS_LOCK:
+        hedger = _HEDGERS.get(key)
+        if hedger is None:
+            hedger = _HEDGERS[key] = Hedger()
+        return hedger
@@ -1,14 +1,37 @@
+import asyncio
+import contextvars
+import difflib
+import functools
+import json
 import os
 import re
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from typing import List
+from typing import List, NamedTuple, Optional
 
 from tenacity import retry, stop_after_attempt, wait_random_exponential
 
 from .base import IntelligenceBackend, register_backend
-from ..message import  SYSTEM_NAME, Message, MessagePool, Question, QuestionPool
+from .cache import get_response_cache, request_key
+from .context import select_context
+from .hedging import DEFAULT_HEDGE_BUDGET, get_hedger
+from .scheduler import Slot, get_scheduler
+from .singleflight import get_single_flight
+from ..embeddings import HashingEncoder, mmr_rank
+from ..message import  MODERATOR_NAME, SYSTEM_NAME, AgentOutput, Message, MessagePool, Question, QuestionPool
+from ..metrics import CallMetrics, count_retry, current_call, get_metrics
+from ..utils import estimate_message_tokens, estimate_tokens
 load_dotenv()
+
+# Connection pool limits shared by the sync and async clients
+MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", 100))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("OPENAI_MAX_KEEPALIVE_CONNECTIONS", 20))
+KEEPALIVE_EXPIRY = float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", 30))
+
 try:
+    import httpx
     import openai
 except ImportError:
     is_openai_available = False
@@ -18,13 +41,48 @@ else:
 
         client = openai.OpenAI(
             api_key=os.environ.get("OPENAI_API_KEY"),
-            base_url=os.environ.get("OPENAI_BASE_URL")  # 推荐用环境变量读取
+            base_url=os.environ.get("OPENAI_BASE_URL"),  # 推荐用环境变量读取
+            max_retries=0,  # 重试统一走 _request 的 retry 和共享调度器
+            http_client=httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=KEEPALIVE_EXPIRY,
+                ),
+                timeout=openai.DEFAULT_TIMEOUT,
+            ),
         )
         is_openai_available = True
     except openai.OpenAIError:
         # logging.warning("OpenAI API key is not set. Please set the environment variable OPENAI_API_KEY")
         is_openai_available = False
 
+# An httpx.AsyncClient's connection pool belongs to the event loop it was first used on,
+# so keep one AsyncOpenAI client per running loop and share it between all backends.
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, object]" = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """Return the AsyncOpenAI client of the running event loop, with keep-alive connection pooling."""
+    loop = asyncio.get_running_loop()
+    async_client = _async_clients.get(loop)
+    if async_client is None:
+        async_client = openai.AsyncOpenAI(
+            api_key=os.environ.get("OPENAI_API_KEY"),
+            base_url=os.environ.get("OPENAI_BASE_URL"),
+            max_retries=0,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=KEEPALIVE_EXPIRY,
+                ),
+                timeout=openai.DEFAULT_TIMEOUT,
+            ),
+        )
+        _async_clients[loop] = async_client
+    return async_client
+
 # Default config follows the OpenAI playground
 DEFAULT_TEMPERATURE = 0.7
 DEFAULT_MAX_TOKENS = 256
@@ -34,6 +92,109 @@ END_OF_MESSAGE = "<EOS>"  # End of message token specified by us not OpenAI
 STOP = ("<|endoftext|>", END_OF_MESSAGE)  # End of sentence token
 BASE_PROMPT = f"The messages always end with the token {END_OF_MESSAGE}."
 
+# 反思后提前结束：修正版与原答案足够相似，或反思最后一行声明无需修改
+DEFAULT_REFLECTION_ROUNDS = 1
+DEFAULT_CONVERGENCE_THRESHOLD = 0.98
+NO_FIX_MARKER = "无需修改"
+NO_FIX_PATTERN = re.compile(rf"(?:^|\n)\s*[“\"]?{NO_FIX_MARKER}[”\"]?[。.！!]?\s*$")
+
+# 多候选：一次请求生成 n 个初步答案，按 MMR 在相关性与多样性之间取舍
+DEFAULT_NUM_CANDIDATES = 1
+DEFAULT_CANDIDATE_DIVERSITY = 0.5
+
+# 提示词中系统提示、历史消息和当前请求合计的 token 预算（估算），超出时按重要性与相关性取舍历史消息。
+# 裁剪会把部分历史换成摘要，默认关闭，需要时在 backend 配置中设置，例如 "context_budget": 8000
+DEFAULT_CONTEXT_BUDGET = None
+
+
+class StopTokenFilter:
+    """
+    Applies the stop tokens to streamed text.
+
+    Text that could be the beginning of a stop token is held back until the next delta
+    shows whether it is one; everything from a stop token on is dropped.
+    """
+
+    def __init__(self, stops=STOP):
+        self.stops = stops
+        self.stopped = False
+        self._pending = ""
+
+    def feed(self, text: str) -> str:
+        if self.stopped:
+            return ""
+        self._pending += text
+        positions = [i for i in (self._pending.find(stop) for stop in self.stops) if i >= 0]
+        if positions:
+            out, self._pending, self.stopped = self._pending[: min(positions)], "", True
+            return out
+        hold = 0
+        for stop in self.stops:
+            for k in range(min(len(stop) - 1, len(self._pending)), hold, -1):
+                if self._pending.endswith(stop[:k]):
+                    hold = k
+                    break
+        cut = len(self._pending) - hold
+        out, self._pending = self._pending[:cut], self._pending[cut:]
+        return out
+
+    def flush(self) -> str:
+        out, self._pending = ("" if self.stopped else self._pending), ""
+        return out
+
+
+def _completion_text(completion, request: dict):
+    """The stripped text of a completion, or the list of texts of its choices when n > 1 was requested."""
+    texts = [(choice.message.content or "").strip() for choice in completion.choices]
+    return texts if request.get("n", 1) > 1 else texts[0]
+
+
+def _record_usage(usage):
+    call = current_call()
+    if call is not None:
+        call.add_usage(usage)
+
+
+def _record_discarded(call, completion):
+    """
+    对冲中输掉但已完成的请求单独记一条调用（status="discarded"），其 token 计入总量；
+    原调用的记录此时可能已经写出，不能再修改。
+    """
+    if call is None:
+        return
+    # hedged 只记在原调用上，避免对冲次数重复计数
+    record = CallMetrics(model=call.model, player=call.player, phase=call.phase, labels=dict(call.labels),
+                         status="discarded")
+    record.add_usage(completion.usage)
+    get_metrics().record(record)
+
+
+async def _run_in_thread(fn, *args):
+    """在默认线程池中运行会阻塞的计算（如句向量编码），不阻塞事件循环；contextvars 随之带入线程。"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(contextvars.copy_context().run, fn, *args))
+
+
+def _advance(steps, value=None):
+    """推进步骤生成器一步：返回 (下一组请求, None)；生成器结束时返回 (None, 结果)。"""
+    try:
+        return steps.send(value), None
+    except StopIteration as e:
+        return None, e.value
+
+
+# 主持人（构念筛查）的请求在指标中单独记为这个 phase，与专家的 answer/reflection/revision 分开统计
+MODERATOR_PHASE = "moderator"
+
+
+class ChatRequest(NamedTuple):
+    """One chat completion request issued by the reflection loop."""
+
+    phase: str  # "answer", "reflection" (or "reflection:<k>" per question when fanned out) or "revision"
+    messages: List[dict]
+    n: int = 1  # completions to generate; more than one are candidates to select from
+    query: Optional[str] = None  # the current request message, which candidates should answer
+
 
 @register_backend
 class OpenAIChat(IntelligenceBackend):
@@ -48,13 +209,62 @@ class OpenAIChat(IntelligenceBackend):
         max_tokens: int = DEFAULT_MAX_TOKENS,
         model: str = DEFAULT_MODEL,
         merge_other_agents_as_one_user: bool = True,
+        cache: Optional[bool] = None,
+        cache_ttl: Optional[float] = None,
+        cache_db: Optional[str] = None,
+        reflection_rounds: int = DEFAULT_REFLECTION_ROUNDS,
+        convergence_threshold: Optional[float] = DEFAULT_CONVERGENCE_THRESHOLD,
+        stop_when_no_fix: bool = True,
+        token_budget: Optional[int] = None,
+        latency_budget: Optional[float] = None,
+        reflection_fanout: bool = False,
+        hedge_percentile: Optional[float] = None,
+        hedge_budget: float = DEFAULT_HEDGE_BUDGET,
+        num_candidates: int = DEFAULT_NUM_CANDIDATES,
+        candidate_diversity: float = DEFAULT_CANDIDATE_DIVERSITY,
+        context_budget: Optional[int] = DEFAULT_CONTEXT_BUDGET,
+        coalesce: bool = True,
         **kwargs,
     ):
+        """
+        cache: 是否缓存回答。None 表示只在 temperature 为 0（结果可复现）时缓存，True/False 强制开启/关闭。
+        cache_ttl: 缓存有效期（秒），None 使用全局缓存的默认值。
+        cache_db: 缓存的 SQLite 文件，None 时使用 CHATARENA_LLM_CACHE_DB 环境变量（未设置则只缓存在内存中）。
+        reflection_rounds: 最多反思/修正的轮数，0 表示只给出初步答案。
+        convergence_threshold: 修正版与本轮答案的相似度（余弦）达到该值即停止，None 表示不检查。
+        stop_when_no_fix: 反思最后一行声明“无需修改”时跳过修正并停止。
+        token_budget / latency_budget: 单次 query 的 token（估算）/ 耗时（秒）预算，超出后不再开始新的反思。
+        reflection_fanout: 每个自省问题单独并发请求（共享相同的前缀），再把各自的回答合并成反思内容。
+        hedge_percentile: 请求耗时超过近期该分位数（如 0.95）仍未返回时，再发一个相同请求，取先返回的结果；None 表示不对冲。
+        hedge_budget: 对冲请求占总请求数的上限比例。
+        num_candidates: 初步答案的候选数，大于 1 时用 API 的 n 参数在一次请求中生成（共享输入 token），
+            再按 MMR 选出与当前请求消息最相关、且与本次运行中已生成的题目（msgs.item_store）最不重复的一个。
+        candidate_diversity: MMR 中多样性的权重（0-1），0 只看相关性，1 只看与已生成题目的差异。
+        context_budget: 系统提示 + 历史消息 + 当前请求的 token 预算（离线估算）。超出时始终保留系统/角色提示、
+            第 0 轮之前的角色说明、自陈内容、主持人消息和当前请求，其余历史按重要性、与当前请求的相关性
+            和新近程度择优保留，放不下的压缩成一段摘要；默认 None，不裁剪。
+        coalesce: 与正在进行中的完全相同的请求（同一 request_key）合并，等待它的结果而不再重复发送。
+        """
         super().__init__(
             temperature=temperature,
             max_tokens=max_tokens,
             model=model,
             merge_other_agents_as_one_user=merge_other_agents_as_one_user,
+            cache=cache,
+            cache_ttl=cache_ttl,
+            cache_db=cache_db,
+            reflection_rounds=reflection_rounds,
+            convergence_threshold=convergence_threshold,
+            stop_when_no_fix=stop_when_no_fix,
+            token_budget=token_budget,
+            latency_budget=latency_budget,
+            reflection_fanout=reflection_fanout,
+            hedge_percentile=hedge_percentile,
+            hedge_budget=hedge_budget,
+            num_candidates=num_candidates,
+            candidate_diversity=candidate_diversity,
+            context_budget=context_budget,
+            coalesce=coalesce,
             **kwargs,
         )
 
@@ -62,93 +272,421 @@ class OpenAIChat(IntelligenceBackend):
         self.max_tokens = max_tokens
         self.model = model
         self.merge_other_agent_as_user = merge_other_agents_as_one_user
+        self.cache = cache
+        self.cache_ttl = cache_ttl
+        self.response_cache = get_response_cache(cache_db)
+        self.reflection_rounds = reflection_rounds
+        self.convergence_threshold = convergence_threshold
+        self.stop_when_no_fix = stop_when_no_fix
+        self.token_budget = token_budget
+        self.latency_budget = latency_budget
+        self.reflection_fanout = reflection_fanout
+        self.hedge_percentile = hedge_percentile
+        self.hedge_budget = hedge_budget
+        self.num_candidates = num_candidates
+        self.candidate_diversity = candidate_diversity
+        self.context_budget = context_budget
+        self.coalesce = coalesce
+
+    @property
+    def cache_enabled(self) -> bool:
+        # 温度不为 0 时同一请求的回答本应不同，默认不缓存
+        return self.cache if self.cache is not None else self.temperature == 0
 
-    @retry(stop=stop_after_attempt(6), wait=wait_random_exponential(min=1, max=60))
-    def _get_response(self, messages):
-        completion = client.chat.completions.create(
+    def _request_params(self, messages, n: int = 1) -> dict:
+        params = dict(
             model=self.model,
             messages=messages,
             temperature=self.temperature,
             max_tokens=self.max_tokens,
-            stop=STOP,
+            stop=list(STOP),
         )
+        if n > 1:
+            params["n"] = n
+        return params
+
+    def _get_response(self, messages, on_text=None, player=None, phase=None, n: int = 1):
+        """
+        Return the completion of `messages`; with `on_text`, stream it to on_text(delta) as well.
+
+        With n > 1, return the list of the n completions instead (never streamed).
+        The call is recorded in the process-wide metrics under `player` and `phase`.
 
-        response = completion.choices[0].message.content
-        response = response.strip()
+        Layers, outermost first: response cache -> coalescing of identical in-flight
+        requests -> retries -> scheduler slot -> hedging of that one attempt.
+        """
+        request = self._request_params(messages, n)
+        key = request_key(request)
+        with get_metrics().track(self.model, player=player, phase=phase) as call:
+            response = self._cached_response(key, n, on_text, call)
+            if response is not None:
+                return response
+            send = functools.partial(self._send, request, on_text, phase)
+            if self.coalesce:
+                response, call.coalesced = get_single_flight().do(key, send)
+            else:
+                response = send()
+            return self._finish_response(key, response, n, on_text, call)
+
+    async def _async_get_response(self, messages, on_text=None, player=None, phase=None, n: int = 1):
+        request = self._request_params(messages, n)
+        key = request_key(request)
+        with get_metrics().track(self.model, player=player, phase=phase) as call:
+            response = self._cached_response(key, n, on_text, call)
+            if response is not None:
+                return response
+            send = functools.partial(self._async_send, request, on_text, phase)
+            if self.coalesce:
+                response, call.coalesced = await get_single_flight().async_do(key, send)
+            else:
+                response = await send()
+            return self._finish_response(key, response, n, on_text, call)
+
+    def _cached_response(self, key: str, n: int, on_text, call):
+        if not self.cache_enabled:
+            return None
+        response = self.response_cache.get(key)
+        if response is None:
+            return None
+        call.cache_hit = True
+        if n > 1:
+            return json.loads(response)
+        if on_text is not None:
+            on_text(response)
         return response
 
-    def query(self, agent_name: str, role_desc: str, history_messages: List[Message], ques: QuestionPool,
+    def _finish_response(self, key: str, response, n: int, on_text, call):
+        if call.coalesced:
+            # 合并的请求没有经过本调用的流式回调，结果整段补发
+            if on_text is not None and n == 1:
+                on_text(response)
+        elif self.cache_enabled:
+            self.response_cache.put(key, json.dumps(response, ensure_ascii=False) if n > 1 else response,
+                                    ttl=self.cache_ttl)
+        return response
+
+    def _respond(self, request: ChatRequest, agent_name: str, stream_callback=None, msgs: MessagePool = None) -> str:
+        """回答一个 ChatRequest；多候选请求先一次生成 n 个候选，再选出一个（选中的整段回调给 stream_callback）。"""
+        on_text = self._phase_callback(stream_callback, request)
+        phase = self._metrics_phase(request, agent_name)
+        if request.n <= 1:
+            return self._get_response(request.messages, on_text=on_text, player=agent_name, phase=phase)
+        candidates = self._get_response(request.messages, player=agent_name, phase=phase, n=request.n)
+        return self._select_candidate(request, candidates, agent_name, msgs, on_text)
+
+    async def _async_respond(self, request: ChatRequest, agent_name: str, stream_callback=None,
+                             msgs: MessagePool = None) -> str:
+        on_text = self._phase_callback(stream_callback, request)
+        phase = self._metrics_phase(request, agent_name)
+        if request.n <= 1:
+            return await self._async_get_response(
+                request.messages, on_text=on_text, player=agent_name, phase=phase
+            )
+        candidates = await self._async_get_response(
+            request.messages, player=agent_name, phase=phase, n=request.n
+        )
+        # 候选的向量编码放到线程中，选中后在事件循环上回调
+        selected = await _run_in_thread(self._select_candidate, request, candidates, agent_name, msgs)
+        if on_text is not None:
+            on_text(selected)
+        return selected
+
+    def _select_candidate(self, request: ChatRequest, candidates: List[str], agent_name: str,
+                          msgs: MessagePool = None, on_text=None) -> str:
+        """
+        按 MMR 从候选中选出一个：与当前请求消息相关，且与本次运行中该专家已生成的题目（消息池的
+        item_store，批量运行时各条记录共享）尽量不重复。向量用消息池的句向量模型，模型关闭时
+        退回字符 n-gram 哈希向量。
+        """
+        candidates = [c for c in candidates if c] or candidates
+        if len(set(candidates)) > 1:
+            # 相关性只对照当前请求消息；拼接整段历史会被编码器截断，只剩最早的几轮
+            query = request.query
+            existing = msgs.item_store.items(agent_name) if msgs is not None else []
+            texts = candidates + existing + ([query] if query else [])
+            vectors = msgs.embed(texts) if msgs is not None else None
+            if vectors is None:
+                vectors = HashingEncoder().encode(texts)
+            ranking = mmr_rank(
+                vectors[: len(candidates)],
+                query=vectors[-1] if query else None,
+                existing=vectors[len(candidates): len(candidates) + len(existing)],
+                diversity=self.candidate_diversity,
+            )
+            selected = candidates[ranking[0]]
+        else:
+            selected = candidates[0]
+        if on_text is not None:
+            on_text(selected)
+        return selected
+
+    def _send(self, request: dict, on_text=None, phase=None) -> str:
+        """Send `request` to the API: streamed, or as single requests (hedged when enabled) with retries."""
+        if on_text is not None:
+            # 流式请求不对冲：两份输出会交替出现在界面上
+            return self._stream_request(request, on_text=on_text)
+        return self._request(request, phase)
+
+    async def _async_send(self, request: dict, on_text=None, phase=None) -> str:
+        if on_text is not None:
+            return await self._async_stream_request(request, on_text=on_text)
+        return await self._async_request(request, phase)
+
+    @staticmethod
+    def _reserved_tokens(request: dict) -> int:
+        # 按提示词估算加最大输出预留 TPM 额度，请求完成后按实际用量结算
+        return estimate_message_tokens(request["messages"]) + (request.get("max_tokens") or 0) * request.get("n", 1)
+
+    @retry(stop=stop_after_attempt(6), wait=wait_random_exponential(min=1, max=60), before_sleep=count_retry)
+    def _request(self, request: dict, phase=None) -> str:
+        """
+        一次尝试：先排队拿到调度槽位，再发送（开启对冲时对这一次尝试对冲）。
+        重试和排队都在对冲之外，对冲的计时和延迟样本只包含服务时间。
+        """
+        tokens = self._reserved_tokens(request)
+        attempt = functools.partial(self._attempt, request, get_scheduler(self.model).acquire(tokens))
+        if self.hedge_percentile is None:
+            completion = attempt()
+        else:
+            completion = get_hedger(self.model).call(
+                phase, attempt, self.hedge_percentile, self.hedge_budget,
+                make_hedge=functools.partial(self._hedge_attempt, request, tokens),
+                discard=functools.partial(_record_discarded, current_call()),
+            )
+        _record_usage(completion.usage)
+        return _completion_text(completion, request)
+
+    @retry(stop=stop_after_attempt(6), wait=wait_random_exponential(min=1, max=60), before_sleep=count_retry)
+    async def _async_request(self, request: dict, phase=None) -> str:
+        tokens = self._reserved_tokens(request)
+        attempt = functools.partial(self._async_attempt, request, await get_scheduler(self.model).async_acquire(tokens))
+        if self.hedge_percentile is None:
+            completion = await attempt()
+        else:
+            completion = await get_hedger(self.model).async_call(
+                phase, attempt, self.hedge_percentile, self.hedge_budget,
+                make_hedge=functools.partial(self._hedge_attempt, request, tokens, is_async=True),
+                discard=functools.partial(_record_discarded, current_call()),
+            )
+        _record_usage(completion.usage)
+        return _completion_text(completion, request)
+
+    def _attempt(self, request: dict, slot: Slot):
+        """发送一次请求（不重试），结束时归还 slot（对冲中输掉的一方也会自己归还）。"""
+        scheduler = get_scheduler(self.model)
+        try:
+            completion = client.chat.completions.create(**request)
+        except BaseException as e:
+            scheduler.release(slot, e)
+            raise
+        slot.used_tokens = completion.usage.total_tokens if completion.usage else None
+        scheduler.release(slot)
+        return completion
+
+    async def _async_attempt(self, request: dict, slot: Slot):
+        scheduler = get_scheduler(self.model)
+        try:
+            completion = await get_async_client().chat.completions.create(**request)
+        except BaseException as e:
+            scheduler.release(slot, e)
+            raise
+        slot.used_tokens = completion.usage.total_tokens if completion.usage else None
+        scheduler.release(slot)
+        return completion
+
+    def _hedge_attempt(self, request: dict, tokens: int, is_async: bool = False):
+        """对冲副本占用自己的调度槽位；调度器已满、有人排队或暂停时不对冲，避免过载时再加负载。"""
+        slot = get_scheduler(self.model).try_acquire(tokens)
+        if slot is None:
+            return None
+        return functools.partial(self._async_attempt if is_async else self._attempt, request, slot)
+
+    @retry(stop=stop_after_attempt(6), wait=wait_random_exponential(min=1, max=60), before_sleep=count_retry)
+    def _stream_request(self, request: dict, on_text) -> str:
+        stop_filter = StopTokenFilter()
+        parts = []
+        with get_scheduler(self.model).slot(self._reserved_tokens(request)) as slot:
+            chunks = client.chat.completions.create(**request, stream=True, stream_options={"include_usage": True})
+            for chunk in chunks:
+                if chunk.usage:
+                    slot.used_tokens = chunk.usage.total_tokens
+                    _record_usage(chunk.usage)
+                if chunk.choices:
+                    parts.append(stop_filter.feed(chunk.choices[0].delta.content or ""))
+                    if parts[-1]:
+                        on_text(parts[-1])
+            parts.append(stop_filter.flush())
+            if parts[-1]:
+                on_text(parts[-1])
+        return "".join(parts).strip()
+
+    @retry(stop=stop_after_attempt(6), wait=wait_random_exponential(min=1, max=60), before_sleep=count_retry)
+    async def _async_stream_request(self, request: dict, on_text) -> str:
+        stop_filter = StopTokenFilter()
+        parts = []
+        async with get_scheduler(self.model).async_slot(self._reserved_tokens(request)) as slot:
+            chunks = await get_async_client().chat.completions.create(
+                **request, stream=True, stream_options={"include_usage": True}
+            )
+            async for chunk in chunks:
+                if chunk.usage:
+                    slot.used_tokens = chunk.usage.total_tokens
+                    _record_usage(chunk.usage)
+                if chunk.choices:
+                    parts.append(stop_filter.feed(chunk.choices[0].delta.content or ""))
+                    if parts[-1]:
+                        on_text(parts[-1])
+            parts.append(stop_filter.flush())
+            if parts[-1]:
+                on_text(parts[-1])
+        return "".join(parts).strip()
+
+    def _similarity(self, a: str, b: str, msgs: MessagePool = None) -> float:
+        """修正前后答案的相似度：优先用消息池的句向量模型，模型关闭时退回字符级相似度。"""
+        similarity = msgs.similarity(a, b) if msgs is not None else None
+        if similarity is None:
+            similarity = difflib.SequenceMatcher(None, a, b).ratio()
+        return similarity
+
+    def _over_budget(self, spent_tokens: int, start: float) -> bool:
+        if self.token_budget is not None and spent_tokens >= self.token_budget:
+            return True
+        return self.latency_budget is not None and time.monotonic() - start >= self.latency_budget
+
+    @staticmethod
+    def _metrics_phase(request: ChatRequest, agent_name: str) -> str:
+        # 指标和对冲延迟按 phase 分组；主持人的请求单独一组，流式回调仍用 request.phase
+        return MODERATOR_PHASE if agent_name == MODERATOR_NAME else request.phase
+
+    @staticmethod
+    def _phase_callback(stream_callback, request: ChatRequest):
+        return functools.partial(stream_callback, request.phase) if stream_callback is not None else None
+
+    def _reflection_steps(self, agent_name: str, role_desc: str, history_messages: List[Message], ques: QuestionPool,
         global_prompt: str = None,
         request_msg: Message = None,
-        *args,
-        **kwargs,
+        msgs: MessagePool = None,
     ):
         """
-        多轮反思与自我修正：每轮包括初步回答、反思、修正判断、修正版答案，最多5轮，直到模型判断无需修正。
-        返回：final_answer, [每轮详细内容dict]
+        多轮反思与自我修正的步骤生成器，与具体的请求方式（同步/异步）无关。
+
+        每次 yield 一组 ChatRequest，调用方把对应的回答列表 send 回来；
+        生成器结束时返回 AgentOutput(final_answer, round_records)。
         """
-        system_prompt = {"role": "system", "content": f"{global_prompt or ''}\n{role_desc}\n你是{agent_name}。"}
+        # 前缀稳定的布局：所有专家共享、跨运行不变的全局提示单独作为第一条消息，逐字节相同，
+        # 便于服务端的提示词缓存命中；角色描述和名字放在其后
+        system_prompt = [{"role": "system", "content": global_prompt}] if global_prompt else []
+        system_prompt.append({"role": "system", "content": f"{role_desc}\n你是{agent_name}。"})
         conversations = []
-        msgs = kwargs.get("msgs")
         if msgs:
             all_messages = msgs.get_all_messages()
             if all_messages:
                 last_message = all_messages[-1]
                 request_msg = last_message.content
+        if self.context_budget is not None:
+            # 系统提示和当前请求必定保留，历史消息只能用剩下的预算
+            fixed = estimate_message_tokens(system_prompt) + estimate_tokens(f"{request_msg or ''}")
+            history_messages, summary = select_context(
+                history_messages, self.context_budget - fixed, query=f"{request_msg or ''}", msgs=msgs
+            )
+            if summary:
+                conversations.append({"role": "user", "content": f"{summary}{END_OF_MESSAGE}"})
         for msg in history_messages:
             role = "assistant" if msg.agent_name == agent_name else "user"
             conversations.append({"role": role, "content": f"{msg.agent_name}: {msg.content}{END_OF_MESSAGE}"})
         if request_msg:
             conversations.append({"role": "user", "content": f"{request_msg}{END_OF_MESSAGE}"})
 
+        request_query = f"{request_msg}" if request_msg else None
+
         # 反思问题
         reflection_questions = ques.get_visible_questions(agent_name) if ques else []
         reflection_prompt = "请你根据以下自省问题进行反思，并逐条简要作答：\n"
         for q in reflection_questions:
             reflection_prompt += f"- {q.content}\n"
         reflection_prompt += "\n请逐条作答。"
-        max_rounds = 1
+        no_fix_prompt = f"\n如果反思后认为原答案无需任何修改，请在最后单独一行写“{NO_FIX_MARKER}”。"
+        if self.stop_when_no_fix:
+            reflection_prompt += no_fix_prompt
+        # 分问题并发反思：每个问题一个请求，前缀与整体反思请求相同
+        fanout = self.reflection_fanout and len(reflection_questions) > 1
+        max_rounds = self.reflection_rounds
         round_records = []
         current_answer = None
-        
+        start = time.monotonic()
+        spent_tokens = 0  # 估算的已用 token，用于 token_budget
+
         # 如果反思轮数为0，直接返回初步答案
         if max_rounds == 0:
-            request = [system_prompt] + conversations + [{"role": "user", "content": "请根据以上信息，给出你的回答。"}]
-            current_answer = self._get_response(request)
+            request = system_prompt + conversations + [{"role": "user", "content": "请根据以上信息，给出你的回答。"}]
+            (current_answer,) = yield [ChatRequest("answer", request, n=self.num_candidates, query=request_query)]
             current_answer = re.sub(rf"{END_OF_MESSAGE}$", "", current_answer).strip()
             # 格式化输出：原始答案
             formatted_answer = f"【原始答案】\n{current_answer}"
-            return formatted_answer, round_records
-        
+            return AgentOutput(formatted_answer, round_records)
+
         # 存储原始答案
         original_answer = None
-        
+
         for i in range(max_rounds):
             if i == 0:
-                request = [system_prompt] + conversations + [{"role": "user", "content": "请根据以上信息，给出你的回答。"}]
-                current_answer = self._get_response(request)
+                request = system_prompt + conversations + [{"role": "user", "content": "请根据以上信息，给出你的回答。"}]
+                (current_answer,) = yield [ChatRequest("answer", request, n=self.num_candidates, query=request_query)]
+                spent_tokens += estimate_message_tokens(request) + estimate_tokens(current_answer)
                 current_answer = re.sub(rf"{END_OF_MESSAGE}$", "", current_answer).strip()
                 original_answer = current_answer  # 保存原始答案
+            if self._over_budget(spent_tokens, start):
+                if round_records:
+                    round_records[-1]["stop_reason"] = "budget"
+                break
             # 2. 反思
-            reflection_request = [system_prompt] + conversations
+            reflection_request = system_prompt + conversations
             reflection_request.append({"role": "assistant", "content": current_answer + END_OF_MESSAGE})
-            reflection_request.append({"role": "user", "content": reflection_prompt})
-            # 保存原温度，临时调高
-            #original_temperature = self.temperature
-            #self.temperature = 0.7
-            reflection = self._get_response(reflection_request)
-            #self.temperature = original_temperature
-            reflection = re.sub(rf"{END_OF_MESSAGE}$", "", reflection).strip()
-            # 3. 直接修正（不再判断是否需要修正）
+            if fanout:
+                question_requests = []
+                for k, q in enumerate(reflection_questions, 1):
+                    question_prompt = f"请你根据以下自省问题进行反思，并简要作答：\n- {q.content}\n"
+                    if self.stop_when_no_fix:
+                        question_prompt += no_fix_prompt
+                    question_requests.append(ChatRequest(
+                        f"reflection:{k}", reflection_request + [{"role": "user", "content": question_prompt}]
+                    ))
+                answers = yield question_requests
+                answers = [re.sub(rf"{END_OF_MESSAGE}$", "", a).strip() for a in answers]
+                spent_tokens += sum(
+                    estimate_message_tokens(r.messages) + estimate_tokens(a) for r, a in zip(question_requests, answers)
+                )
+                no_fix = self.stop_when_no_fix and all(NO_FIX_PATTERN.search(a) for a in answers)
+                reflection = "\n\n".join(
+                    f"{k}. {q.content}\n{a}" for k, (q, a) in enumerate(zip(reflection_questions, answers), 1)
+                )
+            else:
+                reflection_request.append({"role": "user", "content": reflection_prompt})
+                (reflection,) = yield [ChatRequest("reflection", reflection_request)]
+                spent_tokens += estimate_message_tokens(reflection_request) + estimate_tokens(reflection)
+                reflection = re.sub(rf"{END_OF_MESSAGE}$", "", reflection).strip()
+                no_fix = self.stop_when_no_fix and NO_FIX_PATTERN.search(reflection)
+            if no_fix:
+                # 反思认为无需修改：不再请求修正版
+                round_records.append({
+                    "round": i+1,
+                    "answer": current_answer,
+                    "reflection": reflection,
+                    "revised_answer": current_answer,
+                    "stop_reason": "no_fix_needed",
+                })
+                break
+            # 3. 修正
             revise_prompt = (
                 "请根据你的反思，修正你的答案：\n"
                 f"原答案：{current_answer}\n反思：{reflection}\n请输出修正版答案。"
             )
-            revise_request = [system_prompt] + conversations
+            revise_request = system_prompt + conversations
             revise_request.append({"role": "assistant", "content": current_answer + END_OF_MESSAGE})
             revise_request.append({"role": "assistant", "content": reflection + END_OF_MESSAGE})
             revise_request.append({"role": "user", "content": revise_prompt})
-            revised_answer = self._get_response(revise_request)
+            (revised_answer,) = yield [ChatRequest("revision", revise_request)]
+            spent_tokens += estimate_message_tokens(revise_request) + estimate_tokens(revised_answer)
             revised_answer = re.sub(rf"{END_OF_MESSAGE}$", "", revised_answer).strip()
             # 记录本轮内容
             round_records.append({
@@ -157,6 +695,77 @@ class OpenAIChat(IntelligenceBackend):
                 "reflection": reflection,
                 "revised_answer": revised_answer
             })
+            converged = (
+                i + 1 < max_rounds
+                and self.convergence_threshold is not None
+                and self._similarity(current_answer, revised_answer, msgs) >= self.convergence_threshold
+            )
             current_answer = revised_answer
+            if converged:
+                round_records[-1]["stop_reason"] = "converged"
+                break
         final_answer = current_answer
-        return final_answer, round_records
+        return AgentOutput(final_answer, round_records)
+
+    def query(self, agent_name: str, role_desc: str, history_messages: List[Message], ques: QuestionPool,
+        global_prompt: str = None,
+        request_msg: Message = None,
+        *args,
+        **kwargs,
+    ):
+        """
+        多轮反思与自我修正：每轮包括反思和修正版答案，最多 reflection_rounds 轮；
+        修正前后答案趋同、反思声明无需修改或超出预算时提前结束。
+        返回：AgentOutput(final_answer, [每轮详细内容dict])
+        传入 stream_callback(phase, text) 时以流式请求生成，每段新文本到达即回调。
+        """
+        stream_callback = kwargs.get("stream_callback")
+        msgs = kwargs.get("msgs")
+        steps = self._reflection_steps(
+            agent_name, role_desc, history_messages, ques,
+            global_prompt=global_prompt, request_msg=request_msg, msgs=msgs,
+        )
+        try:
+            requests = next(steps)
+            while True:
+                requests = steps.send(self._respond_all(requests, agent_name, stream_callback, msgs))
+        except StopIteration as e:
+            return e.value
+
+    def _respond_all(self, requests: List[ChatRequest], agent_name: str, stream_callback=None,
+                     msgs: MessagePool = None) -> List[str]:
+        """回答一组互不依赖的 ChatRequest（如分问题反思）：多个请求时在线程池中并发发送，按顺序返回。"""
+        if len(requests) <= 1:
+            return [self._respond(request, agent_name, stream_callback, msgs) for request in requests]
+        with ThreadPoolExecutor(max_workers=len(requests), thread_name_prefix="OpenAIChat") as executor:
+            # 每个请求复制一份 contextvars，指标标签和调度通道随请求进入线程
+            futures = [
+                executor.submit(
+                    contextvars.copy_context().run, self._respond, request, agent_name, stream_callback, msgs
+                )
+                for request in requests
+            ]
+            return [future.result() for future in futures]
+
+    async def async_query(self, agent_name: str, role_desc: str, history_messages: List[Message],
+        ques: QuestionPool = None,
+        global_prompt: str = None,
+        request_msg: Message = None,
+        *args,
+        **kwargs,
+    ):
+        """query() 的异步版本：同样的回答/反思/修正流程，请求通过共享的 AsyncOpenAI 客户端发送。"""
+        stream_callback = kwargs.get("stream_callback")
+        msgs = kwargs.get("msgs")
+        steps = self._reflection_steps(
+            agent_name, role_desc, history_messages, ques,
+            global_prompt=global_prompt, request_msg=request_msg, msgs=msgs,
+        )
+        # 生成器中的上下文筛选和收敛判断要做句向量编码，在线程中推进，不阻塞事件循环
+        requests, output = await _run_in_thread(_advance, steps)
+        while requests is not None:
+            responses = await asyncio.gather(
+                *[self._async_respond(request, agent_name, stream_callback, msgs) for request in requests]
+            )
+            requests, output = await _run_in_thread(_advance, steps, list(responses))
+        return output
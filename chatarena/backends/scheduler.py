@@ -0,0 +1,379 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Optional
+
+# Priority lanes, highest first: interactive (web/CLI) requests jump ahead of batch jobs
+LANES = ("interactive", "batch")
+DEFAULT_LANE = "interactive"
+
+# Process-wide limits shared by every backend talking to the same model
+RPM_LIMIT_ENV = "OPENAI_RPM_LIMIT"
+TPM_LIMIT_ENV = "OPENAI_TPM_LIMIT"
+MAX_CONCURRENCY_ENV = "OPENAI_MAX_CONCURRENCY"
+INITIAL_CONCURRENCY_ENV = "OPENAI_INITIAL_CONCURRENCY"
+DEFAULT_MAX_CONCURRENCY = 64
+DEFAULT_INITIAL_CONCURRENCY = 16
+# Pause applied to everyone after a 429 without a Retry-After header
+DEFAULT_RETRY_AFTER = 1.0
+
+_lane = contextvars.ContextVar("chatarena_request_lane", default=DEFAULT_LANE)
+
+
+def current_lane() -> str:
+    return _lane.get()
+
+
+@contextmanager
+def request_lane(lane: str):
+    """Send the requests made inside this block (and tasks started from it) through `lane`."""
+    if lane not in LANES:
+        raise ValueError(f"Unknown lane {lane!r}, expected one of {LANES}")
+    token = _lane.set(lane)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `per_minute` tokens per minute, holding at most `burst`."""
+
+    def __init__(self, per_minute: float, burst: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst if burst is not None else per_minute
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self, amount: float, now: float) -> float:
+        """Seconds until `amount` tokens are available (requests larger than the bucket wait for a full one)."""
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.level
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, amount: float):
+        self.level -= amount
+
+    def give_back(self, amount: float):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD concurrency limit.
+
+    Every success raises the limit by 1/limit (about +1 per limit's worth of requests);
+    an overload signal halves it, at most once per `decrease_interval` seconds so that one
+    burst of 429s counts as a single congestion event.
+    """
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = DEFAULT_MAX_CONCURRENCY,
+                 decrease_interval: float = 1.0):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.decrease_interval = decrease_interval
+        self._next_decrease = 0.0
+
+    def on_success(self):
+        self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+    def on_overload(self, now: float):
+        if now >= self._next_decrease:
+            self.limit = max(self.minimum, self.limit / 2)
+            self._next_decrease = now + self.decrease_interval
+
+
+class Slot:
+    """
+    Capacity granted for one request.
+
+    Set `used_tokens` from the response usage so the token bucket is charged the real
+    amount instead of the estimate.
+    """
+
+    __slots__ = ("tokens", "lane", "used_tokens", "waited")
+
+    def __init__(self, tokens: int, lane: str):
+        self.tokens = tokens
+        self.lane = lane
+        self.used_tokens: Optional[int] = None
+        self.waited = 0.0
+
+
+class _Waiter:
+    __slots__ = ("slot", "granted", "cancelled", "event", "loop", "future")
+
+    def __init__(self, slot: Slot):
+        self.slot = slot
+        self.granted = False
+        self.cancelled = False
+        self.event = None
+        self.loop = None
+        self.future = None
+
+    def wake(self):
+        if self.event is not None:
+            self.event.set()
+        elif self.future is not None:
+            self.loop.call_soon_threadsafe(_set_done, self.future)
+
+
+def _set_done(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+def _rate_limit_info(exc: BaseException):
+    """Return (is_rate_limited, retry_after seconds) for an exception raised by a client."""
+    if getattr(exc, "status_code", None) != 429:
+        return False, None
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return True, float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return True, None
+
+
+class RequestScheduler:
+    """
+    Shared admission control for LLM requests.
+
+    A request waits until (1) it is at the head of the queue, ordered by lane and then
+    arrival, (2) fewer than the adaptive concurrency limit are in flight, (3) no global
+    pause after a 429 is in effect, and (4) the requests-per-minute and tokens-per-minute
+    buckets can pay for it. A 429 pauses every caller for the Retry-After time and halves
+    the concurrency limit, instead of each caller backing off on its own and retrying in
+    lockstep. Both threads (`slot`) and coroutines (`async_slot`) share the same queue.
+    """
+
+    def __init__(
+        self,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        initial_concurrency: int = DEFAULT_INITIAL_CONCURRENCY,
+    ):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.concurrency = AdaptiveConcurrency(initial_concurrency, maximum=max_concurrency)
+        self.in_flight = 0
+        self._paused_until = 0.0
+        self._waiters = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self.granted: Dict[str, int] = {lane: 0 for lane in LANES}
+        self.waited_seconds: Dict[str, float] = {lane: 0.0 for lane in LANES}
+        self.rate_limited = 0
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "queued": sum(not w.cancelled for _, _, w in self._waiters),
+                "concurrency_limit": round(self.concurrency.limit, 2),
+                "rate_limited": self.rate_limited,
+                "granted": dict(self.granted),
+                "waited_seconds": {k: round(v, 3) for k, v in self.waited_seconds.items()},
+            }
+
+    def _dispatch(self) -> Optional[float]:
+        """Grant queued requests in order; return how long until the head may be granted (None: on release)."""
+        now = time.monotonic()
+        while self._waiters:
+            _, _, waiter = self._waiters[0]
+            if waiter.cancelled:
+                heapq.heappop(self._waiters)
+                continue
+            if self.in_flight >= int(self.concurrency.limit):
+                return None
+            if now < self._paused_until:
+                return self._paused_until - now
+            delay = 0.0
+            if self.requests is not None:
+                delay = max(delay, self.requests.delay(1, now))
+            if self.tokens is not None:
+                delay = max(delay, self.tokens.delay(waiter.slot.tokens, now))
+            if delay > 0:
+                return delay
+            heapq.heappop(self._waiters)
+            if self.requests is not None:
+                self.requests.take(1)
+            if self.tokens is not None:
+                self.tokens.take(waiter.slot.tokens)
+            self.in_flight += 1
+            self.granted[waiter.slot.lane] += 1
+            waiter.granted = True
+            waiter.wake()
+        return None
+
+    def _enqueue(self, tokens: int, lane: Optional[str]) -> _Waiter:
+        lane = lane or current_lane()
+        waiter = _Waiter(Slot(tokens, lane))
+        heapq.heappush(self._waiters, (LANES.index(lane), next(self._counter), waiter))
+        return waiter
+
+    def acquire(self, tokens: int = 0, lane: Optional[str] = None) -> Slot:
+        """Block until the request may be sent; pair with `release`."""
+        start = time.monotonic()
+        with self._lock:
+            waiter = self._enqueue(tokens, lane)
+            waiter.event = threading.Event()
+            timeout = self._dispatch()
+        try:
+            while not waiter.granted:
+                waiter.event.wait(timeout)
+                with self._lock:
+                    waiter.event.clear()
+                    timeout = self._dispatch()
+        except BaseException as e:
+            self._abandon(waiter, e)
+            raise
+        waiter.slot.waited = time.monotonic() - start
+        with self._lock:
+            self.waited_seconds[waiter.slot.lane] += waiter.slot.waited
+        return waiter.slot
+
+    def try_acquire(self, tokens: int = 0, lane: Optional[str] = None) -> Optional[Slot]:
+        """
+        Grant a slot only if that is possible right now without jumping the queue: nobody is
+        waiting, the concurrency limit has room, no pause is in effect and the buckets can pay.
+        Returns None otherwise. Used for optional work such as hedged duplicates.
+        """
+        lane = lane or current_lane()
+        now = time.monotonic()
+        with self._lock:
+            if any(not waiter.cancelled for _, _, waiter in self._waiters):
+                return None
+            if self.in_flight >= int(self.concurrency.limit) or now < self._paused_until:
+                return None
+            if self.requests is not None and self.requests.delay(1, now) > 0:
+                return None
+            if self.tokens is not None and self.tokens.delay(tokens, now) > 0:
+                return None
+            if self.requests is not None:
+                self.requests.take(1)
+            if self.tokens is not None:
+                self.tokens.take(tokens)
+            self.in_flight += 1
+            self.granted[lane] += 1
+            return Slot(tokens, lane)
+
+    async def async_acquire(self, tokens: int = 0, lane: Optional[str] = None) -> Slot:
+        """Coroutine version of `acquire`; cancelling it gives the capacity back."""
+        start = time.monotonic()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            waiter = self._enqueue(tokens, lane)
+            waiter.loop = loop
+            waiter.future = loop.create_future()
+            timeout = self._dispatch()
+        try:
+            while not waiter.granted:
+                await asyncio.wait({waiter.future}, timeout=timeout)
+                with self._lock:
+                    if waiter.future.done():
+                        waiter.future = loop.create_future()
+                    timeout = self._dispatch()
+        except BaseException as e:
+            self._abandon(waiter, e)
+            raise
+        waiter.slot.waited = time.monotonic() - start
+        with self._lock:
+            self.waited_seconds[waiter.slot.lane] += waiter.slot.waited
+        return waiter.slot
+
+    def _abandon(self, waiter: _Waiter, exc: BaseException):
+        """Drop a waiter whose caller gave up (e.g. was cancelled), returning its slot if already granted."""
+        with self._lock:
+            waiter.cancelled = True
+            granted = waiter.granted
+        if granted:
+            # The slot was never used: refund its tokens, and pass the exception on so that it
+            # does not count as a success
+            waiter.slot.used_tokens = 0
+            self.release(waiter.slot, exc)
+
+    def release(self, slot: Slot, exc: Optional[BaseException] = None):
+        """
+        Return the capacity of `slot`, adapting the limits to how the request ended.
+
+        `exc` is the exception the request failed with: a 429 pauses everyone and lowers the
+        concurrency limit, any other exception (including cancellation) just frees the slot,
+        and only a request that completed (`exc` None) raises the limit.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self.in_flight -= 1
+            if self.tokens is not None and slot.used_tokens is not None:
+                self.tokens.give_back(slot.tokens - slot.used_tokens)
+            rate_limited, retry_after = _rate_limit_info(exc) if exc is not None else (False, None)
+            if rate_limited:
+                self.rate_limited += 1
+                self.concurrency.on_overload(now)
+                pause = retry_after if retry_after is not None else DEFAULT_RETRY_AFTER
+                self._paused_until = max(self._paused_until, now + pause)
+            elif exc is None:
+                self.concurrency.on_success()
+            self._dispatch()
+        # Waiters sleeping on a bucket or pause timeout re-check on their own; wake the rest now
+        for _, _, waiter in list(self._waiters):
+            if not waiter.granted:
+                waiter.wake()
+
+    @contextmanager
+    def slot(self, tokens: int = 0, lane: Optional[str] = None):
+        slot = self.acquire(tokens, lane)
+        try:
+            yield slot
+        except BaseException as e:
+            self.release(slot, e)
+            raise
+        self.release(slot)
+
+    @asynccontextmanager
+    async def async_slot(self, tokens: int = 0, lane: Optional[str] = None):
+        slot = await self.async_acquire(tokens, lane)
+        try:
+            yield slot
+        except BaseException as e:
+            self.release(slot, e)
+            raise
+        self.release(slot)
+
+
+_SCHEDULERS: Dict[str, RequestScheduler] = {}
+_SCHEDULERS_LOCK = threading.Lock()
+
+
+def get_scheduler(key: str = "default") -> RequestScheduler:
+    """
+    Return the process-wide scheduler for `key` (usually the model name).
+
+    Limits come from OPENAI_RPM_LIMIT, OPENAI_TPM_LIMIT (unset: unlimited),
+    OPENAI_MAX_CONCURRENCY and OPENAI_INITIAL_CONCURRENCY.
+    """
+    with _SCHEDULERS_LOCK:
+        scheduler = _SCHEDULERS.get(key)
+        if scheduler is None:
+            rpm = os.environ.get(RPM_LIMIT_ENV)
+            tpm = os.environ.get(TPM_LIMIT_ENV)
+            scheduler = RequestScheduler(
+                rpm=float(rpm) if rpm else None,
+                tpm=float(tpm) if tpm else None,
+                max_concurrency=int(os.environ.get(MAX_CONCURRENCY_ENV, DEFAULT_MAX_CONCURRENCY)),
+                initial_concurrency=int(os.environ.get(INITIAL_CONCURRENCY_ENV, DEFAULT_INITIAL_CONCURRENCY)),
+            )
+            _SCHEDULERS[key] = scheduler
+        return scheduler
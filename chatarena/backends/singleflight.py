@@ -0,0 +1,115 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Dict, Hashable, NamedTuple, Tuple
+
+
+class _Flight(NamedTuple):
+    future: Future
+    thread: int  # thread of the leader
+    is_async: bool
+
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight calls: while a call for a key is running, later callers
+    with the same key wait for its result instead of making their own call.
+
+    The first caller (the leader) runs the call, and the others (followers) get the
+    leader's result or exception; if the leader is cancelled, they try again. Threads and
+    coroutines share the in-flight table, so a coroutine can follow a call made by a
+    thread and the other way round. The one exception is a thread following a coroutine
+    on its own event loop, which would deadlock; that thread makes its own call instead.
+    Nothing is kept after a call finishes. Caching results is the response cache's job.
+    """
+
+    def __init__(self):
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            return {"leaders": self.leaders, "coalesced": self.coalesced, "in_flight": len(self._flights)}
+
+    def _join(self, key: Hashable, is_async: bool) -> Tuple[Future, bool]:
+        """Return (future, is_leader); the leader must call _land when done."""
+        thread = threading.get_ident()
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and not (flight.is_async and not is_async and flight.thread == thread):
+                self.coalesced += 1
+                return flight.future, False
+            future = Future()
+            if flight is None:
+                self._flights[key] = _Flight(future, thread, is_async)
+            self.leaders += 1
+            return future, True
+
+    def _land(self, key: Hashable, future: Future):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and flight.future is future:
+                del self._flights[key]
+
+    def do(self, key: Hashable, fn: Callable[[], object]) -> Tuple[object, bool]:
+        """Return (fn() or the in-flight result for `key`, whether the result was shared)."""
+        while True:
+            future, leader = self._join(key, is_async=False)
+            if leader:
+                break
+            try:
+                return future.result(), True
+            except BaseException:
+                if not future.cancelled():
+                    raise
+                # the leader was cancelled: try again, possibly as the new leader
+        try:
+            result = fn()
+        except BaseException as e:
+            # leave the table first, so that followers retrying after a cancel find a new flight
+            self._land(key, future)
+            if isinstance(e, Exception):
+                future.set_exception(e)
+            else:
+                future.cancel()
+            raise
+        self._land(key, future)
+        future.set_result(result)
+        return result, False
+
+    async def async_do(self, key: Hashable, make_coro: Callable[[], Awaitable]) -> Tuple[object, bool]:
+        """Async version of do(): await make_coro() or the in-flight result for `key`."""
+        while True:
+            future, leader = self._join(key, is_async=True)
+            if leader:
+                break
+            try:
+                # shield: a cancelled follower must not cancel the shared future
+                return await asyncio.shield(asyncio.wrap_future(future)), True
+            except BaseException:
+                if not future.cancelled():
+                    raise
+        try:
+            result = await make_coro()
+        except BaseException as e:
+            # leave the table first, so that followers retrying after a cancel find a new flight
+            self._land(key, future)
+            if isinstance(e, Exception):
+                future.set_exception(e)
+            else:
+                future.cancel()
+            raise
+        self._land(key, future)
+        future.set_result(result)
+        return result, False
+
+
+_SINGLE_FLIGHT = SingleFlight()
+
+
+def get_single_flight() -> SingleFlight:
+    """Return the process-wide in-flight table shared by every backend."""
+    return _SINGLE_FLIGHT
@@ -109,7 +109,7 @@ class SupabaseDB:
                 "turn": message.turn,
                 "timestamp": str(message.timestamp),
                 "msg_type": message.msg_type,
-                "visible_to": json.dumps(message.visible_to),
+                "visible_to": json.dumps(message.visibility),
             }
             message_rows.append(message_row)
 
@@ -0,0 +1,416 @@
+"""
+Local OpenAI-compatible stand-in server for load tests and offline benchmarks.
+
+Implements enough of `/v1/chat/completions` for OpenAIChat: scripted or templated
+responses, a log-normal latency model, injected 429/5xx errors and timeouts, per-minute
+request/token limits, streaming (`"stream": true`), token accounting and prompt caching.
+Point the
+backends at it with
+
+    python -m chatarena.devserver --port 8008 --latency-median 1.5 --error-rate-429 0.05
+    OPENAI_BASE_URL=http://127.0.0.1:8008/v1 OPENAI_API_KEY=dev python run_sjt.py --batch ...
+
+GET /stats returns the counters as JSON; POST /stats/reset clears them.
+
+Prompt caching follows the provider's rules closely enough to measure prefix reuse: a
+prompt of at least 1024 tokens is cached, and later requests that start with the same
+messages report the shared prefix, rounded down to 128 tokens, in
+usage.prompt_tokens_details.cached_tokens.
+
+A response script is a JSON list of rules tried in order; the first rule whose `match`
+regex is found in the last user message (and whose `system` regex, if any, is found in
+the system prompt) answers. `response` is a template formatted with `last_user`, `model`
+and `index` (the request counter); a list of responses is cycled through.
+
+    [{"match": "自省问题", "response": "1. 无需修改。"},
+     {"system": "Player 2", "response": ["情境A……", "情境B……"]},
+     {"response": "模拟回答 #{index}"}]
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+from .utils import estimate_message_tokens, estimate_tokens
+
+DEFAULT_RESPONSE = "这是本地模拟服务器的回答 #{index}。"
+STREAM_CHUNK_CHARS = 4  # characters per streamed delta
+PROMPT_CACHE_MIN_TOKENS = 1024
+PROMPT_CACHE_BLOCK_TOKENS = 128
+PROMPT_CACHE_CAPACITY = 100000  # cached prefixes kept, oldest evicted first
+
+
+class StandInModel:
+    """
+    Behaviour of the stand-in server: what it answers, how long it takes and how it fails.
+
+    Latency is time-to-first-token drawn from a log-normal distribution with the given
+    median and sigma, plus `per_token` seconds for every completion token. Error rates are
+    independent probabilities per request; `rpm_limit`/`tpm_limit` reject requests over a
+    sliding one-minute window with 429 and a Retry-After header, like the real API.
+    """
+
+    def __init__(
+        self,
+        responses: Optional[List[dict]] = None,
+        latency_median: float = 0.5,
+        latency_sigma: float = 0.5,
+        per_token: float = 0.0,
+        error_rate_429: float = 0.0,
+        error_rate_5xx: float = 0.0,
+        timeout_rate: float = 0.0,
+        timeout_seconds: float = 700.0,
+        rpm_limit: Optional[int] = None,
+        tpm_limit: Optional[int] = None,
+        seed: Optional[int] = None,
+    ):
+        self.responses = responses or [{"response": DEFAULT_RESPONSE}]
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.per_token = per_token
+        self.error_rate_429 = error_rate_429
+        self.error_rate_5xx = error_rate_5xx
+        self.timeout_rate = timeout_rate
+        self.timeout_seconds = timeout_seconds
+        self.rpm_limit = rpm_limit
+        self.tpm_limit = tpm_limit
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window = deque()  # (timestamp, prompt tokens) of accepted requests in the last minute
+        self._cycles = Counter()
+        self._prefixes = OrderedDict()  # hash of a message prefix -> None, in least recently used order
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.index = 0
+            self.status_counts = Counter()
+            self.prompt_tokens = 0
+            self.cached_tokens = 0
+            self.completion_tokens = 0
+            self.total_latency = 0.0
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            completed = self.status_counts.get(200, 0)
+            return {
+                "requests": self.index,
+                "status_counts": {str(k): v for k, v in self.status_counts.items()},
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+                "completion_tokens": self.completion_tokens,
+                "mean_latency": self.total_latency / completed if completed else 0.0,
+            }
+
+    def _render(self, messages: List[dict], model: str, index: int) -> str:
+        system = "\n".join(m.get("content") or "" for m in messages if m.get("role") == "system")
+        last_user = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+        for i, rule in enumerate(self.responses):
+            if "match" in rule and not re.search(rule["match"], last_user):
+                continue
+            if "system" in rule and not re.search(rule["system"], system):
+                continue
+            template = rule["response"]
+            if isinstance(template, list):
+                with self._lock:
+                    template = template[self._cycles[i] % len(template)]
+                    self._cycles[i] += 1
+            return template.format(last_user=last_user, model=model, index=index)
+        return DEFAULT_RESPONSE.format(index=index)
+
+    def _cached_tokens(self, messages: List[dict]) -> int:
+        """Tokens of the longest cached message prefix of `messages`; caches this prompt's prefixes."""
+        digest = hashlib.sha256()
+        prefixes = []  # (hash, tokens) of messages[:k + 1]
+        tokens = 3
+        for message in messages:
+            digest.update(json.dumps(message, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+            tokens += estimate_tokens(message.get("content") or "") + 4
+            prefixes.append((digest.copy().hexdigest(), tokens))
+        cached = 0
+        with self._lock:
+            for key, prefix_tokens in prefixes:
+                if key not in self._prefixes:
+                    break
+                self._prefixes.move_to_end(key)
+                cached = prefix_tokens
+            if tokens >= PROMPT_CACHE_MIN_TOKENS:
+                for key, _ in prefixes:
+                    self._prefixes[key] = None
+                    self._prefixes.move_to_end(key)
+                while len(self._prefixes) > PROMPT_CACHE_CAPACITY:
+                    self._prefixes.popitem(last=False)
+        if cached < PROMPT_CACHE_MIN_TOKENS:
+            return 0
+        return cached // PROMPT_CACHE_BLOCK_TOKENS * PROMPT_CACHE_BLOCK_TOKENS
+
+    def _over_limit(self, prompt_tokens: int, now: float) -> Optional[float]:
+        """Admit the request, or return how many seconds to wait if it exceeds a limit."""
+        with self._lock:
+            while self._window and self._window[0][0] <= now - 60:
+                self._window.popleft()
+            over_rpm = self.rpm_limit is not None and len(self._window) >= self.rpm_limit
+            over_tpm = self.tpm_limit is not None and sum(t for _, t in self._window) + prompt_tokens > self.tpm_limit
+            if over_rpm or over_tpm:
+                return max(self._window[0][0] + 60 - now, 0.0) if self._window else 1.0
+            self._window.append((now, prompt_tokens))
+            return None
+
+    def _record(self, status: int, prompt_tokens: int = 0, completion_tokens: int = 0, latency: float = 0.0,
+                cached_tokens: int = 0):
+        with self._lock:
+            self.status_counts[status] += 1
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens
+            self.completion_tokens += completion_tokens
+            self.total_latency += latency
+
+    def complete(self, body: dict):
+        """
+        Handle one chat completion request.
+
+        Returns (status, headers, payload); sleeps for the simulated latency first.
+        """
+        with self._lock:
+            self.index += 1
+            index = self.index
+        start = time.monotonic()
+        messages = body.get("messages") or []
+        model = body.get("model", "stand-in")
+        prompt_tokens = estimate_message_tokens(messages)
+
+        roll = self._random.random()
+        if roll < self.error_rate_429:
+            self._record(429)
+            return 429, {"Retry-After": "1"}, _error("Rate limit reached (injected)", "rate_limit_exceeded")
+        if roll < self.error_rate_429 + self.error_rate_5xx:
+            status = self._random.choice((500, 502, 503))
+            self._record(status)
+            return status, {}, _error("Upstream error (injected)", "server_error")
+        if roll < self.error_rate_429 + self.error_rate_5xx + self.timeout_rate:
+            time.sleep(self.timeout_seconds)
+            self._record(504)
+            return 504, {}, _error("Timed out (injected)", "timeout")
+
+        retry_after = self._over_limit(prompt_tokens, time.time())
+        if retry_after is not None:
+            self._record(429)
+            return 429, {"Retry-After": f"{retry_after:.0f}"}, _error("Rate limit reached", "rate_limit_exceeded")
+
+        max_tokens = body.get("max_tokens")
+        stop = body.get("stop") or []
+        choices = []
+        completion_tokens = 0
+        for i in range(int(body.get("n") or 1)):
+            text = self._render(messages, model, index)
+            for token in [stop] if isinstance(stop, str) else stop:
+                text = text.split(token)[0]
+            finish_reason = "stop"
+            tokens = estimate_tokens(text)
+            if max_tokens is not None and tokens > max_tokens:
+                text = text[: max(int(len(text) * max_tokens / tokens), 1)]
+                tokens, finish_reason = max_tokens, "length"
+            completion_tokens += tokens
+            choices.append({
+                "index": i,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": finish_reason,
+            })
+
+        ttft = self.latency_median * math.exp(self.latency_sigma * self._random.gauss(0, 1))
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": self._cached_tokens(messages)},
+        }
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        if body.get("stream"):
+            include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+            return 200, {}, self._stream_chunks(
+                completion_id, model, choices, usage if include_usage else None, ttft, start
+            )
+        time.sleep(ttft + self.per_token * completion_tokens / len(choices))
+        latency = time.monotonic() - start
+        self._record(200, prompt_tokens, completion_tokens, latency, usage["prompt_tokens_details"]["cached_tokens"])
+        return 200, {}, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": choices,
+            "usage": usage,
+        }
+
+    def _stream_chunks(self, completion_id: str, model: str, choices: List[dict], usage: Optional[dict],
+                       ttft: float, start: float):
+        """Yield chat.completion.chunk payloads: the first after `ttft`, then one per few characters."""
+        def chunk(choice_list, chunk_usage=None):
+            return {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": choice_list,
+                "usage": chunk_usage,
+            }
+
+        time.sleep(ttft)
+        for choice in choices:
+            text = choice["message"]["content"]
+            yield chunk([{"index": choice["index"], "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+            for i in range(0, len(text), STREAM_CHUNK_CHARS):
+                piece = text[i:i + STREAM_CHUNK_CHARS]
+                time.sleep(self.per_token * estimate_tokens(piece))
+                yield chunk([{"index": choice["index"], "delta": {"content": piece}, "finish_reason": None}])
+            yield chunk([{"index": choice["index"], "delta": {}, "finish_reason": choice["finish_reason"]}])
+        if usage is not None:
+            yield chunk([], usage)
+        completion_tokens = sum(estimate_tokens(c["message"]["content"]) for c in choices)
+        prompt_tokens = usage["prompt_tokens"] if usage else 0
+        cached_tokens = usage["prompt_tokens_details"]["cached_tokens"] if usage else 0
+        self._record(200, prompt_tokens, completion_tokens, time.monotonic() - start, cached_tokens)
+
+
+def _error(message: str, code: str) -> dict:
+    return {"error": {"message": message, "type": code, "param": None, "code": code}}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so client connection pooling is exercised
+    model: StandInModel = None
+
+    def _send(self, status: int, payload: dict, headers: Optional[dict] = None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, chunks):
+        # Server-sent events without a length: the connection is closed at the end of the stream
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        for chunk in chunks:
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path == "/stats":
+            self._send(200, self.model.stats)
+        elif path.endswith("/models"):
+            self._send(200, {"object": "list", "data": [{"id": "stand-in", "object": "model"}]})
+        else:
+            self._send(404, _error(f"Unknown path {self.path}", "not_found"))
+
+    def do_POST(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path.endswith("/chat/completions"):
+            try:
+                body = self._read_json()
+            except ValueError:
+                self._send(400, _error("Request body is not valid JSON", "invalid_request_error"))
+                return
+            try:
+                status, headers, payload = self.model.complete(body)
+            except Exception as e:  # e.g. a broken response template: answer like an upstream failure
+                self._send(500, _error(f"Stand-in server error: {e!r}", "server_error"))
+                return
+            if isinstance(payload, dict):
+                self._send(status, payload, headers)
+            else:
+                self._send_stream(payload)
+        elif path == "/stats/reset":
+            self.model.reset_stats()
+            self._send(200, self.model.stats)
+        else:
+            self._send(404, _error(f"Unknown path {self.path}", "not_found"))
+
+    def log_message(self, format, *args):
+        pass  # one line per request would drown the benchmark output
+
+
+def make_server(model: StandInModel, host: str = "127.0.0.1", port: int = 8008) -> ThreadingHTTPServer:
+    """Create (but do not start) a threaded server answering with `model`; port 0 picks a free port."""
+    handler = type("StandInHandler", (_Handler,), {"model": model})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_in_thread(model: Optional[StandInModel] = None, host: str = "127.0.0.1", port: int = 0):
+    """Start a server on a daemon thread; returns (server, base_url) for OPENAI_BASE_URL."""
+    server = make_server(model or StandInModel(), host, port)
+    threading.Thread(target=server.serve_forever, name="chatarena-devserver", daemon=True).start()
+    return server, f"http://{server.server_address[0]}:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stand-in server for offline load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8008)
+    parser.add_argument("--responses", help="JSON file with scripted response rules")
+    parser.add_argument("--latency-median", type=float, default=0.5, help="median time to first token (s)")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="log-normal sigma of the latency")
+    parser.add_argument("--per-token", type=float, default=0.0, help="extra seconds per completion token")
+    parser.add_argument("--error-rate-429", type=float, default=0.0)
+    parser.add_argument("--error-rate-5xx", type=float, default=0.0)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-seconds", type=float, default=700.0)
+    parser.add_argument("--rpm-limit", type=int)
+    parser.add_argument("--tpm-limit", type=int)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    responses = None
+    if args.responses:
+        with open(args.responses, encoding="utf-8") as f:
+            responses = json.load(f)
+    model = StandInModel(
+        responses=responses,
+        latency_median=args.latency_median,
+        latency_sigma=args.latency_sigma,
+        per_token=args.per_token,
+        error_rate_429=args.error_rate_429,
+        error_rate_5xx=args.error_rate_5xx,
+        timeout_rate=args.timeout_rate,
+        timeout_seconds=args.timeout_seconds,
+        rpm_limit=args.rpm_limit,
+        tpm_limit=args.tpm_limit,
+        seed=args.seed,
+    )
+    server = make_server(model, args.host, args.port)
+    print(f"Serving OpenAI-compatible stand-in on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
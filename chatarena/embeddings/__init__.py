@@ -0,0 +1,28 @@
+from .cache import (
+    CACHE_DIR_ENV,
+    DEFAULT_CACHE_CAPACITY,
+    EmbeddingCache,
+    get_embedding_cache,
+)
+from .encoders import (
+    ENCODER_REGISTRY,
+    Encoder,
+    HashingEncoder,
+    OnnxInt8Encoder,
+    SentenceTransformerEncoder,
+    export_onnx_int8,
+    load_encoder,
+    register_encoder,
+)
+from .engine import DEFAULT_BATCH_SIZE, DEFAULT_FLUSH_INTERVAL, EmbeddingEngine
+from .index import VectorIndex, mmr_rank
+from .registry import (
+    DEFAULT_EMBEDDING_MODELS,
+    LazyModel,
+    ModelLoadStats,
+    clear_models,
+    embeddings_enabled,
+    get_model,
+    model_stats,
+    resolve_models,
+)
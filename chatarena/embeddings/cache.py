@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_CACHE_CAPACITY = 4096
+DEFAULT_DISK_DTYPE = "float16"
+# Directory of the on-disk tier used when no cache_dir is given explicitly
+CACHE_DIR_ENV = "CHATARENA_EMBEDDING_CACHE_DIR"
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class _DiskStore:
+    """
+    Append-only vector store for one model, backed by a memory-mapped matrix.
+
+    Rows are written to `vectors.bin` before their key is appended to `keys.txt`, so a
+    crash never leaves a key pointing at a half-written row. Only one process should
+    write to a store at a time.
+    """
+
+    def __init__(self, directory: str, dim: int, dtype: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        meta_path = os.path.join(directory, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            dim, dtype = meta["dim"], meta["dtype"]
+        else:
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump({"dim": dim, "dtype": dtype}, f)
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+
+        self._keys_path = os.path.join(directory, "keys.txt")
+        self._vectors_path = os.path.join(directory, "vectors.bin")
+        self._rows: Dict[str, int] = {}
+        if os.path.exists(self._keys_path):
+            with open(self._keys_path, encoding="utf-8") as f:
+                for row, key in enumerate(f.read().split()):
+                    self._rows[key] = row
+        self._capacity = 0
+        self._matrix = None
+        self._reserve(max(len(self._rows), 1024))
+
+    def _reserve(self, rows: int):
+        if rows <= self._capacity:
+            return
+        capacity = max(rows, self._capacity * 2)
+        row_bytes = self.dim * self.dtype.itemsize
+        with open(self._vectors_path, "ab") as f:
+            f.truncate(max(capacity * row_bytes, os.path.getsize(self._vectors_path)))
+        if self._matrix is not None:
+            self._matrix.flush()
+        self._matrix = np.memmap(
+            self._vectors_path, dtype=self.dtype, mode="r+", shape=(capacity, self.dim)
+        )
+        self._capacity = capacity
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        row = self._rows.get(key)
+        if row is None:
+            return None
+        return np.array(self._matrix[row], dtype=np.float32)
+
+    def put(self, key: str, vector: np.ndarray):
+        if key in self._rows or vector.shape[-1] != self.dim:
+            return
+        row = len(self._rows)
+        self._reserve(row + 1)
+        self._matrix[row] = vector
+        with open(self._keys_path, "a", encoding="utf-8") as f:
+            f.write(key + "\n")
+        self._rows[key] = row
+
+    def flush(self):
+        self._matrix.flush()
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache of embeddings keyed by (model name, content hash).
+
+    The first tier is an in-memory LRU of `capacity` vectors. When `cache_dir` is set,
+    every vector is also written to a memory-mapped store on disk so that later runs can
+    reuse it; disk hits are promoted to the LRU.
+    """
+
+    def __init__(
+        self,
+        capacity: int = DEFAULT_CACHE_CAPACITY,
+        cache_dir: Optional[str] = None,
+        disk_dtype: str = DEFAULT_DISK_DTYPE,
+    ):
+        self.capacity = capacity
+        self.cache_dir = cache_dir
+        self.disk_dtype = disk_dtype
+        self._lru: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+        self._stores: Dict[str, _DiskStore] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "size": len(self._lru),
+        }
+
+    def _store(self, model_name: str, dim: int = None) -> Optional[_DiskStore]:
+        if self.cache_dir is None:
+            return None
+        store = self._stores.get(model_name)
+        if store is None:
+            directory = os.path.join(self.cache_dir, re.sub(r"[^\w.-]", "_", model_name))
+            if dim is None and not os.path.exists(os.path.join(directory, "meta.json")):
+                return None
+            store = _DiskStore(directory, dim, self.disk_dtype)
+            self._stores[model_name] = store
+        return store
+
+    def _remember(self, key: Tuple[str, str], vector: np.ndarray):
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.capacity:
+            self._lru.popitem(last=False)
+
+    def get(self, model_name: str, text: str) -> Optional[np.ndarray]:
+        """Return the cached vector of `text` under `model_name`, or None on a miss."""
+        key = (model_name, content_hash(text))
+        with self._lock:
+            vector = self._lru.get(key)
+            if vector is not None:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return vector
+            store = self._store(model_name)
+            vector = store.get(key[1]) if store is not None else None
+            if vector is not None:
+                self._remember(key, vector)
+                self.hits += 1
+                self.disk_hits += 1
+                return vector
+            self.misses += 1
+            return None
+
+    def put(self, model_name: str, text: str, vector):
+        """Cache the vector of `text` under `model_name` in both tiers."""
+        vector = np.asarray(vector, dtype=np.float32)
+        key = (model_name, content_hash(text))
+        with self._lock:
+            self._remember(key, vector)
+            store = self._store(model_name, dim=vector.shape[-1])
+            if store is not None:
+                store.put(key[1], vector)
+
+    def flush(self):
+        """Write the memory-mapped stores back to disk."""
+        with self._lock:
+            for store in self._stores.values():
+                store.flush()
+
+    def clear(self):
+        """Drop the in-memory tier and reset the counters; the disk tier is kept."""
+        with self._lock:
+            self._lru.clear()
+            self.hits = self.disk_hits = self.misses = 0
+
+
+_CACHES: Dict[Optional[str], EmbeddingCache] = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def get_embedding_cache(cache_dir: Optional[str] = None) -> EmbeddingCache:
+    """
+    Return the process-wide cache for `cache_dir`.
+
+    Without an explicit directory the CHATARENA_EMBEDDING_CACHE_DIR environment variable
+    is used; if that is unset too, the cache is memory only.
+    """
+    if cache_dir is None:
+        cache_dir = os.environ.get(CACHE_DIR_ENV) or None
+    with _CACHES_LOCK:
+        cache = _CACHES.get(cache_dir)
+        if cache is None:
+            cache = EmbeddingCache(cache_dir=cache_dir)
+            _CACHES[cache_dir] = cache
+        return cache
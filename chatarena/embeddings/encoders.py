@@ -0,0 +1,242 @@
+"""
+Interchangeable text encoders behind MessagePool's embedding models.
+
+A model is named by a spec string "<type>:<argument>"; a spec without a known type prefix
+is a sentence-transformers model name, so the default configuration keeps working:
+
+- "all-mpnet-base-v2": the full-precision sentence-transformers model.
+- "onnx-int8:<export dir>": an int8-quantized ONNX Runtime export of a sentence-transformers
+  model, created with `python -m chatarena.embeddings.encoders export <model> <export dir>`.
+- "hashing" or "hashing:<dim>": a dependency-free hashed bag of character n-grams, for
+  tests and deployments where exact semantics do not matter.
+"""
+import json
+import os
+import sys
+import zlib
+from abc import abstractmethod
+from typing import Dict, List, Type
+
+import numpy as np
+
+DEFAULT_HASHING_DIM = 768
+# Tokens longer than this are truncated by the ONNX encoder, as sentence-transformers does
+DEFAULT_MAX_SEQ_LENGTH = 384
+
+
+class Encoder:
+    """An abstraction of a model that turns texts into fixed-size vectors."""
+
+    type_name = None
+
+    def __init__(self, spec: str):
+        self.spec = spec
+
+    def __init_subclass__(cls, **kwargs):
+        if getattr(cls, "type_name") is None:
+            raise TypeError(
+                f"Can't instantiate abstract class {cls.__name__} without type_name attribute defined"
+            )
+        return super().__init_subclass__(**kwargs)
+
+    @abstractmethod
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """Encode `texts` into a float32 matrix with one row per text."""
+        raise NotImplementedError
+
+    @property
+    def memory_bytes(self) -> int:
+        """Approximate memory held by the model weights."""
+        return 0
+
+
+ENCODER_REGISTRY: Dict[str, Type[Encoder]] = {}
+
+
+def register_encoder(cls: Type[Encoder]) -> Type[Encoder]:
+    """Register a new encoder type."""
+    ENCODER_REGISTRY[cls.type_name] = cls
+    return cls
+
+
+def load_encoder(spec: str) -> Encoder:
+    """Create the encoder described by `spec`."""
+    type_name, _, argument = spec.partition(":")
+    encoder_cls = ENCODER_REGISTRY.get(type_name)
+    if encoder_cls is None:
+        return SentenceTransformerEncoder(spec)
+    return encoder_cls(argument)
+
+
+@register_encoder
+class SentenceTransformerEncoder(Encoder):
+    """The reference PyTorch sentence-transformers model."""
+
+    type_name = "sentence-transformers"
+
+    def __init__(self, spec: str):
+        super().__init__(spec)
+        # Imported here so that importing chatarena does not pull in torch
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(spec)
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        return self.model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+
+    @property
+    def memory_bytes(self) -> int:
+        return sum(p.numel() * p.element_size() for p in self.model.parameters())
+
+
+@register_encoder
+class OnnxInt8Encoder(Encoder):
+    """
+    An int8-quantized ONNX Runtime export of a sentence-transformers model.
+
+    The export directory holds `model.onnx`, the tokenizer files and `pooling.json`; see
+    export_onnx_int8.
+    """
+
+    type_name = "onnx-int8"
+
+    def __init__(self, spec: str):
+        super().__init__(spec)
+        import onnxruntime
+        from transformers import AutoTokenizer
+
+        self.directory = spec
+        self.tokenizer = AutoTokenizer.from_pretrained(spec)
+        with open(os.path.join(spec, "pooling.json"), encoding="utf-8") as f:
+            pooling = json.load(f)
+        self.pooling_mode = pooling["mode"]
+        self.normalize = pooling["normalize"]
+        self.max_seq_length = pooling.get("max_seq_length", DEFAULT_MAX_SEQ_LENGTH)
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(spec, "model.onnx"), options, providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {node.name for node in self.session.get_inputs()}
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            tokens = self.tokenizer(
+                texts[start : start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np",
+            )
+            inputs = {
+                name: value.astype(np.int64)
+                for name, value in tokens.items()
+                if name in self._input_names
+            }
+            hidden = self.session.run(None, inputs)[0]
+            if self.pooling_mode == "cls":
+                pooled = hidden[:, 0]
+            else:
+                mask = tokens["attention_mask"][..., None].astype(np.float32)
+                pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if self.normalize:
+                pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            batches.append(pooled.astype(np.float32))
+        if not batches:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.concatenate(batches)
+
+    @property
+    def memory_bytes(self) -> int:
+        return os.path.getsize(os.path.join(self.directory, "model.onnx"))
+
+
+@register_encoder
+class HashingEncoder(Encoder):
+    """
+    Hashed bag of character 1- to 3-grams, L2-normalized.
+
+    It needs nothing beyond numpy and is deterministic across processes, which makes it a
+    stand-in for the neural models in tests. Texts that share many n-grams get similar
+    vectors, but similarity is lexical, not semantic.
+    """
+
+    type_name = "hashing"
+
+    def __init__(self, spec: str = ""):
+        super().__init__(spec)
+        self.dim = int(spec) if spec else DEFAULT_HASHING_DIM
+
+    def _ngrams(self, text: str) -> List[str]:
+        return [text[i : i + n] for n in (1, 2, 3) for i in range(len(text) - n + 1)]
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            hashes = np.fromiter(
+                (zlib.crc32(gram.encode("utf-8")) for gram in self._ngrams(text)), dtype=np.int64
+            )
+            if len(hashes) == 0:
+                continue
+            # The low bits pick the bucket and bit 31 the sign, which keeps collisions unbiased
+            signs = np.where(hashes & (1 << 31), -1.0, 1.0).astype(np.float32)
+            np.add.at(vectors[row], hashes % self.dim, signs)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.clip(norms, 1e-12, None)
+
+
+def export_onnx_int8(model_name: str, output_dir: str, opset: int = 14):
+    """
+    Export the sentence-transformers model `model_name` to an int8 ONNX model in `output_dir`.
+
+    Requires torch, sentence_transformers and onnxruntime. The directory can then be used
+    as the embedding model "onnx-int8:<output_dir>".
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer, models
+
+    os.makedirs(output_dir, exist_ok=True)
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer = model[0]
+    pooling = next(module for module in model if isinstance(module, models.Pooling))
+    normalize = any(isinstance(module, models.Normalize) for module in model)
+
+    tokenizer = transformer.tokenizer
+    tokenizer.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, "pooling.json"), "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "mode": "cls" if pooling.pooling_mode_cls_token else "mean",
+                "normalize": normalize,
+                "max_seq_length": transformer.max_seq_length,
+            },
+            f,
+        )
+
+    dummy = tokenizer(["chatarena"], return_tensors="pt")
+    fp32_path = os.path.join(output_dir, "model.fp32.onnx")
+    torch.onnx.export(
+        transformer.auto_model.eval(),
+        (dummy["input_ids"], dummy["attention_mask"]),
+        fp32_path,
+        input_names=["input_ids", "attention_mask"],
+        output_names=["last_hidden_state"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "sequence"},
+            "last_hidden_state": {0: "batch", 1: "sequence"},
+        },
+        opset_version=opset,
+    )
+    quantize_dynamic(fp32_path, os.path.join(output_dir, "model.onnx"), weight_type=QuantType.QInt8)
+    os.remove(fp32_path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] != "export":
+        print("usage: python -m chatarena.embeddings.encoders export <model name> <output dir>")
+        sys.exit(1)
+    export_onnx_int8(sys.argv[2], sys.argv[3])
@@ -0,0 +1,188 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, NamedTuple, Optional
+
+from .cache import EmbeddingCache
+
+# Default micro-batch settings: flush when this many texts are pending, or when the
+# oldest pending text has waited this many seconds, whichever comes first.
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_FLUSH_INTERVAL = 0.05
+# The background worker exits after this many idle seconds and is restarted on demand
+WORKER_IDLE_TIMEOUT = 5.0
+
+
+class _PendingItem(NamedTuple):
+    model_key: str
+    text: str
+    callback: Callable[[Any], None]
+    enqueued_at: float
+
+
+class EmbeddingEngine:
+    """
+    Encode texts in micro-batches on a background thread.
+
+    Texts are queued with `submit` and encoded together once `batch_size` texts are pending
+    or the oldest one has waited `flush_interval` seconds. Each text's callback receives its
+    vector once its batch is encoded. Call `flush` to encode everything pending right away.
+    Texts found in the optional cache skip the queue and get their vector immediately.
+    The worker thread exits once it has been idle for WORKER_IDLE_TIMEOUT seconds, so
+    engines that are never closed do not keep a thread alive.
+    """
+
+    def __init__(
+        self,
+        encoders: Dict[str, Any],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        cache: Optional[EmbeddingCache] = None,
+        model_names: Optional[Dict[str, str]] = None,
+    ):
+        """
+        Initialize the engine.
+
+        Parameters:
+            encoders (Dict[str, Any]): Mapping from model key to an object with a
+                SentenceTransformer-style `encode(texts, batch_size=...)` method.
+            batch_size (int): Number of pending texts that triggers a batch.
+            flush_interval (float): Maximum seconds a text waits before its batch is encoded.
+                Use 0 to encode every submission immediately on the caller's thread.
+            cache (EmbeddingCache): Cache consulted before encoding and filled afterwards.
+            model_names (Dict[str, str]): Model name of each key, used as the cache namespace.
+                Defaults to the keys themselves.
+        """
+        self.encoders = encoders
+        self.cache = cache
+        self.model_names = model_names or {}
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self._pending: Deque[_PendingItem] = deque()
+        self._cond = threading.Condition()
+        # Held while a batch is being encoded so that flush() waits for in-flight batches
+        self._encode_lock = threading.Lock()
+        self._worker = None
+        self._closed = False
+
+    @property
+    def num_pending(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def submit(self, model_key: str, text: str, callback: Callable[[Any], None]):
+        """Queue a text for encoding with the encoder registered as `model_key`."""
+        if model_key not in self.encoders:
+            raise ValueError(f"Unknown embedding model: {model_key}")
+        if self.cache is not None:
+            vector = self.cache.get(self._model_name(model_key), text)
+            if vector is not None:
+                callback(vector)
+                return
+        if self.flush_interval <= 0:
+            self._encode([_PendingItem(model_key, text, callback, time.monotonic())])
+            return
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("EmbeddingEngine is closed")
+            self._pending.append(_PendingItem(model_key, text, callback, time.monotonic()))
+            self._ensure_worker()
+            self._cond.notify()
+
+    def encode(self, model_key: str, texts: List[str]) -> List[Any]:
+        """Encode `texts` right away on the caller's thread, going through the cache."""
+        vectors = [None] * len(texts)
+        missing = []
+        for i, text in enumerate(texts):
+            if self.cache is not None:
+                vectors[i] = self.cache.get(self._model_name(model_key), text)
+            if vectors[i] is None:
+                missing.append(
+                    _PendingItem(model_key, text, lambda v, i=i: vectors.__setitem__(i, v), time.monotonic())
+                )
+        if missing:
+            self._encode(missing)
+        return vectors
+
+    def flush(self):
+        """Encode every pending text on the caller's thread and wait for in-flight batches."""
+        while True:
+            with self._encode_lock:
+                with self._cond:
+                    batch = list(self._pending)
+                    self._pending.clear()
+                if not batch:
+                    return
+                self._encode(batch)
+
+    def close(self):
+        """Flush pending texts and stop the background worker."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+            worker, self._worker = self._worker, None
+        if worker is not None:
+            worker.join()
+        self.flush()
+
+    def _model_name(self, model_key: str) -> str:
+        return self.model_names.get(model_key, model_key)
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(
+                target=self._run, name="EmbeddingEngine", daemon=True
+            )
+            self._worker.start()
+
+    def _is_due(self) -> bool:
+        if len(self._pending) >= self.batch_size:
+            return True
+        return bool(self._pending) and (
+            time.monotonic() - self._pending[0].enqueued_at >= self.flush_interval
+        )
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and not self._is_due():
+                    if self._pending:
+                        self._cond.wait(timeout=self.flush_interval - (
+                            time.monotonic() - self._pending[0].enqueued_at
+                        ))
+                    elif not self._cond.wait(timeout=WORKER_IDLE_TIMEOUT) and not self._pending:
+                        # Idle: exit; submit() starts a new worker when needed
+                        if self._worker is threading.current_thread():
+                            self._worker = None
+                        return
+                if self._closed:
+                    return
+            with self._encode_lock:
+                with self._cond:
+                    batch = [
+                        self._pending.popleft()
+                        for _ in range(min(self.batch_size, len(self._pending)))
+                    ]
+                if batch:
+                    self._encode(batch)
+
+    def _encode(self, batch: List[_PendingItem]):
+        by_model: Dict[str, List[_PendingItem]] = {}
+        for item in batch:
+            by_model.setdefault(item.model_key, []).append(item)
+
+        for model_key, items in by_model.items():
+            try:
+                vectors = self.encoders[model_key].encode(
+                    [item.text for item in items], batch_size=len(items)
+                )
+            except Exception:
+                logging.exception(
+                    f"Failed to encode a batch of {len(items)} texts with {model_key}"
+                )
+                continue
+            for item, vector in zip(items, vectors):
+                if self.cache is not None:
+                    self.cache.put(self._model_name(model_key), item.text, vector)
+                item.callback(vector)
@@ -0,0 +1,193 @@
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+DEFAULT_INITIAL_CAPACITY = 256
+# Rows are dequantized in chunks of this many rows during search, bounding the
+# temporary float32 copy for float16/int8 storage
+SEARCH_CHUNK_ROWS = 8192
+SUPPORTED_DTYPES = ("float32", "float16", "int8")
+
+
+class VectorIndex:
+    """
+    Growable, contiguous matrix of embeddings with brute-force cosine search.
+
+    Rows are reserved with `add` when an item is appended and filled in later with
+    `set_vector`, which lets the embedding engine deliver vectors asynchronously while
+    the row order still follows the append order. The matrix doubles in capacity when
+    it fills up, so appends are amortized O(1).
+
+    Rows are stored as float32, float16, or int8 with a per-row scale; `vector` and
+    `search` always work in float32.
+    """
+
+    def __init__(self, initial_capacity: int = DEFAULT_INITIAL_CAPACITY, dtype: str = "float32"):
+        if str(dtype) not in SUPPORTED_DTYPES:
+            raise ValueError(f"Unsupported embedding dtype: {dtype}")
+        self.initial_capacity = initial_capacity
+        self.dtype = np.dtype(dtype)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._matrix: Optional[np.ndarray] = None  # allocated once the dimension is known
+            self._norms = np.zeros(self.initial_capacity, dtype=np.float32)
+            self._scales = np.ones(self.initial_capacity, dtype=np.float32)
+            self._filled = np.zeros(self.initial_capacity, dtype=bool)
+            self._row_by_id: Dict[int, int] = {}
+            self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def dim(self) -> Optional[int]:
+        return None if self._matrix is None else self._matrix.shape[1]
+
+    @property
+    def capacity(self) -> int:
+        return len(self._filled)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the stored vectors and their per-row metadata."""
+        matrix_bytes = 0 if self._matrix is None else self._matrix.nbytes
+        return matrix_bytes + self._norms.nbytes + self._scales.nbytes + self._filled.nbytes
+
+    def _grow(self, capacity: int):
+        extra = capacity - self.capacity
+        self._norms = np.concatenate([self._norms, np.zeros(extra, np.float32)])
+        self._scales = np.concatenate([self._scales, np.ones(extra, np.float32)])
+        self._filled = np.concatenate([self._filled, np.zeros(extra, bool)])
+        if self._matrix is not None:
+            matrix = np.zeros((capacity, self._matrix.shape[1]), dtype=self.dtype)
+            matrix[: len(self._matrix)] = self._matrix
+            self._matrix = matrix
+
+    def add(self, item: Any) -> int:
+        """Reserve the next row for `item` and return its row number."""
+        with self._lock:
+            row = self._size
+            if row >= self.capacity:
+                self._grow(self.capacity * 2)
+            self._row_by_id[id(item)] = row
+            self._size += 1
+            return row
+
+    def set_vector(self, row: int, vector):
+        """Store the embedding of a previously reserved row."""
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            if self._matrix is None:
+                self._matrix = np.zeros((self.capacity, vector.shape[-1]), dtype=self.dtype)
+            if self.dtype == np.int8:
+                scale = float(np.abs(vector).max()) / 127 or 1.0
+                self._matrix[row] = np.round(vector / scale).astype(np.int8)
+                self._scales[row] = scale
+            else:
+                self._matrix[row] = vector
+            self._norms[row] = np.linalg.norm(self._dequantize(row, row + 1)[0])
+            self._filled[row] = True
+
+    def _dequantize(self, start: int, stop: int) -> np.ndarray:
+        block = self._matrix[start:stop]
+        if self.dtype == np.float32:
+            return block
+        block = block.astype(np.float32)
+        if self.dtype == np.int8:
+            block *= self._scales[start:stop, None]
+        return block
+
+    def vector(self, row: int) -> Optional[np.ndarray]:
+        """
+        Return the float32 embedding of `row`, or None if it has not been filled in yet.
+
+        For float32 storage this is a view into the matrix, not a copy.
+        """
+        with self._lock:
+            if row >= self._size or not self._filled[row]:
+                return None
+            return self._dequantize(row, row + 1)[0]
+
+    def remove(self, item: Any):
+        """
+        Forget the row of `item`. The last row is freed for the next `add`; an earlier row
+        is only emptied, so the rows of later items keep their numbers.
+
+        A vector still being computed for the row must be delivered before this is called,
+        or it would land in the row of whichever item is added next.
+        """
+        with self._lock:
+            row = self._row_by_id.pop(id(item), None)
+            if row is None:
+                return
+            self._filled[row] = False
+            self._norms[row] = 0.0
+            self._scales[row] = 1.0
+            if row == self._size - 1:
+                self._size -= 1
+
+    def row_of(self, item: Any) -> Optional[int]:
+        return self._row_by_id.get(id(item))
+
+    def search(
+        self, query, k: int, candidates: Sequence[Any]
+    ) -> List[Tuple[Any, float]]:
+        """
+        Return the `k` candidates most cosine-similar to `query`, best first.
+
+        Scores are computed for the whole matrix with matrix-vector products and then
+        restricted to the rows of `candidates`; candidates without a vector are skipped.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        with self._lock:
+            if self._matrix is None or k <= 0:
+                return []
+            rows = [self._row_by_id.get(id(item)) for item in candidates]
+            filled, size = self._filled, self._size
+            scores = np.empty(size, dtype=np.float32)
+            for start in range(0, size, SEARCH_CHUNK_ROWS):
+                stop = min(start + SEARCH_CHUNK_ROWS, size)
+                scores[start:stop] = self._dequantize(start, stop) @ query
+            scores /= self._norms[:size] * np.linalg.norm(query) + 1e-12
+
+        picked = [(i, row) for i, row in enumerate(rows) if row is not None and filled[row]]
+        if not picked:
+            return []
+        positions = np.fromiter((i for i, _ in picked), dtype=np.int64, count=len(picked))
+        picked_rows = np.fromiter((row for _, row in picked), dtype=np.int64, count=len(picked))
+        candidate_scores = scores[picked_rows]
+
+        k = min(k, len(candidate_scores))
+        top = np.argpartition(-candidate_scores, k - 1)[:k]
+        top = top[np.argsort(-candidate_scores[top], kind="stable")]
+        return [(candidates[positions[i]], float(candidate_scores[i])) for i in top]
+
+
+def mmr_rank(candidates, query=None, existing=None, k: Optional[int] = None, diversity: float = 0.5) -> List[int]:
+    """
+    Order `candidates` by maximal marginal relevance, best first.
+
+    Each pick maximizes (1 - diversity) * sim(candidate, query) - diversity * max sim to the
+    `existing` vectors and to the candidates picked before it. Inputs are matrices of
+    L2-normalized rows (`query` a single vector); without a query every candidate is
+    equally relevant, so the ranking is by novelty alone.
+    """
+    candidates = np.asarray(candidates, dtype=np.float32)
+    n = len(candidates)
+    k = n if k is None else min(k, n)
+    relevance = candidates @ np.asarray(query, dtype=np.float32) if query is not None else np.zeros(n, np.float32)
+    redundancy = np.full(n, -1.0, dtype=np.float32)
+    if existing is not None and len(existing):
+        redundancy = (candidates @ np.asarray(existing, dtype=np.float32).T).max(axis=1)
+    picked: List[int] = []
+    remaining = list(range(n))
+    while remaining and len(picked) < k:
+        scores = (1 - diversity) * relevance[remaining] - diversity * np.maximum(redundancy[remaining], 0)
+        best = remaining.pop(int(np.argmax(scores)))
+        picked.append(best)
+        redundancy = np.maximum(redundancy, candidates @ candidates[best])
+    return picked
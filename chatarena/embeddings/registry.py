@@ -0,0 +1,107 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Union
+
+from .encoders import load_encoder
+
+# The models MessagePool uses by default, keyed by how messages are routed to them:
+# "qa" embeds text/ref messages and "sym" embeds every other message type.
+# Values are encoder specs, see chatarena.embeddings.encoders.
+DEFAULT_EMBEDDING_MODELS = {
+    "qa": "multi-qa-mpnet-base-cos-v1",
+    "sym": "all-mpnet-base-v2",
+}
+
+
+@dataclass
+class ModelLoadStats:
+    """Load time and parameter memory of a model held by the registry."""
+
+    name: str
+    load_seconds: float
+    memory_bytes: int
+
+
+_MODELS: Dict[str, Any] = {}
+_MODEL_STATS: Dict[str, ModelLoadStats] = {}
+_LOAD_LOCKS: Dict[str, threading.Lock] = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_model(name: str):
+    """
+    Return the process-wide encoder for the model spec `name`, loading it on first use.
+
+    Every MessagePool in the process shares the same instance, so the weights are read from
+    disk once no matter how many pools or arenas are created.
+    """
+    model = _MODELS.get(name)
+    if model is not None:
+        return model
+
+    with _REGISTRY_LOCK:
+        load_lock = _LOAD_LOCKS.setdefault(name, threading.Lock())
+    # Load different models concurrently, but never the same model twice
+    with load_lock:
+        model = _MODELS.get(name)
+        if model is None:
+            start = time.perf_counter()
+            model = load_encoder(name)
+            load_seconds = time.perf_counter() - start
+            stats = ModelLoadStats(name, load_seconds, model.memory_bytes)
+            logging.info(
+                f"Loaded embedding model {name} in {stats.load_seconds:.2f}s "
+                f"({stats.memory_bytes / 2 ** 20:.1f} MiB)"
+            )
+            _MODEL_STATS[name] = stats
+            _MODELS[name] = model
+    return model
+
+
+class LazyModel:
+    """Stand-in for a registry model that is only loaded when it first encodes something."""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def encode(self, *args, **kwargs):
+        return get_model(self.name).encode(*args, **kwargs)
+
+
+def embeddings_enabled(embeddings: Union[bool, str, None]) -> bool:
+    """Interpret an `embeddings` config value: False, "off" and "false" turn embeddings off."""
+    if isinstance(embeddings, str):
+        return embeddings.strip().lower() not in ("off", "false", "no", "0")
+    return embeddings is None or bool(embeddings)
+
+
+def resolve_models(
+    embedding_models: Optional[Dict[str, Optional[str]]] = None,
+    embeddings: Union[bool, str, None] = True,
+) -> Dict[str, str]:
+    """
+    Merge `embedding_models` over the defaults and drop the disabled entries.
+
+    A model name of None, "" or "off" disables that key; `embeddings="off"` disables all.
+    """
+    if not embeddings_enabled(embeddings):
+        return {}
+    models = dict(DEFAULT_EMBEDDING_MODELS)
+    if embedding_models:
+        models.update(embedding_models)
+    return {key: name for key, name in models.items() if name and name != "off"}
+
+
+def model_stats() -> Dict[str, ModelLoadStats]:
+    """Return the load statistics of every model loaded so far."""
+    return dict(_MODEL_STATS)
+
+
+def clear_models():
+    """Drop every loaded model so that the next get_model() call reloads it."""
+    with _REGISTRY_LOCK:
+        _MODELS.clear()
+        _MODEL_STATS.clear()
+        _LOAD_LOCKS.clear()
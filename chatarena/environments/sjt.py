@@ -1,11 +1,25 @@
-from typing import List, Union
+from typing import Dict, List, Optional, Union
 
 from ..agent import SIGNAL_END_OF_CONVERSATION, Moderator
 from ..config import AgentConfig, EnvironmentConfig
+from ..embeddings import DEFAULT_BATCH_SIZE, DEFAULT_FLUSH_INTERVAL
 from ..message import Message, MessagePool, Question, QuestionPool
 from .base import Environment, TimeStep, register_env
 
 
+def split_action(action):
+    """
+    Split a backend output into (message content, trace).
+
+    When query() returns AgentOutput(final_answer, round_records), only the final answer
+    becomes the content, which is embedded and shown to later players; the round records
+    go to the message pool's TraceStore.
+    """
+    if isinstance(action, tuple):
+        return action[0], action[1]
+    return action, None
+
+
 @register_env
 class SJT_env(Environment):
     """
@@ -16,11 +30,45 @@ class SJT_env(Environment):
 
     type_name = "SJT_env"
     #给环境起一个类型名（SJT_env）
-    def __init__(self, player_names: List[str], parallel: bool = False, **kwargs):
-        super().__init__(player_names=player_names, parallel=parallel, **kwargs)
+    def __init__(
+        self,
+        player_names: List[str],
+        parallel: bool = False,
+        embedding_batch_size: int = DEFAULT_BATCH_SIZE,
+        embedding_flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        embedding_models: Optional[Dict[str, Optional[str]]] = None,
+        embedding_cache_dir: Optional[str] = None,
+        embedding_dtype: str = "float32",
+        embeddings: Union[bool, str] = True,
+        **kwargs,
+    ):
+        super().__init__(
+            player_names=player_names,
+            parallel=parallel,
+            embedding_batch_size=embedding_batch_size,
+            embedding_flush_interval=embedding_flush_interval,
+            embedding_models=embedding_models,
+            embedding_cache_dir=embedding_cache_dir,
+            embedding_dtype=embedding_dtype,
+            embeddings=embeddings,
+            **kwargs,
+        )
         #初始化环境
         self.parallel = parallel#是否开启并行对话，false
-        self.message_pool = MessagePool()#实例化 messagepool
+        self.embedding_batch_size = embedding_batch_size
+        self.embedding_flush_interval = embedding_flush_interval
+        self.embedding_models = embedding_models
+        self.embedding_cache_dir = embedding_cache_dir
+        self.embedding_dtype = embedding_dtype
+        self.embeddings = embeddings
+        self.message_pool = MessagePool(
+            embedding_batch_size=embedding_batch_size,
+            embedding_flush_interval=embedding_flush_interval,
+            embedding_models=embedding_models,
+            embedding_cache_dir=embedding_cache_dir,
+            embedding_dtype=embedding_dtype,
+            embeddings=embeddings,
+        )#实例化 messagepool
         self.question_pool = QuestionPool()
         self._current_turn = 0#当前题目生成轮次
         self._next_player_idx = 0#当前专家发言
@@ -40,6 +88,12 @@ class SJT_env(Environment):
             env_type=self.type_name,
             player_names=self.player_names,
             parallel=self.parallel,
+            embedding_batch_size=self.embedding_batch_size,
+            embedding_flush_interval=self.embedding_flush_interval,
+            embedding_models=self.embedding_models,
+            embedding_cache_dir=self.embedding_cache_dir,
+            embedding_dtype=self.embedding_dtype,
+            embeddings=self.embeddings,
         )
 
     def print(self):
@@ -49,6 +103,18 @@ class SJT_env(Environment):
         """Get the next player."""
         return self.player_names[self._next_player_idx]
 
+    def get_next_players(self) -> List[str]:
+        """
+        Get the players that can act concurrently in the next step.
+
+        In parallel mode every player that has not spoken yet in the current turn only
+        observes earlier turns, so they can act at the same time; otherwise this is just
+        the next player.
+        """
+        if self.parallel:
+            return self.player_names[self._next_player_idx:]
+        return [self.get_next_player()]
+
     def get_observation(self, player_name=None) -> List[Message]:
         """Get observation for the player."""
         if player_name is None:
@@ -77,15 +143,18 @@ class SJT_env(Environment):
             player_name: the name of the player that takes the action
             action: the action that the agents wants to take
         """
+        content, trace = split_action(action)
         message = Message(
-            agent_name=player_name, content=action, turn=self._current_turn
+            agent_name=player_name, content=content, turn=self._current_turn, trace=trace
         )
         self.message_pool.append_message(message)
+        if isinstance(content, str):
+            self.message_pool.item_store.add(player_name, content)
 
-        # Update the counters
+        # Update the counters; in parallel mode the turn only advances once every player has spoken
+        self._next_player_idx = (self._next_player_idx + 1) % self.num_players
         if not self.parallel or self._next_player_idx == 0:
             self._current_turn += 1
-        self._next_player_idx = (self._next_player_idx + 1) % self.num_players
 
         timestep = TimeStep(
             observation=self.get_observation(),
@@ -141,6 +210,12 @@ class ModeratedConversation(SJT_env):
             env_type=self.type_name,
             player_names=self.player_names,
             parallel=self.parallel,
+            embedding_batch_size=self.embedding_batch_size,
+            embedding_flush_interval=self.embedding_flush_interval,
+            embedding_models=self.embedding_models,
+            embedding_cache_dir=self.embedding_cache_dir,
+            embedding_dtype=self.embedding_dtype,
+            embeddings=self.embeddings,
             moderator=self.moderator.to_config(),
             moderator_visibility=self.moderator_visibility,
             moderator_period=self.moderator_period,
@@ -154,10 +229,13 @@ class ModeratedConversation(SJT_env):
             player_name: the name of the player that takes the action
             action: the action that the agents wants to take
         """
+        content, trace = split_action(action)
         message = Message(
-            agent_name=player_name, content=action, turn=self._current_turn
+            agent_name=player_name, content=content, turn=self._current_turn, trace=trace
         )
         self.message_pool.append_message(message)
+        if isinstance(content, str):
+            self.message_pool.item_store.add(player_name, content)
 
         # Round-robin order for the next player
         self._next_player_idx = (self._next_player_idx + 1) % self.num_players
@@ -167,12 +245,13 @@ class ModeratedConversation(SJT_env):
         ):
             # Moderator's turn
             moderator_history = self.message_pool.get_all_messages()
-            moderator_response = self.moderator(moderator_history)
+            moderator_response, moderator_trace = split_action(self.moderator(moderator_history))
             moderator_message = Message(
                 agent_name=self.moderator.name,
                 content=moderator_response,
                 turn=self._current_turn,
                 visible_to=self.moderator_visibility,
+                trace=moderator_trace,
             )
             self.message_pool.append_message(moderator_message)
             terminal = (
@@ -0,0 +1,212 @@
+"""
+Buffered log files written by a background thread.
+
+Everything that appends to log files on the hot path (the moderator log, the dialog
+transcript) goes through the process-wide LogWriter instead of opening and closing the
+file for every line. Lines are queued in a bounded buffer. A single writer thread keeps
+the files open, fsyncs them periodically, and rotates them by size. Each conversation
+writes to its own file, named after MessagePool.conversation_id, so concurrent arenas in
+one process never interleave lines.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+DEFAULT_MAX_BUFFERED = 10000
+DEFAULT_FSYNC_INTERVAL = 1.0
+DEFAULT_MAX_BYTES = 10 * 2 ** 20
+DEFAULT_BACKUP_COUNT = 5
+DEFAULT_MAX_OPEN_FILES = 64
+# Seconds flush() and close() wait for the writer thread before giving up
+DEFAULT_FLUSH_TIMEOUT = 30.0
+# Directory that conversation logs are written to; defaults to the working directory
+LOG_DIR_ENV = "CHATARENA_LOG_DIR"
+
+
+def conversation_log_path(name: str, conversation_id: str, log_dir: Optional[str] = None) -> str:
+    """Return the path of the `name` log of a conversation, e.g. moderator_log_<id>.md."""
+    if log_dir is None:
+        log_dir = os.environ.get(LOG_DIR_ENV, "")
+    stem, ext = os.path.splitext(name)
+    return os.path.join(log_dir, f"{stem}_{conversation_id}{ext}")
+
+
+class LogWriter:
+    """Append text to files from a background thread with bounded buffering."""
+
+    def __init__(
+        self,
+        max_buffered: int = DEFAULT_MAX_BUFFERED,
+        fsync_interval: float = DEFAULT_FSYNC_INTERVAL,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        backup_count: int = DEFAULT_BACKUP_COUNT,
+        max_open_files: int = DEFAULT_MAX_OPEN_FILES,
+    ):
+        """
+        Initialize the writer.
+
+        Parameters:
+            max_buffered (int): Maximum number of queued writes; `write` blocks when full.
+            fsync_interval (float): Seconds between flushing and fsyncing the open files.
+            max_bytes (int): Size at which a file is rotated to `<path>.1`; 0 disables rotation.
+            backup_count (int): Number of rotated files to keep.
+            max_open_files (int): Least recently written files beyond this many are closed.
+        """
+        self.fsync_interval = fsync_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.max_open_files = max_open_files
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_buffered)
+        self._files: "OrderedDict[str, object]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    def write(self, path: str, text: str):
+        """Queue `text` to be appended to `path`."""
+        if self._closed:
+            raise RuntimeError("LogWriter is closed")
+        self._ensure_thread()
+        self._queue.put((path, text))
+
+    def flush(self, timeout: Optional[float] = DEFAULT_FLUSH_TIMEOUT) -> bool:
+        """
+        Wait until every queued write has been written and synced to disk.
+
+        Returns False if that did not happen within `timeout` seconds (None waits forever).
+        """
+        thread = self._thread
+        if thread is None:
+            return True
+        if not thread.is_alive():
+            return False
+        done = threading.Event()
+        try:
+            self._queue.put((None, done), timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def close(self, timeout: Optional[float] = DEFAULT_FLUSH_TIMEOUT):
+        """
+        Write out everything queued, close the files and stop the writer thread.
+
+        Gives up after `timeout` seconds (None waits forever) rather than hanging the caller,
+        e.g. at interpreter exit.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        thread, self._thread = self._thread, None
+        if thread is None or not thread.is_alive():
+            return
+        try:
+            self._queue.put((None, None), timeout=timeout)
+        except queue.Full:
+            logging.warning("LogWriter queue is full; closing without writing it out")
+            return
+        thread.join(timeout)
+        if thread.is_alive():
+            logging.warning(f"LogWriter did not finish writing within {timeout} seconds")
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="LogWriter", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        last_sync = time.monotonic()
+        while True:
+            timeout = max(0.0, self.fsync_interval - (time.monotonic() - last_sync))
+            try:
+                path, item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                path, item = None, False
+            try:
+                if path is not None:
+                    self._append(path, item)
+                elif item is not False:  # flush request (an Event) or shutdown (None)
+                    self._sync()
+                    last_sync = time.monotonic()
+                if time.monotonic() - last_sync >= self.fsync_interval:
+                    self._sync()
+                    last_sync = time.monotonic()
+            except Exception:
+                # a bad line or file must not stop the thread: every later write would be lost
+                logging.exception(f"Failed to write log file {path}")
+            finally:
+                # whatever happened, release whoever waits on this request
+                if path is None and item is None:
+                    self._close_files()
+                elif isinstance(item, threading.Event):
+                    item.set()
+            if path is None and item is None:
+                return
+
+    def _open(self, path: str):
+        f = self._files.get(path)
+        if f is None:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            f = open(path, "a", encoding="utf-8")
+            self._files[path] = f
+            while len(self._files) > self.max_open_files:
+                _, oldest = self._files.popitem(last=False)
+                oldest.close()
+        else:
+            self._files.move_to_end(path)
+        return f
+
+    def _append(self, path: str, text: str):
+        f = self._open(path)
+        if self.max_bytes and f.tell() + len(text.encode("utf-8")) > self.max_bytes and f.tell() > 0:
+            self._rotate(path)
+            f = self._open(path)
+        f.write(text)
+
+    def _rotate(self, path: str):
+        self._files.pop(path).close()
+        if self.backup_count <= 0:
+            os.remove(path)
+            return
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{path}.{i}"):
+                os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+        os.replace(path, f"{path}.1")
+
+    def _sync(self):
+        for path, f in list(self._files.items()):
+            try:
+                f.flush()
+                os.fsync(f.fileno())
+            except OSError:
+                logging.exception(f"Failed to sync log file {path}")
+
+    def _close_files(self):
+        for path, f in self._files.items():
+            try:
+                f.close()
+            except Exception:
+                logging.exception(f"Failed to close log file {path}")
+        self._files.clear()
+
+
+_LOG_WRITER: Optional[LogWriter] = None
+_LOG_WRITER_LOCK = threading.Lock()
+
+
+def get_log_writer() -> LogWriter:
+    """Return the process-wide LogWriter, which is closed (and thus flushed) at exit."""
+    global _LOG_WRITER
+    with _LOG_WRITER_LOCK:
+        if _LOG_WRITER is None:
+            _LOG_WRITER = LogWriter()
+            atexit.register(_LOG_WRITER.close)
+        return _LOG_WRITER
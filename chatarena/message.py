@@ -1,16 +1,37 @@
 import hashlib
+import json
+import threading
 import time
+from bisect import bisect_left
+from collections import deque
 from dataclasses import dataclass
-from typing import List, Union
+from typing import TYPE_CHECKING, Dict, FrozenSet, List, NamedTuple, Optional, Tuple, Union
 from uuid import uuid1
-from sentence_transformers import SentenceTransformer
-import torch
+import numpy as np
 import os
 import sys
 import re
+
+from .embeddings import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_FLUSH_INTERVAL,
+    EmbeddingEngine,
+    LazyModel,
+    VectorIndex,
+    get_embedding_cache,
+    get_model,
+    resolve_models,
+)
+from .logsink import conversation_log_path, get_log_writer
+
+if TYPE_CHECKING:
+    import torch
+
 # Preserved roles
 SYSTEM_NAME = "System"
 MODERATOR_NAME = "Moderator"
+# Author of the self-report message every SJT run starts from
+SELF_REPORT_NAME = "Self_report"
 
 
 def _hash(input: str):
@@ -19,17 +40,249 @@ def _hash(input: str):
     return hex_dig
 
 
-@dataclass
+def normalize_visibility(visible_to: Union[str, List[str]]) -> Union[str, FrozenSet[str]]:
+    """Normalize `visible_to` to "all" or a frozenset of player names."""
+    if visible_to == "all":
+        return "all"
+    if isinstance(visible_to, str):
+        return frozenset((visible_to,))
+    return frozenset(visible_to)
+
+
+# Dimension of the zero embedding returned for messages that have not been embedded
+EMBEDDING_DIM = 768
+# Items an ItemStore keeps per agent; older ones are forgotten
+DEFAULT_MAX_ITEMS = 1000
+
+
+class AgentOutput(NamedTuple):
+    """
+    Structured result of a backend query: the final answer and the trace that produced it.
+
+    Environments store `answer` as the message content and `round_records` (the answer,
+    reflection and revision of every reflection round) as the message trace. Only the
+    content is embedded and shown to later players. It is still a tuple, so
+    `answer, round_records = backend.query(...)` keeps working.
+    """
+
+    answer: str
+    round_records: List[dict]
+
+
+class TraceStore:
+    """
+    Side store of message traces, kept out of Message.content.
+
+    Traces are held as compact JSON and only decoded when `Message.trace` is read. With a
+    `path`, every trace is also appended to that JSONL file through the log writer.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._traces: Dict[int, str] = {}
+        self._next_key = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._traces)
+
+    def put(self, trace) -> int:
+        """Store `trace` (any JSON-serializable value) and return its key."""
+        encoded = json.dumps(trace, ensure_ascii=False, default=str)
+        with self._lock:
+            key = self._next_key
+            self._next_key += 1
+            self._traces[key] = encoded
+        if self.path:
+            get_log_writer().write(self.path, f'{{"key": {key}, "trace": {encoded}}}\n')
+        return key
+
+    def discard(self, key: int):
+        """Drop the trace stored under `key` from memory (the JSONL file is append-only)."""
+        with self._lock:
+            self._traces.pop(key, None)
+
+    def get(self, key: int):
+        encoded = self._traces.get(key)
+        return json.loads(encoded) if encoded is not None else None
+
+    def clear(self):
+        with self._lock:
+            self._traces.clear()
+
+
+class ItemStore:
+    """
+    Outputs generated so far in a run (e.g. the SJT items of a whole batch), per agent.
+
+    Candidate selection steers new outputs away from the ones stored here. Every pool has
+    its own store by default; pools that share one (run_sjt --batch gives all its arenas
+    the same store) also avoid repeating the items of other runs. The store is not
+    cleared by MessagePool.reset. Only the newest `max_items` per agent are kept.
+    """
+
+    def __init__(self, max_items: int = DEFAULT_MAX_ITEMS):
+        self.max_items = max_items
+        self._items: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(items) for items in self._items.values())
+
+    def add(self, agent_name: str, item: str):
+        with self._lock:
+            items = self._items.get(agent_name)
+            if items is None:
+                items = self._items[agent_name] = deque(maxlen=self.max_items)
+            items.append(item)
+
+    def items(self, agent_name: str) -> List[str]:
+        """The stored outputs of `agent_name`, oldest first."""
+        with self._lock:
+            return list(self._items.get(agent_name, ()))
+
+
 class Message:
-    agent_name: str
-    content: Union[str, List[Union[str, int]]]
-    turn: int
-    timestamp: int = time.time_ns()
-    visible_to: Union[str, List[str]] = "all"
-    importance: int = 1
-    msg_type: str = "text"
-    logged: bool = False  # Whether the message is logged in the database
-    embedding: torch.FloatTensor = torch.zeros((768,), dtype=torch.float32)
+    """
+    A message in the conversation.
+
+    Messages are slotted to keep long-running pools small. The embedding is not stored on
+    the message itself: MessagePool binds each message to a row of its shared VectorIndex
+    and the tensor is only materialized when `embedding` is read.
+    """
+
+    __slots__ = (
+        "agent_name",
+        "content",
+        "turn",
+        "timestamp",
+        "_visible_to",
+        "importance",
+        "msg_type",
+        "logged",  # Whether the message is logged in the database
+        "_embedding",
+        "_embedding_index",
+        "_embedding_row",
+        "_trace",  # Trace not yet moved to a TraceStore
+        "_trace_store",
+        "_trace_key",
+        "_seq",  # Position in the order messages were added to the pool
+    )
+
+    def __init__(
+        self,
+        agent_name: str,
+        content: Union[str, List[Union[str, int]]],
+        turn: int,
+        timestamp: int = None,
+        visible_to: Union[str, List[str]] = "all",
+        importance: int = 1,
+        msg_type: str = "text",
+        logged: bool = False,
+        embedding: "torch.FloatTensor" = None,
+        trace=None,
+    ):
+        self.agent_name = agent_name
+        self.content = content
+        self.turn = turn
+        self.timestamp = time.time_ns() if timestamp is None else timestamp
+        self.visible_to = visible_to
+        self.importance = importance
+        self.msg_type = msg_type
+        self.logged = logged
+        self._embedding = embedding
+        self._embedding_index = None
+        self._embedding_row = None
+        self._trace = trace
+        self._trace_store = None
+        self._trace_key = None
+        self._seq = -1
+
+    @property
+    def visible_to(self) -> Union[str, FrozenSet[str]]:
+        """Either "all" or the set of player names that can see the message."""
+        return self._visible_to
+
+    @visible_to.setter
+    def visible_to(self, value: Union[str, List[str]]):
+        self._visible_to = normalize_visibility(value)
+
+    @property
+    def visibility(self) -> Union[str, List[str]]:
+        """JSON-serializable form of `visible_to`: "all" or a sorted list of names."""
+        return "all" if self._visible_to == "all" else sorted(self._visible_to)
+
+    def is_visible_to(self, agent_name: str) -> bool:
+        return (
+            self._visible_to == "all"
+            or agent_name in self._visible_to
+            or agent_name == MODERATOR_NAME
+        )
+
+    @property
+    def embedding(self) -> "torch.FloatTensor":
+        import torch  # torch is only needed once an embedding is actually read
+
+        if self._embedding_index is not None:
+            vector = self._embedding_index.vector(self._embedding_row)
+            if vector is not None:
+                return torch.from_numpy(vector)
+        if self._embedding is not None:
+            return self._embedding
+        return torch.zeros((EMBEDDING_DIM,), dtype=torch.float32)
+
+    @embedding.setter
+    def embedding(self, value: "torch.FloatTensor"):
+        self._embedding = value
+        self._embedding_index = None
+        self._embedding_row = None
+
+    def bind_embedding(self, index: VectorIndex, row: int):
+        """Point the message's embedding at `row` of `index`."""
+        self._embedding = None
+        self._embedding_index = index
+        self._embedding_row = row
+
+    @property
+    def trace(self):
+        """How the content was produced (e.g. the reflection round records), or None."""
+        if self._trace_store is not None:
+            return self._trace_store.get(self._trace_key)
+        return self._trace
+
+    def bind_trace(self, store: TraceStore, key: int):
+        """Point the message's trace at entry `key` of `store`."""
+        self._trace = None
+        self._trace_store = store
+        self._trace_key = key
+
+    def _fields(self):
+        return (
+            self.agent_name,
+            self.content,
+            self.turn,
+            self.timestamp,
+            self.visible_to,
+            self.importance,
+            self.msg_type,
+            self.logged,
+        )
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    __hash__ = None
+
+    def __repr__(self):
+        return (
+            f"Message(agent_name={self.agent_name!r}, content={self.content!r}, turn={self.turn!r}, "
+            f"timestamp={self.timestamp!r}, visible_to={self.visibility!r}, importance={self.importance!r}, "
+            f"msg_type={self.msg_type!r}, logged={self.logged!r})"
+        )
+
     @property
     def msg_hash(self):
         # Generate a unique message id given the content, timestamp and role
@@ -39,14 +292,112 @@ class Message:
 
 
 class MessagePool:
-    def __init__(self):
-        """Initialize the MessagePool with a unique conversation ID."""
+    def __init__(
+        self,
+        embedding_batch_size: int = DEFAULT_BATCH_SIZE,
+        embedding_flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        embedding_models: Optional[Dict[str, Optional[str]]] = None,
+        embedding_cache_dir: Optional[str] = None,
+        embedding_dtype: str = "float32",
+        embeddings: Union[bool, str] = True,
+        item_store: Optional[ItemStore] = None,
+    ):
+        """
+        Initialize the MessagePool with a unique conversation ID.
+
+        Embedding models are loaded on first use, not when the pool is created.
+
+        Parameters:
+            embeddings (Union[bool, str]): Set to False or "off" to never embed messages; the pool
+                then never imports torch or sentence_transformers.
+            embedding_models (Dict[str, Optional[str]]): Overrides for the "qa" and "sym" embedding
+                models. Set a key to None or "off" to leave those messages without embeddings.
+            embedding_cache_dir (str): Directory of the persistent embedding cache. Defaults to
+                $CHATARENA_EMBEDDING_CACHE_DIR; the cache is memory only when neither is set.
+            embedding_dtype (str): Storage type of the embedding matrix: "float32", or "float16"
+                and "int8" to trade some precision for memory.
+            embedding_batch_size (int): Number of queued messages that triggers an embedding batch.
+            embedding_flush_interval (float): Maximum seconds a message waits for its embedding.
+                Use 0 to embed every message synchronously when it is appended.
+            item_store (ItemStore): Store of the outputs generated so far, shared by the pools of
+                a run. Defaults to a store of this pool's own.
+        """
         self.conversation_id = str(uuid1())
         self._last_message_idx = 0
+        self.moderator_log_path = conversation_log_path("moderator_log.md", self.conversation_id)
+        # Reflection traces of agent outputs, kept out of the content and loaded on demand
+        self.trace_store = TraceStore()
+        # Outputs generated so far, which new outputs should not repeat
+        self.item_store = item_store if item_store is not None else ItemStore()
         os.environ["TOKENIZERS_PARALLELISM"] = "false"
-        self.model_qa = SentenceTransformer('multi-qa-mpnet-base-cos-v1')
-        self.model_sym = SentenceTransformer('all-mpnet-base-v2')
+        # Models come from the process-wide registry and are shared by every pool
+        model_names = resolve_models(embedding_models, embeddings)
+        encoders = {key: LazyModel(name) for key, name in model_names.items()}
+        self._model_names = model_names
+        self.embedding_engine = EmbeddingEngine(
+            encoders,
+            batch_size=embedding_batch_size,
+            flush_interval=embedding_flush_interval,
+            cache=get_embedding_cache(embedding_cache_dir),
+            model_names=model_names,
+        )
+        # One contiguous embedding matrix per model, rows in append order
+        self._vector_indexes = {key: VectorIndex(dtype=embedding_dtype) for key in encoders}
         self._messages: List[Message] = []
+        self._next_seq = 0
+        self._last_insert_seq = -1
+        # Sequence number of the newest message each agent has observed via get_new_messages
+        self._cursors: Dict[str, int] = {}
+        self._rebuild_indexes()
+
+    @property
+    def model_qa(self):
+        name = self._model_names.get("qa")
+        return get_model(name) if name else None
+
+    @property
+    def model_sym(self):
+        name = self._model_names.get("sym")
+        return get_model(name) if name else None
+
+    def _rebuild_indexes(self):
+        # Turn of every message, parallel to self._messages
+        self._turns: List[int] = []
+        # Per-agent (messages, turns) of the messages visible to the agent, in pool order.
+        # Built lazily the first time an agent is queried, then kept up to date on append.
+        self._visible: Dict[str, Tuple[List[Message], List[int]]] = {}
+        # While turns never decrease in pool order, a turn cutoff selects a prefix and
+        # can be found with bisect; otherwise lookups fall back to a linear scan.
+        self._turn_ordered = True
+        for message in self._messages:
+            self._index_message(message)
+
+    def _index_message(self, message: Message):
+        """Add a message at the end of the pool order to the indexes."""
+        if self._turns and message.turn < self._turns[-1]:
+            self._turn_ordered = False
+        self._turns.append(message.turn)
+        if message._seq < 0:
+            message._seq = self._next_seq
+            self._next_seq += 1
+        if message.visible_to == "all":
+            agents = self._visible.keys()
+        else:
+            agents = [name for name in message.visible_to if name in self._visible]
+        for agent_name in agents:
+            messages, turns = self._visible[agent_name]
+            messages.append(message)
+            turns.append(message.turn)
+
+    def _visible_index(self, agent_name: str) -> Tuple[List[Message], List[int]]:
+        if agent_name == MODERATOR_NAME:
+            return self._messages, self._turns
+        index = self._visible.get(agent_name)
+        if index is None:
+            messages = [message for message in self._messages if message.is_visible_to(agent_name)]
+            index = (messages, [message.turn for message in messages])
+            self._visible[agent_name] = index
+        return index
 
     def save_exps_to(self, exps_path_to, current_game_number, is_incremental=False):
         if is_incremental:
@@ -64,7 +415,29 @@ class MessagePool:
 
     def reset(self):
         """Clear the message pool."""
+        self.flush_embeddings()
         self._messages = []
+        self._next_seq = 0
+        self._last_insert_seq = -1
+        self._cursors = {}
+        self._rebuild_indexes()
+        for index in self._vector_indexes.values():
+            index.reset()
+        self.trace_store.clear()
+
+    def close(self):
+        """Embed whatever is still pending and stop the embedding worker; the pool stays readable."""
+        self.embedding_engine.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _store_trace(self, message: Message):
+        if message._trace is not None:
+            message.bind_trace(self.trace_store, self.trace_store.put(message._trace))
 
     def give_importance(self, message: Message):
         content = message.content if message.msg_type in ("text", "ref") else message.content[0]
@@ -88,26 +461,141 @@ class MessagePool:
         if hasattr(message, "importance") and message.importance == 0:
             return
         content = message.content if message.msg_type in ("text", "ref") else message.content[0]
-        if message.msg_type in ("text", "ref"):
-            message.embedding = torch.tensor(self.model_qa.encode(content), dtype=torch.float32)
-        else:
-            message.embedding = torch.tensor(self.model_sym.encode(content), dtype=torch.float32)
+        model_key = "qa" if message.msg_type in ("text", "ref") else "sym"
+        self._submit_embedding(message, model_key, content)
+        self._store_trace(message)
         #self.give_importance(message)
         self._messages.append(message)
+        self._index_message(message)
         if getattr(message, "agent_name", "") == "Moderator":
-            with open("moderator_log.md", "a", encoding="utf-8") as f:
-                output = f"**{message.agent_name} (-> {str(message.visible_to)})**: {message.content}"
-                f.write(output + "  \n")
+            output = f"**{message.agent_name} (-> {str(message.visibility)})**: {message.content}"
+            get_log_writer().write(self.moderator_log_path, output + "  \n")
 
     def append_message_at_index(self, message: Message, index: int):
-        message.embedding = torch.from_numpy(self.model_qa.encode(message.content))
+        self._submit_embedding(message, "qa", message.content)
+        self._store_trace(message)
         self.give_importance(message)
+        message._seq = self._next_seq
+        self._next_seq += 1
+        self._last_insert_seq = message._seq
         self._messages.insert(index, message)
+        # Inserting in the middle shifts every position, so rebuild the indexes
+        self._rebuild_indexes()
+
+    def pop_message(self) -> Message:
+        """
+        Remove and return the last message of the pool.
+
+        The message's embedding row, trace entry and index entries are released; the returned
+        message keeps its trace but no longer has an embedding. Agents whose `get_new_messages`
+        cursor was at the message will see the next appended message as new.
+        """
+        # Its embedding may still be pending, and the callback would fill a reused row
+        self.flush_embeddings()
+        message = self._messages.pop()
+        self._turns.pop()
+        for messages, turns in self._visible.values():
+            if messages and messages[-1] is message:
+                messages.pop()
+                turns.pop()
+        for index in self._vector_indexes.values():
+            index.remove(message)
+        message._embedding_index = None
+        message._embedding_row = None
+        if message._trace_store is not None:
+            message._trace = message.trace
+            message._trace_store.discard(message._trace_key)
+            message._trace_store = None
+            message._trace_key = None
+        if message._seq == self._next_seq - 1:
+            # The newest message: reuse its sequence number and move cursors back before it
+            self._next_seq -= 1
+            for agent_name, seen in self._cursors.items():
+                if seen >= message._seq:
+                    self._cursors[agent_name] = message._seq - 1
+            if self._last_insert_seq >= message._seq:
+                self._last_insert_seq = -1
+        message._seq = -1
+        return message
+
+    def _submit_embedding(self, message: Message, model_key: str, content):
+        """Queue the message content for encoding; `message.embedding` is filled when its batch is done."""
+        if model_key not in self.embedding_engine.encoders:  # this model is turned off
+            return
+        if not isinstance(content, str):
+            content = str(content)
+        index = self._vector_indexes[model_key]
+        row = index.add(message)
+        message.bind_embedding(index, row)
+        self.embedding_engine.submit(model_key, content, lambda vector: index.set_vector(row, vector))
+
+    def flush_embeddings(self):
+        """Block until every appended message has its embedding filled in."""
+        self.embedding_engine.flush()
+
+    def search(
+        self,
+        query,
+        k: int = 5,
+        agent_name: str = None,
+        turn_lt: int = None,
+        model_key: str = "qa",
+        candidates: List[Message] = None,
+    ) -> List[Tuple[Message, float]]:
+        """
+        Return the `k` messages most relevant to `query`, with their cosine similarity, best first.
+
+        Parameters:
+            query (Union[str, array-like]): The query text, or an already encoded query vector.
+            k (int): Maximum number of messages to return.
+            agent_name (str): Only search the messages visible to this agent, following the same
+                rules as get_visible_messages. Defaults to every message in the pool.
+            turn_lt (int): Only search the messages from turns before this one.
+            model_key (str): Which embedding space to search; only messages embedded by this model
+                are candidates.
+            candidates (List[Message]): Only search these messages of the pool, e.g. a prompt's
+                history. Takes the place of the agent_name and turn_lt filters.
+        """
+        index = self._vector_indexes.get(model_key)
+        if index is None:
+            return []
+        self.flush_embeddings()
+        if isinstance(query, str):
+            query = self.embedding_engine.encode(model_key, [query])[0]
+            if query is None:
+                return []
+
+        if candidates is None and agent_name is not None:
+            turn = turn_lt if turn_lt is not None else float("inf")
+            candidates = self.get_visible_messages(agent_name, turn=turn)
+        elif candidates is None and turn_lt is not None:
+            candidates = [message for message in self._messages if message.turn < turn_lt]
+        elif candidates is None:
+            candidates = self._messages
+        return index.search(query, k, candidates)
+
+    def embed(self, texts: List[str], model_key: str = "sym") -> Optional[np.ndarray]:
+        """L2-normalized embeddings of `texts`, one row per text, or None if the `model_key` model is off."""
+        if model_key not in self.embedding_engine.encoders:
+            return None
+        vectors = self.embedding_engine.encode(model_key, list(texts))
+        if any(v is None for v in vectors):
+            return None
+        matrix = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.clip(norms, 1e-12, None)
+
+    def similarity(self, a: str, b: str, model_key: str = "sym") -> Optional[float]:
+        """Cosine similarity of two texts in the `model_key` embedding space, or None if that model is off."""
+        vectors = self.embed([a, b], model_key)
+        if vectors is None:
+            return None
+        return float(np.dot(vectors[0], vectors[1]))
 
     def print(self):
         """Print all the messages in the pool."""
         for message in self._messages:
-            print(f"[{message.agent_name}->{message.visible_to}]: {message.content}")
+            print(f"[{message.agent_name}->{message.visibility}]: {message.content}")
 
     @property
     def last_turn(self):
@@ -130,18 +618,38 @@ class MessagePool:
         return self._messages
 
     def get_visible_messages(self, agent_name, turn: int) -> List[Message]:
+        """Return the messages from turns before `turn` that `agent_name` can see, in pool order."""
+        messages, turns = self._visible_index(agent_name)
+        if self._turn_ordered:
+            return messages[: bisect_left(turns, turn)]
+        return [message for message in messages if message.turn < turn]
+
+    def get_new_messages(self, agent_name, turn: int = None) -> List[Message]:
+        """
+        Return the messages visible to `agent_name` that were added since its previous call.
+
+        Parameters:
+            agent_name (str): The observing agent.
+            turn (int): If given, only return messages from turns before this one.
+        """
+        messages, turns = self._visible_index(agent_name)
+        seen = self._cursors.get(agent_name, -1)
+        if self._last_insert_seq > seen:
+            # A message was inserted in the middle since the last call, so new messages
+            # are not necessarily at the end
+            new_messages = [message for message in messages if message._seq > seen]
+        else:
+            start = len(messages)
+            while start > 0 and messages[start - 1]._seq > seen:
+                start -= 1
+            new_messages = messages[start:]
+        if turn is not None:
+            new_messages = [message for message in new_messages if message.turn < turn]
+        if new_messages:
+            self._cursors[agent_name] = max(message._seq for message in new_messages)
+        return new_messages
+
 
-        prev_messages = [message for message in self._messages if message.turn < turn]
-
-        visible_messages = []
-        for message in prev_messages:
-            if (
-                message.visible_to == "all"
-                or agent_name in message.visible_to
-                or agent_name == "Moderator"
-            ):
-                visible_messages.append(message)
-        return visible_messages
 @dataclass
 class Question:
     content: str
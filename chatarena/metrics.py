@@ -0,0 +1,242 @@
+"""
+Per-call metrics of LLM requests.
+
+Every chat completion request made by a backend is recorded as one CallMetrics record:
+the token usage (prompt, completion, and prompt tokens served from the provider's cache),
+wall time, retries, whether the response cache or an identical in-flight request
+answered it, and labels describing where the call came from. The model, player and
+phase are filled in by the backend. The arena,
+and the batch and item of run_sjt --batch, come from `metrics_labels` blocks that are
+active when the call is made. Labels are context variables, so they follow a call into
+asyncio tasks, and into executor threads when the context is copied.
+
+Records are kept in a bounded in-memory window for summaries. They are also appended to
+the JSONL file named by CHATARENA_METRICS_FILE, through the buffered log writer. Totals
+since start are exported in the Prometheus text format.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .logsink import get_log_writer
+
+# JSONL file that every call record is appended to; unset disables the file export
+METRICS_FILE_ENV = "CHATARENA_METRICS_FILE"
+DEFAULT_WINDOW = 100000
+
+_labels: "contextvars.ContextVar[Dict[str, str]]" = contextvars.ContextVar("chatarena_metrics_labels", default={})
+_current_call: "contextvars.ContextVar[Optional[CallMetrics]]" = contextvars.ContextVar(
+    "chatarena_current_call", default=None
+)
+
+
+@contextmanager
+def metrics_labels(**labels):
+    """Attach `labels` (e.g. arena=..., batch=..., item=...) to the calls made inside this block."""
+    token = _labels.set({**_labels.get(), **{k: str(v) for k, v in labels.items()}})
+    try:
+        yield
+    finally:
+        _labels.reset(token)
+
+
+def current_labels() -> Dict[str, str]:
+    return dict(_labels.get())
+
+
+@dataclass
+class CallMetrics:
+    """Measurements of one chat completion request, including its retries."""
+
+    model: str
+    player: Optional[str] = None
+    phase: Optional[str] = None
+    labels: Dict[str, str] = field(default_factory=dict)
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    wall_time: float = 0.0
+    retries: int = 0
+    cache_hit: bool = False
+    hedged: bool = False
+    hedge_won: bool = False
+    coalesced: bool = False  # answered by an identical request already in flight
+    # "ok", "error", or "discarded": the losing duplicate of a hedged call, recorded on its
+    # own once it finishes so that its tokens are counted
+    status: str = "ok"
+    timestamp: float = field(default_factory=time.time)
+
+    def add_usage(self, usage):
+        """Add the `usage` of a completion (an OpenAI usage object or a dict)."""
+        if usage is None:
+            return
+        if isinstance(usage, dict):
+            get = usage.get
+        else:
+            def get(key, default=None):
+                return getattr(usage, key, default)
+        self.prompt_tokens += get("prompt_tokens", 0) or 0
+        self.completion_tokens += get("completion_tokens", 0) or 0
+        details = get("prompt_tokens_details")
+        if details is not None:
+            cached = details.get("cached_tokens") if isinstance(details, dict) else getattr(details, "cached_tokens", 0)
+            self.cached_tokens += cached or 0
+
+
+def current_call() -> Optional[CallMetrics]:
+    """The record of the call being made in this context, if any."""
+    return _current_call.get()
+
+
+def count_retry(retry_state=None):
+    """tenacity `before_sleep` hook: count a retry of the current call."""
+    record = _current_call.get()
+    if record is not None:
+        record.retries += 1
+
+
+class MetricsRecorder:
+    """Collects CallMetrics: a bounded window of records, totals since start and the JSONL export."""
+
+    def __init__(self, window: int = DEFAULT_WINDOW, jsonl_path: Optional[str] = None):
+        self.jsonl_path = jsonl_path
+        self._records = deque(maxlen=window)
+        # (model, player, phase, status) -> totals, for the Prometheus export
+        self._totals: Dict[Tuple[str, str, str, str], Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, call: CallMetrics):
+        key = (call.model, call.player or "", call.phase or "", call.status)
+        with self._lock:
+            self._records.append(call)
+            totals = self._totals.setdefault(key, {
+                "calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0,
+                "wall_time": 0.0, "retries": 0, "cache_hits": 0, "hedges": 0, "hedge_wins": 0, "coalesced": 0,
+            })
+            totals["calls"] += 1
+            totals["prompt_tokens"] += call.prompt_tokens
+            totals["completion_tokens"] += call.completion_tokens
+            totals["cached_tokens"] += call.cached_tokens
+            totals["wall_time"] += call.wall_time
+            totals["retries"] += call.retries
+            totals["cache_hits"] += int(call.cache_hit)
+            totals["hedges"] += int(call.hedged)
+            totals["hedge_wins"] += int(call.hedge_won)
+            totals["coalesced"] += int(call.coalesced)
+        if self.jsonl_path:
+            get_log_writer().write(self.jsonl_path, json.dumps(asdict(call), ensure_ascii=False) + "\n")
+
+    @contextmanager
+    def track(self, model: str, player: Optional[str] = None, phase: Optional[str] = None):
+        """Measure the call made inside this block; the block may fill in usage via `current_call()`."""
+        call = CallMetrics(model=model, player=player, phase=phase, labels=current_labels())
+        token = _current_call.set(call)
+        start = time.perf_counter()
+        try:
+            yield call
+        except BaseException:
+            call.status = "error"
+            raise
+        finally:
+            call.wall_time = time.perf_counter() - start
+            _current_call.reset(token)
+            self.record(call)
+
+    def records(self, **labels) -> List[CallMetrics]:
+        """Records in the window whose labels (or model/player/phase) match all of `labels`."""
+        with self._lock:
+            records = list(self._records)
+        return [r for r in records if all(_field(r, k) == str(v) for k, v in labels.items())]
+
+    def summary(self, by: Iterable[str] = ("phase",), **labels) -> Dict[str, dict]:
+        """
+        Aggregate the matching records of the window, grouped by the given fields.
+
+        Fields are model, player, phase, status or any label (arena, batch, item, ...);
+        groups are keyed by their values joined with "/". `cached_token_rate` is the share
+        of prompt tokens the provider served from its prompt cache.
+        """
+        by = tuple(by)
+        groups: Dict[str, dict] = {}
+        for r in self.records(**labels):
+            key = "/".join(_field(r, k) or "-" for k in by)
+            g = groups.setdefault(key, {
+                "calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0,
+                "wall_time": 0.0, "retries": 0, "cache_hits": 0, "hedges": 0, "hedge_wins": 0, "coalesced": 0, "errors": 0,
+            })
+            g["calls"] += 1
+            g["prompt_tokens"] += r.prompt_tokens
+            g["completion_tokens"] += r.completion_tokens
+            g["cached_tokens"] += r.cached_tokens
+            g["wall_time"] = round(g["wall_time"] + r.wall_time, 3)
+            g["retries"] += r.retries
+            g["cache_hits"] += int(r.cache_hit)
+            g["hedges"] += int(r.hedged)
+            g["hedge_wins"] += int(r.hedge_won)
+            g["coalesced"] += int(r.coalesced)
+            g["errors"] += int(r.status == "error")
+        for g in groups.values():
+            g["cached_token_rate"] = round(g["cached_tokens"] / g["prompt_tokens"], 4) if g["prompt_tokens"] else 0.0
+        return groups
+
+    def prometheus_text(self) -> str:
+        """Totals since start in the Prometheus text exposition format."""
+        metrics = [
+            ("chatarena_llm_calls_total", "counter", "LLM requests", "calls"),
+            ("chatarena_llm_prompt_tokens_total", "counter", "Prompt tokens", "prompt_tokens"),
+            ("chatarena_llm_completion_tokens_total", "counter", "Completion tokens", "completion_tokens"),
+            ("chatarena_llm_cached_tokens_total", "counter", "Prompt tokens served from the provider cache", "cached_tokens"),
+            ("chatarena_llm_retries_total", "counter", "Retried attempts", "retries"),
+            ("chatarena_llm_response_cache_hits_total", "counter", "Calls answered by the response cache", "cache_hits"),
+            ("chatarena_llm_hedges_total", "counter", "Calls that sent a hedged duplicate", "hedges"),
+            ("chatarena_llm_hedge_wins_total", "counter", "Hedged calls answered by the duplicate", "hedge_wins"),
+            ("chatarena_llm_coalesced_total", "counter", "Calls answered by an identical in-flight request", "coalesced"),
+            ("chatarena_llm_wall_seconds_total", "counter", "Wall time of the calls, retries included", "wall_time"),
+        ]
+        with self._lock:
+            totals = {key: dict(value) for key, value in self._totals.items()}
+        lines = []
+        for name, kind, help_text, column in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (model, player, phase, status), value in sorted(totals.items()):
+                labels = ",".join(
+                    f'{k}="{_escape(v)}"' for k, v in
+                    (("model", model), ("player", player), ("phase", phase), ("status", status))
+                )
+                lines.append(f"{name}{{{labels}}} {value[column]}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+            self._totals.clear()
+
+
+def _field(record: CallMetrics, key: str) -> Optional[str]:
+    if key in ("model", "player", "phase", "status"):
+        return getattr(record, key)
+    return record.labels.get(key)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+_METRICS: Optional[MetricsRecorder] = None
+_METRICS_LOCK = threading.Lock()
+
+
+def get_metrics() -> MetricsRecorder:
+    """Return the process-wide recorder; CHATARENA_METRICS_FILE enables the JSONL export."""
+    global _METRICS
+    with _METRICS_LOCK:
+        if _METRICS is None:
+            _METRICS = MetricsRecorder(jsonl_path=os.environ.get(METRICS_FILE_ENV) or None)
+        return _METRICS
@@ -39,8 +39,8 @@ class ArenaCLI:
     def __init__(self, arena: Arena):
         self.arena = arena
 
-    def launch(self, max_steps: int = None, interactive: bool = True):
-        """Run the CLI."""
+    def launch(self, max_steps: int = None, interactive: bool = True, stream: bool = True):
+        """Run the CLI; with `stream`, the players' responses are printed as they are generated."""
         if not interactive and max_steps is None:
             max_steps = MAX_STEPS
 
@@ -78,6 +78,18 @@ class ArenaCLI:
 
         console.print("\n========= Arena Start! ==========\n", style="bold green")
 
+        streamed = set()  # players whose response of this step was already printed while streaming
+        stream_target = [None]
+
+        def render_delta(player_name, phase, text):
+            if stream_target[0] != (player_name, phase):
+                stream_target[0] = (player_name, phase)
+                header = Text(f"\n[{player_name} ({phase})]: ")
+                header.stylize(f"bold {name_to_color.get(player_name, 'red')}")
+                console.print(header, end="")
+            console.print(text, end="", markup=False, highlight=False)
+            streamed.add(player_name)
+
         step = 0
         while not timestep.terminal:
             if interactive:
@@ -135,8 +147,10 @@ class ArenaCLI:
                     console.print(f"Invalid command: {command}", style="bold red")
                     continue
 
+            streamed.clear()
+            stream_target[0] = None
             try:
-                timestep = self.arena.step()
+                timestep = self.arena.step(stream_callback=render_delta if stream else None)
             except HumanBackendError as e:
                 # Handle human input and recover with the game update
                 human_player_name = env.get_next_player()
@@ -159,17 +173,22 @@ class ArenaCLI:
                 console.print(f"Too many invalid actions: {e}", style="bold red")
                 break
 
+            if streamed:
+                console.print()
             # The messages that are not yet logged
             messages = [msg for msg in env.get_observation() if not msg.logged]
             # Print the new messages
             for msg in messages:
+                if msg.agent_name in streamed:
+                    msg.logged = True
+                    continue
                 message_text = Text(
-                    f"[{msg.agent_name}->{msg.visible_to}]: {msg.content}"
+                    f"[{msg.agent_name}->{msg.visibility}]: {msg.content}"
                 )
                 message_text.stylize(
                     f"bold {name_to_color[msg.agent_name]}",
                     0,
-                    len(f"[{msg.agent_name}->{msg.visible_to}]:"),
+                    len(f"[{msg.agent_name}->{msg.visibility}]:"),
                 )
                 console.print(message_text)
                 msg.logged = True
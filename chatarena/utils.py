@@ -77,6 +77,42 @@ def extract_code(text):
     return parsed_codes
 
 
+# CJK ideographs, kana, hangul and full-width punctuation: roughly one token per character
+_WIDE_CHARS = re.compile(r"[　-〿぀-ヿ㐀-䶿一-鿿가-힯＀-￯]")
+
+
+def estimate_tokens(text):
+    """
+    Estimates the number of tokens of a given string without a tokenizer.
+
+    Counts one token per CJK character and one per four characters of everything else,
+    which is within ~20% of the cl100k/o200k tokenizers on mixed Chinese/English prompts.
+
+    Parameters:
+        text (str): The string to be measured.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    if not text:
+        return 0
+    wide = len(_WIDE_CHARS.findall(text))
+    return wide + (len(text) - wide + 3) // 4
+
+
+def estimate_message_tokens(messages):
+    """
+    Estimates the prompt tokens of a list of chat messages ({"role", "content"} dicts).
+
+    Parameters:
+        messages (List[Dict]): The chat messages.
+
+    Returns:
+        int: The estimated number of tokens, including ~4 tokens of framing per message.
+    """
+    return sum(estimate_tokens(m.get("content") or "") + 4 for m in messages) + 3
+
+
 class AttributedDict(dict):
     """
     A dictionary class whose keys are automatically set as attributes of the class.
@@ -1,58 +1,68 @@
+import argparse
+import asyncio
+import csv
 import json
+import os
+import sys
+import time
+
+from chatarena import EXAMPLES_DIR
 from chatarena.arena import Arena
 from chatarena.config import ArenaConfig, BackendConfig
-from chatarena.message import Message
+from chatarena.message import SELF_REPORT_NAME, ItemStore, Message
 from chatarena.backends import load_backend
-from chatarena.config import BackendConfig
+from chatarena.backends.scheduler import request_lane
+from chatarena.logsink import conversation_log_path, get_log_writer
+from chatarena.metrics import get_metrics, metrics_labels
+
+DEFAULT_CONFIG_PATH = os.path.join(EXAMPLES_DIR, "sjt.json")
+DEFAULT_CONCURRENCY = 8
+
+MODERATOR_CONFIG = {
+    "role_desc": (
+        "你是SJT-agent项目的moderator，具有人格心理测评和语言表达评估的专业背景。你的任务是：在所有专家完成题目生成后，逐题进行深入分析，并判断每一道题目是否符合高质量人格情境判断测验（SJT）的标准。\n\n"
+        "请依照以下步骤进行审查：\n\n"
+        "【Step 1】题目测量特质判断：\n"
+        "分析该题干与四个选项所共同构成的心理场景，逐步推理其激活的实际心理特质是什么。列出推理路径，判断其是否属于目标特质维度。\n\n"
+        "【Step 2】题干与选项优化建议：\n"
+        "根据你的意见，提出该题目的优化方向：\n"
+        "请从语言表达角度具体指出该题干或选项中存在的问题，并提出两条可直接执行的修改建议。\n"
+        "包括但不限于：\n"
+        "- 哪一句表达不够自然或逻辑跳跃，如何修改更好；\n"
+        "- 是否有语义重复、模糊、啰嗦现象，如何优化；\n"
+        "- 选项是否句式统一，行为风格是否明确。\n"
+        "请确保建议聚焦语言与表达本身，不泛泛而谈构念或策略层面问题。\n"
+        "【最终筛选】\n"
+        "判断该题目是否合格。\n"
+        "如合格，请重新输出完整题干与四个选项；\n"
+        "如不合格，请说明拒绝理由，简述主要问题。\n\n"
+        "所有输出请使用中文，格式规范、语言专业、简洁有力。"
+    ),
+    "backend": {
+        "backend_type": "openai-chat",
+        "temperature": 0.5,
+        "max_tokens": 2048
+    }
+}
 
 
-def run_sjt():
+def load_sjt_config(config_path=DEFAULT_CONFIG_PATH):
     # 加载 SJT 配置文件
-    sjt_config_path = r"E:\博士学习\LLM自适应测验\项目demo\SJT_Agent\examples\sjt.json"
-    with open(sjt_config_path, "r", encoding="utf-8") as f:
-        sjt_config = json.load(f)
-    Self_report = input("请输入自陈内容：")
+    with open(config_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def build_arena(sjt_config, self_report, item_store=None):
+    """根据配置创建 Arena，并插入自陈内容；传入 item_store 时与其他 Arena 共享已生成的题目。"""
     global_prompt = sjt_config["global_prompt"]
-    moderator_config = {
-        "role_desc": (
-            "你是SJT-agent项目的moderator，具有人格心理测评和语言表达评估的专业背景。你的任务是：在所有专家完成题目生成后，逐题进行深入分析，并判断每一道题目是否符合高质量人格情境判断测验（SJT）的标准。\n\n"
-            "请依照以下步骤进行审查：\n\n"
-            "【Step 1】题目测量特质判断：\n"
-            "分析该题干与四个选项所共同构成的心理场景，逐步推理其激活的实际心理特质是什么。列出推理路径，判断其是否属于目标特质维度。\n\n"
-            "【Step 2】题干与选项优化建议：\n"
-            "根据你的意见，提出该题目的优化方向：\n"
-            "请从语言表达角度具体指出该题干或选项中存在的问题，并提出两条可直接执行的修改建议。\n"
-            "包括但不限于：\n"
-            "- 哪一句表达不够自然或逻辑跳跃，如何修改更好；\n"
-            "- 是否有语义重复、模糊、啰嗦现象，如何优化；\n"
-            "- 选项是否句式统一，行为风格是否明确。\n"
-            "请确保建议聚焦语言与表达本身，不泛泛而谈构念或策略层面问题。\n"
-            "【最终筛选】\n"
-            "判断该题目是否合格。\n"
-            "如合格，请重新输出完整题干与四个选项；\n"
-            "如不合格，请说明拒绝理由，简述主要问题。\n\n"
-            "所有输出请使用中文，格式规范、语言专业、简洁有力。"
-        ),
-        "backend": {
-            "backend_type": "openai-chat",
-            "temperature": 0.5,
-            "max_tokens": 2048
-        }
-    }
     player_configs = []
     for i in range(len(sjt_config["players"])):
         player_name = f"Player {i + 1}"
-        role_desc, backend_type, temperature, max_tokens = sjt_config["players"][i]["role_desc"], \
-            sjt_config["players"][i]["backend"]["backend_type"], sjt_config["players"][i]["backend"]["temperature"], \
-            sjt_config["players"][i]["backend"]["max_tokens"]
+        # backend 配置原样传入，便于在 sjt.json 中开启 cache 等选项
         player_config = {
             "name": player_name,
-            "role_desc": role_desc,
-            "backend": {
-                "backend_type": backend_type,
-                "temperature": temperature,
-                "max_tokens": max_tokens
-            },
+            "role_desc": sjt_config["players"][i]["role_desc"],
+            "backend": dict(sjt_config["players"][i]["backend"]),
         }
         player_configs.append(player_config)
 
@@ -61,25 +71,43 @@ def run_sjt():
         "env_type": "SJT_env",
         "parallel": False
     }
-    arena = Arena.from_config(ArenaConfig(players=player_configs, environment=env_config, global_prompt=global_prompt))
+    arena_config = ArenaConfig(players=player_configs, environment=env_config, global_prompt=global_prompt)
+    if "embeddings" in sjt_config:  # 例如 "embeddings": "off"，离线压测时不加载向量模型
+        arena_config["embeddings"] = sjt_config["embeddings"]
+    arena = Arena.from_config(arena_config)
+    if item_store is not None:
+        # 候选挑选时避开整批运行中已生成的题目，而不只是本条记录内的
+        arena.environment.message_pool.item_store = item_store
     arena.environment.message_pool.append_message(
-        Message(agent_name="player 1", content=Self_report, turn=0, visible_to="player 1")
+        Message(agent_name=SELF_REPORT_NAME, content=self_report, turn=0, visible_to="player 1")
     )
-    # 让每个专家各发言一次
-    arena.run(num_steps=len(player_configs))
+    return arena
+
+
+def split_content(content):
+    """把消息或 query 的返回值拆成 (主要内容, 反思记录)；消息的反思记录在 trace 中。"""
+    if isinstance(content, Message):
+        return content.content, content.trace
+    if isinstance(content, tuple):
+        return content[0], content[1]
+    return content, None
+
+
+def run_sjt(config_path=DEFAULT_CONFIG_PATH):
+    sjt_config = load_sjt_config(config_path)
+    Self_report = input("请输入自陈内容：")
+    global_prompt = sjt_config["global_prompt"]
+    arena = build_arena(sjt_config, Self_report)
+    # 让每个专家各发言一次；结束后关闭 arena，停止其线程池和消息池的向量化线程
+    with arena:
+        arena.run(num_steps=len(arena.players))
 
     # 收集所有历史消息（题目内容）
     messages = arena.environment.get_observation()
     print("=" * 30 + " SJT 专家生成题目历史 " + "=" * 30)
     for msg in messages:
         print(f"第{getattr(msg, 'turn', '?')}轮 [{msg.agent_name}]：")
-        content = msg.content
-        round_records = None
-        if isinstance(content, tuple):
-            main_content = content[0]
-            round_records = content[1]
-        else:
-            main_content = content
+        main_content, round_records = split_content(msg)
         print(main_content)
         if round_records:
             print("🧠 Agent 反思过程")
@@ -89,30 +117,184 @@ def run_sjt():
                     print(f"{k}: {v}")
                 print("-" * 30)
 
-    moderator_backend = load_backend(BackendConfig(**moderator_config["backend"]))
+    moderator_backend = load_backend(BackendConfig(**MODERATOR_CONFIG["backend"]))
     moderator_output = moderator_backend.query(
         agent_name="Moderator",
-        role_desc=moderator_config["role_desc"],
+        role_desc=MODERATOR_CONFIG["role_desc"],
         history_messages=messages,
         ques=None,
         global_prompt=global_prompt
     )
     print("\n" + "=" * 30 + " Moderator 构念筛查报告 " + "=" * 30)
-    if isinstance(moderator_output, tuple):
-        main_content = moderator_output[0]
-        round_records = moderator_output[1]
-    else:
-        main_content = moderator_output
-        round_records = None
+    main_content, round_records = split_content(moderator_output)
     print(main_content)
 
-    # 保存为txt
-    with open("sjt_dialog_history.txt", "w", encoding="utf-8") as f:
-        for msg in messages:
-            f.write(f"第{getattr(msg, 'turn', '?')}轮 [{msg.agent_name}]：{msg.content}\n")
-        f.write("\n" + "=" * 30 + " Moderator 构念筛查报告 " + "=" * 30 + "\n")
-        f.write(str(moderator_output) + "\n")
+    # 保存为txt（每个对话单独一个文件）
+    log_writer = get_log_writer()
+    history_path = conversation_log_path(
+        "sjt_dialog_history.txt", arena.environment.message_pool.conversation_id
+    )
+    for msg in messages:
+        log_writer.write(history_path, f"第{getattr(msg, 'turn', '?')}轮 [{msg.agent_name}]：{msg.content}\n")
+    log_writer.write(history_path, "\n" + "=" * 30 + " Moderator 构念筛查报告 " + "=" * 30 + "\n")
+    log_writer.write(history_path, main_content + "\n")
+    log_writer.flush()
+    print(f"对话历史已保存到 {history_path}")
+
+
+def read_self_reports(input_path):
+    """
+    逐条读取自陈内容，不把整个文件读入内存。
+
+    支持 JSONL（每行一个含 "self_report" 字段的对象，或直接是字符串）和 CSV（需有 self_report 列）。
+    可选的 "id" 字段作为记录编号，缺省时使用行号。
+    """
+    with open(input_path, "r", encoding="utf-8", newline="") as f:
+        if input_path.endswith(".csv"):
+            for i, row in enumerate(csv.DictReader(f)):
+                yield str(row.get("id") or i), row["self_report"]
+        else:
+            for i, line in enumerate(f):
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if isinstance(record, str):
+                    yield str(i), record
+                else:
+                    yield str(record.get("id", i)), record["self_report"]
+
+
+def completed_ids(output_path):
+    """已成功写入输出文件的记录编号，用于断点续跑。"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:  # 崩溃时写了一半的最后一行
+                continue
+            if "error" not in result:
+                done.add(str(result["id"]))
+    return done
+
+
+async def run_one_async(sjt_config, record_id, self_report, item_store=None):
+    """异步运行一条自陈内容的完整流程，返回可写入 JSONL 的结果。"""
+    arena = build_arena(sjt_config, self_report, item_store)
+    # 每条记录一个 arena，用完即关闭，批量运行时不会积累线程
+    with metrics_labels(item=record_id), arena:
+        await arena.async_run(num_steps=len(arena.players))
+        messages = arena.environment.get_observation()
+
+        moderator_backend = load_backend(BackendConfig(**MODERATOR_CONFIG["backend"]))
+        moderator_output = await moderator_backend.async_query(
+            agent_name="Moderator",
+            role_desc=MODERATOR_CONFIG["role_desc"],
+            history_messages=messages,
+            ques=None,
+            global_prompt=sjt_config["global_prompt"]
+        )
+
+    history = []
+    for msg in messages:
+        content, round_records = split_content(msg)
+        history.append({
+            "turn": msg.turn,
+            "agent_name": msg.agent_name,
+            "content": content,
+            "round_records": round_records,
+        })
+    moderator_content, moderator_records = split_content(moderator_output)
+    return {
+        "id": record_id,
+        "self_report": self_report,
+        "history": history,
+        "moderator": moderator_content,
+        "moderator_round_records": moderator_records,
+        # 本条记录各阶段（answer/reflection/revision）的调用次数、token 与耗时
+        "metrics": get_metrics().summary(by=("player", "phase"), item=record_id),
+    }
+
+
+async def run_batch(input_path, output_path, config_path=DEFAULT_CONFIG_PATH,
+                    concurrency=DEFAULT_CONCURRENCY, resume=True):
+    """
+    批量运行：从 JSONL/CSV 流式读取自陈内容，最多同时运行 concurrency 个 Arena。
+
+    每条结果完成后立即追加写入 output_path；resume=True 时跳过输出文件中已成功完成的记录。
+    """
+    sjt_config = load_sjt_config(config_path)
+    done = completed_ids(output_path) if resume else set()
+    if done:
+        print(f"跳过已完成的 {len(done)} 条记录", file=sys.stderr)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    # 整批共享：每条记录的候选都与之前各条生成的题目比较多样性
+    item_store = ItemStore()
+    start = time.monotonic()
+    finished = failed = 0
+    tasks = set()
+
+    batch_id = time.strftime("%Y%m%d-%H%M%S")
+    # 批量请求走低优先级通道，网页等交互式请求可以插队
+    with request_lane("batch"), metrics_labels(batch=batch_id), \
+            open(output_path, "a" if resume else "w", encoding="utf-8") as out:
+
+        async def worker(record_id, self_report):
+            nonlocal finished, failed
+            try:
+                result = await run_one_async(sjt_config, record_id, self_report, item_store)
+            except Exception as e:  # 单条失败不影响整个批次，续跑时会重试
+                failed += 1
+                result = {"id": record_id, "self_report": self_report, "error": repr(e)}
+            finally:
+                semaphore.release()
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            finished += 1
+            rate = finished / max(time.monotonic() - start, 1e-9) * 60
+            print(f"[{finished} 完成, {failed} 失败] {record_id}  {rate:.1f} 条/分钟", file=sys.stderr)
+
+        for record_id, self_report in read_self_reports(input_path):
+            if record_id in done:
+                continue
+            # 先占用并发名额再创建任务，避免一次性为整个文件创建任务
+            await semaphore.acquire()
+            task = asyncio.ensure_future(worker(record_id, self_report))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    elapsed = time.monotonic() - start
+    print(f"共完成 {finished} 条（失败 {failed} 条），用时 {elapsed:.1f}s，"
+          f"{finished / max(elapsed, 1e-9) * 60:.1f} 条/分钟", file=sys.stderr)
+    print("各阶段调用统计：", file=sys.stderr)
+    for phase, totals in sorted(get_metrics().summary(by=("phase",), batch=batch_id).items()):
+        print(f"  {phase}: {json.dumps(totals, ensure_ascii=False)}", file=sys.stderr)
+    overall = get_metrics().summary(by=(), batch=batch_id).get("")
+    if overall:
+        print(f"提示词缓存命中：{overall['cached_tokens']}/{overall['prompt_tokens']} tokens "
+              f"({overall['cached_token_rate']:.1%})", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="运行 SJT 多专家题目生成流程")
+    parser.add_argument("--config", default=DEFAULT_CONFIG_PATH, help="SJT 配置文件路径")
+    parser.add_argument("--batch", metavar="INPUT", help="批量模式：自陈内容的 JSONL 或 CSV 文件")
+    parser.add_argument("--output", default="sjt_results.jsonl", help="批量模式的输出 JSONL 文件")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="批量模式下同时运行的 Arena 数")
+    parser.add_argument("--no-resume", action="store_true", help="不跳过输出文件中已完成的记录，重新开始")
+    args = parser.parse_args()
+
+    if args.batch:
+        asyncio.run(run_batch(args.batch, args.output, config_path=args.config,
+                              concurrency=args.concurrency, resume=not args.no_resume))
+    else:
+        run_sjt(args.config)
 
 
 if __name__ == "__main__":
-    run_sjt()
+    main()
@@ -0,0 +1,44 @@
+from unittest import TestCase
+
+from chatarena.backends.openai import ChatRequest, OpenAIChat
+from chatarena.message import SELF_REPORT_NAME, ItemStore, Message, MessagePool
+
+HASHING_MODELS = {"qa": "hashing:256", "sym": "hashing:256"}
+
+PREVIOUS_ITEM = "情境：你的同事在项目截止前拒绝合作。A. 直接向领导汇报 B. 私下沟通原因 C. 自己完成 D. 暂不处理"
+NEAR_DUPLICATE = "情境：你的同事在项目截止前拒绝配合。A. 直接向领导汇报 B. 私下沟通原因 C. 自己完成 D. 暂不处理"
+NEW_ITEM = "情境：客户当众投诉你的服务态度。A. 立即道歉 B. 解释原因 C. 请主管处理 D. 事后回访"
+
+
+class TestCandidateSelection(TestCase):
+    def setUp(self):
+        self.backend = OpenAIChat(num_candidates=2, candidate_diversity=0.5)
+        self.request = ChatRequest("answer", [{"role": "user", "content": "请根据以上信息，给出你的回答。"}], n=2,
+                                   query="请设计一道关于同事在项目中拒绝合作的情境判断题")
+
+    def test_near_duplicate_of_previous_item_loses(self):
+        item_store = ItemStore()
+        with MessagePool(embedding_models=HASHING_MODELS, item_store=item_store) as previous_run:
+            previous_run.append_message(Message(agent_name="Player 3", content=PREVIOUS_ITEM, turn=1))
+            item_store.add("Player 3", PREVIOUS_ITEM)
+        with MessagePool(embedding_models=HASHING_MODELS, item_store=item_store) as pool:
+            pool.append_message(Message(agent_name=SELF_REPORT_NAME, content="我做事有条理", turn=0))
+            for candidates in ([NEAR_DUPLICATE, NEW_ITEM], [NEW_ITEM, NEAR_DUPLICATE]):
+                selected = self.backend._select_candidate(self.request, candidates, "Player 3", pool)
+                self.assertEqual(selected, NEW_ITEM)
+
+    def test_upstream_messages_are_not_penalized(self):
+        with MessagePool(embedding_models=HASHING_MODELS) as pool:
+            # An upstream expert's draft is input to build on, not a previous item
+            pool.append_message(Message(agent_name="Player 2", content=PREVIOUS_ITEM, turn=1))
+            request = self.request._replace(query=PREVIOUS_ITEM)
+            selected = self.backend._select_candidate(request, [NEW_ITEM, NEAR_DUPLICATE], "Player 3", pool)
+            self.assertEqual(selected, NEAR_DUPLICATE)
+
+    def test_relevance_uses_the_latest_request_message(self):
+        steps = self.backend._reflection_steps(
+            "Player 3", "role", [Message(agent_name="Player 1", content="很早的讨论" * 200, turn=1)], None,
+            request_msg="请围绕客户投诉设计题目",
+        )
+        (request,) = next(steps)
+        self.assertEqual(request.query, "请围绕客户投诉设计题目")
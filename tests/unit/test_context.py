@@ -0,0 +1,54 @@
+from unittest import TestCase
+
+from chatarena.backends.context import message_tokens, select_context
+from chatarena.message import SELF_REPORT_NAME, Message
+
+from run_sjt import build_arena, load_sjt_config
+
+SELF_REPORT = "我做事有条理，喜欢提前规划，和同事合作时会主动沟通。"
+TURNS = 40
+BUDGET = 800
+
+
+class TestSelectContextOnSJTRun(TestCase):
+    def setUp(self):
+        sjt_config = dict(load_sjt_config(), embeddings="off")
+        self.arena = build_arena(sjt_config, SELF_REPORT)
+        self.pool = self.arena.environment.message_pool
+        # Many relevant, important player outputs, as a long run accumulates them: ranked on
+        # merit they would crowd out the short role prompts
+        for turn in range(TURNS):
+            player = self.arena.players[turn % 2]
+            self.pool.append_message(Message(
+                agent_name=player.name, content=f"第 {turn} 轮：{SELF_REPORT}对应尽责性，可设计团队协作情境。",
+                turn=turn, importance=5,
+            ))
+
+    def tearDown(self):
+        self.pool.close()
+
+    def assert_setup_kept(self, history):
+        self.assertGreater(sum(message_tokens(m) for m in history), BUDGET)
+        kept, summary = select_context(history, BUDGET, query=SELF_REPORT, msgs=self.pool)
+
+        self.assertIsNotNone(summary)
+        self.assertLess(len(kept), len(history))
+        setup = [m for m in history if m.turn < 0 or m.agent_name == SELF_REPORT_NAME]
+        self.assertTrue(setup)
+        for message in setup:
+            self.assertIn(message, kept)
+        # Only player outputs are dropped, the oldest before the newest
+        outputs = [m for m in history if m not in setup]
+        self.assertIn(outputs[-1], kept)
+        self.assertNotIn(outputs[0], kept)
+
+    def test_player_history_keeps_its_role_prompt(self):
+        # What get_observation returns once the environment has reached the last turn
+        history = self.pool.get_visible_messages(self.arena.players[0].name, turn=TURNS)
+        self.assertTrue(any(m.turn < 0 for m in history))
+        self.assert_setup_kept(history)
+
+    def test_full_transcript_keeps_self_report_and_role_prompts(self):
+        history = self.pool.get_all_messages()
+        self.assertTrue(any(m.agent_name == SELF_REPORT_NAME for m in history))
+        self.assert_setup_kept(history)
@@ -0,0 +1,33 @@
+from unittest import TestCase
+
+from chatarena.message import Message, MessagePool
+
+HASHING_MODELS = {"qa": "hashing:64", "sym": "hashing:64"}
+
+
+class TestMessagePool(TestCase):
+    def setUp(self):
+        self.pool = MessagePool(embedding_models=HASHING_MODELS)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_pop_message_then_search(self):
+        self.pool.append_message(Message(agent_name="Player 1", content="团队冲突情境", turn=0))
+        self.pool.append_message(Message(agent_name="Player 2", content="客户投诉情境", turn=1, trace=[{"round": 1}]))
+        self.assertEqual(len(self.pool.get_new_messages("Player 3")), 2)
+
+        popped = self.pool.pop_message()
+        self.assertEqual(popped.content, "客户投诉情境")
+        self.assertEqual(popped.trace, [{"round": 1}])
+        self.assertEqual(len(self.pool.trace_store), 0)
+        results = self.pool.search("客户投诉情境", k=5)
+        self.assertEqual([message.content for message, _ in results], ["团队冲突情境"])
+        self.assertEqual(self.pool.get_visible_messages("Player 3", turn=5), self.pool.get_all_messages())
+
+        replacement = Message(agent_name="Player 2", content="客户投诉情境（修改）", turn=1)
+        self.pool.append_message(replacement)
+        self.assertEqual(self.pool.get_new_messages("Player 3"), [replacement])
+        results = self.pool.search("客户投诉情境（修改）", k=1)
+        self.assertIs(results[0][0], replacement)
+        self.assertAlmostEqual(results[0][1], 1.0, places=5)
@@ -1,11 +1,13 @@
-from flask import Flask, render_template, request
+from flask import Flask, Response, render_template, request, stream_with_context
 from chatarena.arena import Arena
 from chatarena.config import ArenaConfig
-from chatarena.message import Message
+from chatarena.embeddings import get_model, resolve_models
+from chatarena.message import SELF_REPORT_NAME, Message
+from chatarena.metrics import get_metrics
 import os
 import json
 
-def run_sjt_web(self_report, reflection_on=True):
+def build_web_arena(self_report):
     SJT_CONFIG_PATH = os.path.join(os.path.dirname(__file__), "../examples/sjt.json")
     with open(SJT_CONFIG_PATH, "r", encoding="utf-8") as f:
         sjt_config = json.load(f)
@@ -34,32 +36,35 @@ def run_sjt_web(self_report, reflection_on=True):
     arena = Arena.from_config(ArenaConfig(players=player_configs, environment=env_config, global_prompt=global_prompt))
     # 插入自陈内容
     arena.environment.message_pool.append_message(
-        Message(agent_name="Self_report", content=self_report, turn=0)
+        Message(agent_name=SELF_REPORT_NAME, content=self_report, turn=0)
     )
+    return arena
+
+
+def player1_query_kwargs(arena, reflection_on=True):
     player1 = arena.players[0]
-    observation = arena.environment.get_observation(player1.name)
-    if reflection_on:
-        final_response, round_records = player1.backend.query(
-            agent_name=player1.name,
-            role_desc=player1.role_desc,
-            history_messages=observation,
-            ques=arena.environment.question_pool,
-            global_prompt=player1.global_prompt,
-            msgs=arena.environment.message_pool
-        )
-    else:
-        final_response, round_records = player1.backend.query(
-            agent_name=player1.name,
-            role_desc=player1.role_desc,
-            history_messages=observation,
-            ques=None,
-            global_prompt=player1.global_prompt,
-            msgs=arena.environment.message_pool
-        )
+    return dict(
+        agent_name=player1.name,
+        role_desc=player1.role_desc,
+        history_messages=arena.environment.get_observation(player1.name),
+        ques=arena.environment.question_pool if reflection_on else None,
+        global_prompt=player1.global_prompt,
+        msgs=arena.environment.message_pool
+    )
+
+
+def run_sjt_web(self_report, reflection_on=True):
+    arena = build_web_arena(self_report)
+    with arena.environment.message_pool:  # 每个请求一个消息池，用完关闭
+        final_response, round_records = arena.players[0].backend.query(**player1_query_kwargs(arena, reflection_on))
     return final_response, round_records
 
 app = Flask(__name__)
 
+# 预加载嵌入模型：所有请求共享同一份权重，避免每次请求重新加载
+for model_name in resolve_models().values():
+    get_model(model_name)
+
 @app.route("/", methods=["GET", "POST"])
 def index():
     result = ""
@@ -73,5 +78,41 @@ def index():
             result, round_records = run_sjt_web(self_report, reflection_on)
     return render_template("index.html", result=result, self_report=self_report, reflection_on=reflection_on, round_records=round_records)
 
+@app.route("/metrics")
+def metrics():
+    """Prometheus 格式的 LLM 调用统计（调用次数、token、重试、耗时）。"""
+    return Response(get_metrics().prometheus_text(), mimetype="text/plain; version=0.0.4")
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.route("/stream")
+def stream():
+    """以 Server-Sent Events 推送生成过程：delta 事件为新生成的文本，done 事件为最终结果。"""
+    self_report = request.args.get("self_report", "")
+    reflection_on = request.args.get("reflection_on", "on") == "on"
+
+    def generate():
+        if not self_report.strip():
+            yield sse_event("error", {"message": "自陈内容不能为空"})
+            return
+        arena = build_web_arena(self_report)
+        with arena.environment.message_pool:
+            response_stream = arena.players[0].backend.stream(**player1_query_kwargs(arena, reflection_on))
+            try:
+                for delta in response_stream:
+                    yield sse_event("delta", {"phase": delta.phase, "text": delta.text})
+            except Exception as e:
+                yield sse_event("error", {"message": str(e)})
+                return
+        final_response, round_records = response_stream.result
+        yield sse_event("done", {"result": final_response, "round_records": round_records})
+
+    # 关闭代理缓冲，保证文本逐段到达浏览器
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 if __name__ == "__main__":
     app.run(debug=True) 
\ No newline at end of file